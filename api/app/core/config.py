@@ -8,10 +8,83 @@ class Settings(BaseSettings):
     database_url: str = "sqlite:///./data/cope.db"
     qdrant_url: str = "http://localhost:6333"
     qdrant_collection: str = "pdf_chunks"
+    qdrant_timeout: int = 10
+    qdrant_pool_max_connections: int = 10
+    qdrant_retry_seconds: float = 30.0
+    local_vectors_enabled: bool = True
+    local_vectors_dtype: str = "float16"
+    local_vectors_block_rows: int = 65536
+    local_vectors_compact_min_rows: int = 1024
     ollama_url: str = "http://localhost:11434"
     ollama_chat_model: str = "llama3.1"
     ollama_embedding_model: str = "nomic-embed-text"
+    ollama_embed_batch_size: int = 32
+    ollama_embed_concurrency: int = 4
+    ollama_pool_max_connections: int = 20
+    ollama_pool_max_keepalive: int = 10
+    ollama_pool_keepalive_expiry: float = 30.0
+    ollama_pool_timeout: float = 10.0
+    ollama_connect_timeout: float = 5.0
+    ollama_probe_read_timeout: float = 5.0
+    ollama_chat_read_timeout: float = 120.0
+    ollama_embed_read_timeout: float = 60.0
+    ollama_breaker_failure_threshold: int = 3
+    ollama_breaker_reset_seconds: float = 15.0
+    ollama_health_ttl_seconds: float = 5.0
+    ollama_health_interval_seconds: float = 5.0
+    ollama_keep_alive: str = "10m"
+    ollama_warmup_on_startup: bool = True
+    ollama_warm_keep_alive: str = "30m"
+    ollama_warm_interval_seconds: float = 240.0
+    ollama_warm_models_max: int = 2
+    ollama_warm_lookback_days: int = 7
+    ollama_class_days: str = "0,1,2,3,4"
+    ollama_class_hours: str = "08:00-18:00"
+    ollama_cold_start_threshold_ms: float = 500.0
+    embedding_cache_enabled: bool = True
+    embedding_cache_max_entries: int = 200_000
+    rag_cache_max_entries: int = 1024
+    rag_cache_ttl_seconds: float = 600.0
+    retrieve_budget_ms: int = 1500
+    retrieve_rrf_k: int = 60
+    retrieve_candidates_factor: int = 4
+    mmr_lambda: float = 0.7
+    answer_cache_enabled: bool = False
+    answer_cache_threshold: float = 0.95
+    answer_cache_max_entries: int = 512
+    answer_cache_ttl_seconds: float = 3600.0
     storage_root: str = "./data"
+    context_max_tokens: int = 8192
+    context_answer_tokens: int = 1024
+    context_system_tokens: int = 512
+    context_sources_tokens: int = 2048
+    context_history_max_messages: int = 40
+    context_chars_per_token: float = 4.0
+    sse_coalesce_ms: int = 0
+    sse_coalesce_max_chars: int = 256
+    trace_sync: bool = False
+    trace_batch_size: int = 100
+    trace_flush_interval_seconds: float = 1.0
+    trace_max_retries: int = 3
+    trace_max_pending: int = 10000
+    upload_chunk_size: int = 1024 * 1024
+    pdf_extract_workers: int = 2
+    pdf_parallel_min_pages: int = 16
+    pdf_pages_per_task: int = 8
+    chunker: str = "structured"
+    chunk_target_tokens: int = 200
+    chunk_max_tokens: int = 320
+    chunk_overlap_sentences: int = 0
+    ingest_batch_size: int = 0
+    ingest_queue_size: int = 4
+    ingest_batch_retries: int = 3
+    ingest_retry_backoff_seconds: float = 1.0
+    ingest_max_concurrency: int = 2
+    ingest_interactive_max_wait_seconds: float = 30.0
+    ingest_poll_interval_seconds: float = 5.0
+    ingest_max_attempts: int = 5
+    ingest_requeue_delay_seconds: float = 60.0
+    ingest_progress_interval_seconds: float = 1.0
 
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
@@ -0,0 +1,90 @@
+import json
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+
+# Colonnes ajoutées après la création initiale des tables (create_all ne modifie pas les tables existantes)
+ADDED_COLUMNS = [
+    ("pdf_documents", "sha256", "VARCHAR(64)"),
+    ("conversations", "owner_id", "INTEGER REFERENCES users(id)"),
+]
+
+ADDED_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_pdf_documents_sha256 ON pdf_documents (sha256)",
+    "CREATE INDEX IF NOT EXISTS ix_conversations_owner_updated ON conversations (owner_id, updated_at)",
+]
+
+
+def _backfill_conversation_owners(conn: Connection):
+    # Propriétaire historique = auteur de l'événement conversation_create
+    rows = conn.execute(
+        text("SELECT user_id, payload FROM trace_events WHERE event_type = 'conversation_create' ORDER BY id")
+    )
+    for user_id, payload in rows.fetchall():
+        if isinstance(payload, str):
+            try:
+                payload = json.loads(payload)
+            except ValueError:
+                continue
+        conversation_id = (payload or {}).get("conversation_id")
+        if conversation_id:
+            conn.execute(
+                text("UPDATE conversations SET owner_id = :owner WHERE id = :id AND owner_id IS NULL"),
+                {"owner": user_id, "id": int(conversation_id)},
+            )
+
+
+def _backfill_user_daily_stats(conn: Connection):
+    totals: dict[tuple, list[int]] = {}
+    rows = conn.execution_options(yield_per=1000).execute(
+        text("SELECT user_id, event_type, payload, created_at FROM trace_events")
+    )
+    for user_id, event_type, payload, created_at in rows:
+        if isinstance(payload, str):
+            try:
+                payload = json.loads(payload)
+            except ValueError:
+                payload = {}
+        if isinstance(created_at, str):
+            created_at = datetime.fromisoformat(created_at)
+        row = totals.setdefault((user_id, created_at.date().isoformat(), event_type), [0, 0])
+        row[0] += 1
+        row[1] += int(bool((payload or {}).get("has_citations")))
+    if totals:
+        conn.execute(
+            text(
+                "INSERT INTO user_daily_stats (user_id, day, event_type, count, citations) "
+                "VALUES (:user_id, :day, :event_type, :count, :citations)"
+            ),
+            [
+                {"user_id": u, "day": d, "event_type": t, "count": count, "citations": citations}
+                for (u, d, t), (count, citations) in totals.items()
+            ],
+        )
+
+
+# Migrations de données à exécuter une seule fois, dans l'ordre
+DATA_MIGRATIONS = [
+    ("backfill_conversation_owners", _backfill_conversation_owners),
+    ("backfill_user_daily_stats", _backfill_user_daily_stats),
+]
+
+
+def run_migrations(engine: Engine):
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table, column, ddl in ADDED_COLUMNS:
+            existing = {c["name"] for c in inspector.get_columns(table)}
+            if column not in existing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+        for statement in ADDED_INDEXES:
+            conn.execute(text(statement))
+
+        conn.execute(text("CREATE TABLE IF NOT EXISTS schema_migrations (name VARCHAR(255) PRIMARY KEY)"))
+        applied = {name for (name,) in conn.execute(text("SELECT name FROM schema_migrations"))}
+        for name, migrate in DATA_MIGRATIONS:
+            if name not in applied:
+                migrate(conn)
+                conn.execute(text("INSERT INTO schema_migrations (name) VALUES (:name)"), {"name": name})
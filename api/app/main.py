@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 from fastapi import FastAPI
@@ -7,9 +8,36 @@ from fastapi.staticfiles import StaticFiles
 
 from app.core.config import settings
 from app.core.database import Base, engine
+from app.core.migrations import run_migrations
 from app.routers import artifacts, auth, chat, dashboard, library, system
+from app.services import ingestion, ollama, rag, warmup
+from app.services.tracing import trace_writer
 
-app = FastAPI(title=settings.app_name)
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    trace_writer.start()
+    await ollama.start_http_client()
+    await ollama.start_health_monitor()
+    await warmup.start_scheduler()
+    await rag.start_qdrant()
+    await rag.sync_lexical_index()
+    await rag.sync_local_vectors()
+    rag.start_extraction_pool()
+    await ingestion.start_worker()
+    try:
+        yield
+    finally:
+        await ingestion.stop_worker()
+        rag.close_extraction_pool()
+        await rag.close_qdrant()
+        await warmup.stop_scheduler()
+        await ollama.stop_health_monitor()
+        await ollama.close_http_client()
+        trace_writer.stop()
+
+
+app = FastAPI(title=settings.app_name, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,6 +49,7 @@ app.add_middleware(
 
 Path(settings.storage_root).mkdir(parents=True, exist_ok=True)
 Base.metadata.create_all(bind=engine)
+run_migrations(engine)
 
 app.include_router(auth.router)
 app.include_router(chat.router)
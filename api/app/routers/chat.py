@@ -1,16 +1,24 @@
-import json
+import math
+import time
+
+import orjson
 
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
+from app.core.config import settings
 from app.core.database import SessionLocal, get_db
 from app.core.deps import get_actor_user
 from app.models.entities import Conversation, Message, TraceEvent, User
 from app.schemas.chat import ConversationCreate, MessageIn
-from app.services.ollama import chat_stream, check_ollama, list_models, pull_model
-from app.services.rag import retrieve
-from app.services.tracing import log_event
+from app.services import answer_cache, warmup
+from app.services.circuit import CircuitOpenError
+from app.services.context import build_chat_messages, fit_citations
+from app.services.ingestion import interactive
+from app.services.ollama import breaker, chat_stream, check_ollama, list_models, pull_model
+from app.services.rag import embed_query, retrieve
+from app.services.tracing import discard_events, log_event
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
@@ -46,31 +54,46 @@ def _message_out(msg: Message) -> dict:
     }
 
 
-def _diversify_hits(hits: list[dict], selected_doc_ids: list[int] | None, max_items: int) -> list[dict]:
-    if not hits:
-        return []
-    if not selected_doc_ids or len(selected_doc_ids) <= 1:
-        return hits[:max_items]
-
-    by_doc: dict[int, list[dict]] = {}
-    for h in hits:
-        did = int(h.get("doc_id", -1))
-        by_doc.setdefault(did, []).append(h)
-
-    out: list[dict] = []
-    # one snippet per selected doc first
-    for did in selected_doc_ids:
-        snippets = by_doc.get(int(did)) or []
-        if snippets:
-            out.append(snippets.pop(0))
-    # then fill with remaining best hits
-    if len(out) < max_items:
-        for h in hits:
-            if h not in out:
-                out.append(h)
-            if len(out) >= max_items:
-                break
-    return out[:max_items]
+def _is_first_turn(db: Session, conversation_id: int, current_message_id: int) -> bool:
+    # Le cache de réponses ne s'applique qu'aux questions sans historique (réponse indépendante du fil)
+    earlier = (
+        db.query(Message.id)
+        .filter(Message.conversation_id == conversation_id, Message.id != current_message_id)
+        .first()
+    )
+    return earlier is None
+
+
+def _sse(payload: dict) -> bytes:
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+class _TokenCoalescer:
+    # Regroupe les tokens en trames SSE sur une petite fenêtre (temps ou taille): moins d'écritures réseau
+    def __init__(self, window_ms: int, max_chars: int):
+        self.window = window_ms / 1000
+        self.max_chars = max_chars
+        self.pending: list[str] = []
+        self.pending_chars = 0
+        self.last_flush = time.monotonic()
+
+    def add(self, token: str) -> bytes | None:
+        if self.window <= 0:
+            return _sse({"token": token})
+        self.pending.append(token)
+        self.pending_chars += len(token)
+        if self.pending_chars >= self.max_chars or time.monotonic() - self.last_flush >= self.window:
+            return self.flush()
+        return None
+
+    def flush(self) -> bytes | None:
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return None
+        frame = _sse({"token": "".join(self.pending)})
+        self.pending.clear()
+        self.pending_chars = 0
+        return frame
 
 
 @router.get("/models")
@@ -92,7 +115,13 @@ async def pull_chat_model(payload: dict):
 
 @router.post("/conversations")
 def create_conversation(payload: ConversationCreate, db: Session = Depends(get_db), user: User = Depends(get_actor_user)):
-    conv = Conversation(title=payload.title, mode=payload.mode, type=payload.type, course_id=payload.course_id)
+    conv = Conversation(
+        title=payload.title,
+        mode=payload.mode,
+        type=payload.type,
+        course_id=payload.course_id,
+        owner_id=user.id,
+    )
     db.add(conv)
     db.commit()
     db.refresh(conv)
@@ -102,14 +131,7 @@ def create_conversation(payload: ConversationCreate, db: Session = Depends(get_d
 
 @router.get("/conversations")
 def list_conversations(db: Session = Depends(get_db), user: User = Depends(get_actor_user)):
-    created_ids = [
-        int(e.payload.get("conversation_id"))
-        for e in db.query(TraceEvent).filter(TraceEvent.user_id == user.id, TraceEvent.event_type == "conversation_create").all()
-        if e.payload.get("conversation_id")
-    ]
-    if not created_ids:
-        return []
-    conversations = db.query(Conversation).filter(Conversation.id.in_(created_ids)).order_by(Conversation.updated_at.desc()).all()
+    conversations = db.query(Conversation).filter(Conversation.owner_id == user.id).order_by(Conversation.updated_at.desc()).all()
     return [_conversation_out(c) for c in conversations]
 
 
@@ -129,15 +151,7 @@ def rename_conversation(conversation_id: int, payload: dict, db: Session = Depen
     if not title:
         raise HTTPException(status_code=400, detail="Nouveau titre requis")
 
-    create_events = db.query(TraceEvent).filter(
-        TraceEvent.user_id == user.id,
-        TraceEvent.event_type == "conversation_create",
-    ).all()
-    created_ids = {int(e.payload.get("conversation_id")) for e in create_events if e.payload.get("conversation_id")}
-    if conversation_id not in created_ids:
-        raise HTTPException(status_code=404, detail="Conversation introuvable")
-
-    conv = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+    conv = db.query(Conversation).filter(Conversation.id == conversation_id, Conversation.owner_id == user.id).first()
     if not conv:
         raise HTTPException(status_code=404, detail="Conversation introuvable")
 
@@ -148,25 +162,62 @@ def rename_conversation(conversation_id: int, payload: dict, db: Session = Depen
     return _conversation_out(conv)
 @router.delete("/conversations/{conversation_id}")
 def delete_conversation(conversation_id: int, db: Session = Depends(get_db), user: User = Depends(get_actor_user)):
-    create_events = db.query(TraceEvent).filter(
-        TraceEvent.user_id == user.id,
-        TraceEvent.event_type == "conversation_create",
-    ).all()
-    created_ids = {int(e.payload.get("conversation_id")) for e in create_events if e.payload.get("conversation_id")}
-    if conversation_id not in created_ids:
-        raise HTTPException(status_code=404, detail="Conversation introuvable")
-
-    conv = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+    conv = db.query(Conversation).filter(Conversation.id == conversation_id, Conversation.owner_id == user.id).first()
     if not conv:
         raise HTTPException(status_code=404, detail="Conversation introuvable")
 
     db.query(Message).filter(Message.conversation_id == conversation_id).delete(synchronize_session=False)
-    db.query(TraceEvent).filter(TraceEvent.user_id == user.id, TraceEvent.conversation_id == conversation_id).delete(synchronize_session=False)
+    discard_events(db, db.query(TraceEvent).filter(TraceEvent.user_id == user.id, TraceEvent.conversation_id == conversation_id))
     db.delete(conv)
     db.commit()
 
     log_event(db, user.id, "conversation_delete", {"conversation_id": conversation_id, "pseudo": user.full_name})
     return {"ok": True}
+def _record_turn(
+    conv_id: int,
+    conv_mode: str,
+    user_id: int,
+    user_name: str,
+    payload: MessageIn,
+    answer: str,
+    citations: list[dict],
+    turn_stats: dict,
+    cached: dict | None = None,
+):
+    metadata = {"citations": citations, "model": payload.model}
+    if cached:
+        metadata.update(cached=True, similarity=cached["similarity"])
+    with SessionLocal() as writer_db:
+        writer_db.add(Message(conversation_id=conv_id, role="assistant", content=answer, metadata_json=metadata))
+        writer_db.commit()
+        log_event(
+            writer_db,
+            user_id,
+            "chat_turn",
+            {
+                "conversation_id": conv_id,
+                "has_citations": bool(citations),
+                "prompt_length": len(payload.content),
+                "mode": conv_mode,
+                "model": payload.model,
+                **turn_stats,
+                "cached": bool(cached),
+                "pseudo": user_name,
+            },
+            conversation_id=conv_id,
+        )
+
+
+async def _cached_stream(cached: dict, conv_id: int, conv_mode: str, user_id: int, user_name: str, payload: MessageIn):
+    # Même format SSE qu'une génération: trames "token" puis "done"
+    answer = cached["answer"]
+    step = max(1, settings.sse_coalesce_max_chars)
+    for i in range(0, len(answer), step):
+        yield _sse({"token": answer[i : i + step]})
+    _record_turn(conv_id, conv_mode, user_id, user_name, payload, answer, cached["citations"], {}, cached=cached)
+    yield _sse({"done": True, "citations": cached["citations"], "cached": True})
+
+
 @router.post("/conversations/{conversation_id}/stream")
 async def stream_reply(conversation_id: int, payload: MessageIn, db: Session = Depends(get_db), user: User = Depends(get_actor_user)):
     conv = db.query(Conversation).filter(Conversation.id == conversation_id).first()
@@ -178,76 +229,112 @@ async def stream_reply(conversation_id: int, payload: MessageIn, db: Session = D
     user_id = int(user.id)
     user_name = str(user.full_name)
 
+    try:
+        # Circuit ouvert, ou half_open avec l'appel d'essai déjà en cours: 503 plutôt qu'une erreur dans le flux
+        breaker.check()
+    except CircuitOpenError as exc:
+        raise HTTPException(
+            status_code=503,
+            detail="Ollama surchargé ou indisponible, réessayez dans quelques secondes.",
+            headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+        )
     ok, err = await check_ollama()
     if not ok:
         raise HTTPException(
             status_code=503,
             detail=f"Ollama inaccessible ({err}). Définissez OLLAMA_URL=http://localhost:11434 en local.",
+            headers={"Retry-After": str(math.ceil(settings.ollama_health_interval_seconds))},
         )
 
     user_msg = Message(conversation_id=conv_id, user_id=user_id, role="user", content=payload.content)
     db.add(user_msg)
     db.commit()
 
+    cache_key = None
+    query_vector = None
+    if settings.answer_cache_enabled and _is_first_turn(db, conv_id, user_msg.id):
+        try:
+            query_vector = await embed_query(payload.content)
+            cache_key = answer_cache.cache_key(conv_mode, payload.model, payload.collection_ids, payload.use_rag)
+            cached = answer_cache.lookup(cache_key, query_vector)
+        except Exception:
+            cache_key, cached = None, None
+        if cached:
+            return StreamingResponse(
+                _cached_stream(cached, conv_id, conv_mode, user_id, user_name, payload), media_type="text/event-stream"
+            )
+
     citations = []
     context = ""
     if payload.use_rag:
         try:
             target_k = max(6, len(payload.collection_ids or []) * 2)
-            hits = await retrieve(payload.content, payload.collection_ids, top_k=target_k)
-            hits = _diversify_hits(hits, payload.collection_ids, max_items=target_k)
-            citations = [
-                {"doc_id": h["doc_id"], "title": h["title"], "page": h["page"], "excerpt": h["text"][:280]}
-                for h in hits
-            ]
-            context = "\n\nSources PDF:\n" + "\n".join([f"- {c['title']} p.{c['page']}: {c['excerpt']}" for c in citations])
+            async with interactive():
+                hits = await retrieve(payload.content, payload.collection_ids, top_k=target_k)
+            citations, context = fit_citations(
+                [
+                    {"doc_id": h["doc_id"], "title": h["title"], "page": h["page"], "excerpt": h["text"][:280]}
+                    for h in hits
+                ]
+            )
         except Exception:
             context = "\n\nNote: RAG indisponible (index/embeddings). Réponse sans sources PDF pour ce tour."
-
-    history = db.query(Message).filter(Message.conversation_id == conv_id).order_by(Message.created_at.asc()).all()
-    model_messages = [{"role": "system", "content": MODE_SYSTEM.get(conv_mode, MODE_SYSTEM["exploration_novice"])}]
-    for m in history[-12:]:
-        model_messages.append({"role": m.role, "content": m.content})
-    model_messages[-1]["content"] = payload.content + context + "\nSi plusieurs sources PDF sont sélectionnées, compare-les explicitement. Si aucune source fournie, indique-le explicitement. Termine par auto-évaluation 1-5."
+        if not citations:
+            # Réponse sans sources (RAG en échec ou sans résultat): jamais servie aux questions voisines
+            cache_key = None
+
+    model_messages = build_chat_messages(
+        db,
+        conv_id,
+        MODE_SYSTEM.get(conv_mode, MODE_SYSTEM["exploration_novice"]),
+        user_msg.id,
+        payload.content + context + "\nSi plusieurs sources PDF sont sélectionnées, compare-les explicitement. Si aucune source fournie, indique-le explicitement. Termine par auto-évaluation 1-5.",
+    )
 
     async def event_stream():
-        collected = ""
+        collected: list[str] = []
+        started = time.perf_counter()
+        ttft_ms: float | None = None
+        coalescer = _TokenCoalescer(settings.sse_coalesce_ms, settings.sse_coalesce_max_chars)
         try:
-            async for line in chat_stream(model_messages, model=payload.model):
-                try:
-                    obj = json.loads(line)
-                except json.JSONDecodeError:
-                    continue
-                token = obj.get("message", {}).get("content", "")
-                if token:
-                    collected += token
-                    yield f"data: {json.dumps({'token': token})}\n\n"
-                if obj.get("done"):
-                    with SessionLocal() as writer_db:
-                        ai_msg = Message(
-                            conversation_id=conv_id,
-                            role="assistant",
-                            content=collected,
-                            metadata_json={"citations": citations, "model": payload.model},
-                        )
-                        writer_db.add(ai_msg)
-                        writer_db.commit()
-                        log_event(
-                            writer_db,
+            async with interactive():
+                async for line in chat_stream(model_messages, model=payload.model):
+                    try:
+                        obj = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        continue
+                    token = obj.get("message", {}).get("content", "")
+                    if token:
+                        if ttft_ms is None:
+                            ttft_ms = (time.perf_counter() - started) * 1000
+                        collected.append(token)
+                        frame = coalescer.add(token)
+                        if frame:
+                            yield frame
+                    if obj.get("done"):
+                        frame = coalescer.flush()
+                        if frame:
+                            yield frame
+                        load_ms = (obj.get("load_duration") or 0) / 1e6
+                        cold_start = warmup.record_ttft(ttft_ms or 0.0, load_ms)
+                        answer = "".join(collected)
+                        _record_turn(
+                            conv_id,
+                            conv_mode,
                             user_id,
-                            "chat_turn",
-                            {
-                                "conversation_id": conv_id,
-                                "has_citations": bool(citations),
-                                "prompt_length": len(payload.content),
-                                "mode": conv_mode,
-                                "model": payload.model,
-                                "pseudo": user_name,
-                            },
-                            conversation_id=conv_id,
+                            user_name,
+                            payload,
+                            answer,
+                            citations,
+                            {"ttft_ms": round(ttft_ms or 0.0, 1), "load_ms": round(load_ms, 1), "cold_start": cold_start},
                         )
-                    yield f"data: {json.dumps({'done': True, 'citations': citations})}\n\n"
+                        if cache_key is not None:
+                            answer_cache.store(cache_key, query_vector, answer, citations)
+                        yield _sse({"done": True, "citations": citations})
         except Exception as exc:
-            yield f"data: {json.dumps({'error': f'Échec chat Ollama: {exc}'})}\n\n"
+            frame = coalescer.flush()
+            if frame:
+                yield frame
+            yield _sse({"error": f"Échec chat Ollama: {exc}"})
 
     return StreamingResponse(event_stream(), media_type="text/event-stream")
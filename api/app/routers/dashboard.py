@@ -1,25 +1,30 @@
-from collections import Counter
-
 from fastapi import APIRouter, Depends
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
 from app.core.database import get_db
 from app.core.deps import get_actor_user
-from app.models.entities import Consent, TraceEvent, User
+from app.models.entities import Consent, TraceEvent, User, UserDailyStat
 
 router = APIRouter(prefix="/dashboard", tags=["dashboard"])
 
 
 @router.get("/me")
 def my_progress(db: Session = Depends(get_db), user: User = Depends(get_actor_user)):
-    events = db.query(TraceEvent).filter(TraceEvent.user_id == user.id).all()
-    counts = Counter([e.event_type for e in events])
+    totals = (
+        db.query(UserDailyStat.event_type, func.sum(UserDailyStat.count), func.sum(UserDailyStat.citations))
+        .filter(UserDailyStat.user_id == user.id)
+        .group_by(UserDailyStat.event_type)
+        .all()
+    )
+    counts = {event_type: int(count or 0) for event_type, count, _ in totals}
+    latest = db.query(TraceEvent).filter(TraceEvent.user_id == user.id).order_by(TraceEvent.id.desc()).limit(50).all()
     return {
-        "timeline": [{"type": e.event_type, "at": e.created_at.isoformat(), "payload": e.payload} for e in events[-50:]],
+        "timeline": [{"type": e.event_type, "at": e.created_at.isoformat(), "payload": e.payload} for e in reversed(latest)],
         "metrics": {
             "iterations": counts.get("artifact_iteration", 0),
             "chat_turns": counts.get("chat_turn", 0),
-            "source_usage": sum(1 for e in events if e.payload.get("has_citations")),
+            "source_usage": sum(int(citations or 0) for _, _, citations in totals),
             "metacognition_prompts": counts.get("metacognition", 0),
         },
     }
@@ -27,15 +32,25 @@ def my_progress(db: Session = Depends(get_db), user: User = Depends(get_actor_us
 
 @router.get("/cohort")
 def cohort_progress(db: Session = Depends(get_db), user: User = Depends(get_actor_user)):
-    events = db.query(TraceEvent).all()
+    totals = (
+        db.query(
+            UserDailyStat.user_id,
+            UserDailyStat.event_type,
+            func.sum(UserDailyStat.count),
+            func.sum(UserDailyStat.citations),
+        )
+        .group_by(UserDailyStat.user_id, UserDailyStat.event_type)
+        .having(func.sum(UserDailyStat.count) > 0)
+        .all()
+    )
     by_user = {}
-    for e in events:
-        by_user.setdefault(e.user_id, {"chat_turns": 0, "iterations": 0, "citations": 0})
-        if e.event_type == "chat_turn":
-            by_user[e.user_id]["chat_turns"] += 1
-            by_user[e.user_id]["citations"] += int(bool(e.payload.get("has_citations")))
-        if e.event_type == "artifact_iteration":
-            by_user[e.user_id]["iterations"] += 1
+    for user_id, event_type, count, citations in totals:
+        stats = by_user.setdefault(user_id, {"chat_turns": 0, "iterations": 0, "citations": 0})
+        if event_type == "chat_turn":
+            stats["chat_turns"] += int(count)
+            stats["citations"] += int(citations or 0)
+        if event_type == "artifact_iteration":
+            stats["iterations"] += int(count)
     return by_user
 
 
@@ -1,26 +1,22 @@
-from pathlib import Path
+import asyncio
 
-from fastapi import APIRouter, BackgroundTasks, Depends, File, Form, HTTPException, UploadFile
+from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
 from sqlalchemy.orm import Session
 
-from app.core.config import settings
-from app.core.database import SessionLocal, get_db
+from app.core.database import get_db
 from app.core.deps import get_actor_user
-from app.models.entities import PdfDocument, User
+from app.models.entities import IngestionJob, PdfDocument, User
 from app.schemas.pdf import PdfOut
-from app.services.rag import ingest_document, remove_document_chunks
+from app.services import ingestion
+from app.services.rag import clone_document_chunks, remove_document_chunks
+from app.services.storage import pdf_path, store_upload
 from app.services.tracing import log_event
 
 router = APIRouter(prefix="/library", tags=["library"])
 
 
-def _pdf_storage_path(filename: str) -> Path:
-    return Path(settings.storage_root) / "pdfs" / filename
-
-
 @router.post("/upload", response_model=PdfOut)
 async def upload_pdf(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     title: str = Form(...),
     tags: str = Form(""),
@@ -30,10 +26,7 @@ async def upload_pdf(
 ):
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Seuls les PDF sont autorisés")
-    storage = Path(settings.storage_root) / "pdfs"
-    storage.mkdir(parents=True, exist_ok=True)
-    target = storage / file.filename
-    target.write_bytes(await file.read())
+    sha256, target = await store_upload(file)
 
     doc = PdfDocument(
         title=title,
@@ -42,29 +35,41 @@ async def upload_pdf(
         course_id=course_id,
         uploaded_by_id=user.id,
         status="processing",
+        sha256=sha256,
     )
+    source_id = await asyncio.to_thread(_add_document, db, doc)
+
+    # Mêmes octets déjà ingérés: on réutilise leurs chunks sans extraction ni embeddings
+    clone = await clone_document_chunks(source_id, doc.id, title) if source_id else None
+    await asyncio.to_thread(_finish_upload, db, doc, target, clone)
+    await asyncio.to_thread(
+        log_event, db, user.id, "pdf_upload", {"doc_id": doc.id, "title": title, "deduplicated": clone is not None}
+    )
+    return doc
+
+
+def _add_document(db: Session, doc: PdfDocument) -> int | None:
+    # Insère le document et renvoie l'id d'un document prêt aux octets identiques
     db.add(doc)
     db.commit()
     db.refresh(doc)
+    source = (
+        db.query(PdfDocument)
+        .filter(PdfDocument.sha256 == doc.sha256, PdfDocument.status == "ready", PdfDocument.id != doc.id)
+        .order_by(PdfDocument.id.desc())
+        .first()
+    )
+    return source.id if source else None
 
-    async def _ingest(doc_id: int):
-        inner_db = SessionLocal()
-        try:
-            d = inner_db.query(PdfDocument).filter(PdfDocument.id == doc_id).first()
-            try:
-                await ingest_document(doc_id, target, title)
-                if d:
-                    d.status = "ready"
-            except Exception:
-                if d:
-                    d.status = "failed"
-            inner_db.commit()
-        finally:
-            inner_db.close()
-
-    background_tasks.add_task(_ingest, doc.id)
-    log_event(db, user.id, "pdf_upload", {"doc_id": doc.id, "title": title})
-    return doc
+
+def _finish_upload(db: Session, doc: PdfDocument, target, clone: dict | None):
+    if clone is not None:
+        doc.status = "ready"
+        db.commit()
+        db.refresh(doc)
+    if clone is None or not clone["complete"]:
+        # Pas de copie, ou points Qdrant non copiés (chunks marqués non indexés): le worker complète
+        ingestion.enqueue(db, doc.id, target, doc.title)
 
 
 @router.get("/documents", response_model=list[PdfOut])
@@ -72,6 +77,16 @@ def list_docs(db: Session = Depends(get_db), user: User = Depends(get_actor_user
     return db.query(PdfDocument).order_by(PdfDocument.created_at.desc()).all()
 
 
+@router.get("/documents/{doc_id}/progress")
+def doc_progress(doc_id: int, db: Session = Depends(get_db), user: User = Depends(get_actor_user)):
+    doc = db.query(PdfDocument).filter(PdfDocument.id == doc_id).first()
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document introuvable")
+    job = db.query(IngestionJob).filter(IngestionJob.doc_id == doc_id).order_by(IngestionJob.id.desc()).first()
+    progress = ingestion.job_progress(job) if job else {}
+    return {"doc_id": doc.id, "status": doc.status, **progress}
+
+
 @router.patch("/documents/{doc_id}", response_model=PdfOut)
 def rename_doc(doc_id: int, payload: dict, db: Session = Depends(get_db), user: User = Depends(get_actor_user)):
     title = (payload.get("title") or "").strip()
@@ -87,6 +102,47 @@ def rename_doc(doc_id: int, payload: dict, db: Session = Depends(get_db), user:
     return doc
 
 
+@router.put("/documents/{doc_id}/file", response_model=PdfOut)
+async def replace_pdf(
+    doc_id: int,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    user: User = Depends(get_actor_user),
+):
+    if not file.filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Seuls les PDF sont autorisés")
+    doc = db.query(PdfDocument).filter(PdfDocument.id == doc_id).first()
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document introuvable")
+    old_path = pdf_path(doc)
+    old_sha256 = doc.sha256
+    sha256, target = await store_upload(file)
+    if sha256 == old_sha256:
+        # Même fichier: relance seulement si la dernière ingestion a échoué
+        if ingestion.last_job_failed(db, doc.id):
+            ingestion.enqueue(db, doc.id, target, doc.title)
+        return doc
+
+    doc.filename = file.filename
+    doc.sha256 = sha256
+    doc.status = "processing"
+    db.commit()
+    db.refresh(doc)
+    shared = bool(old_sha256) and (
+        db.query(PdfDocument).filter(PdfDocument.sha256 == old_sha256, PdfDocument.id != doc.id).count() > 0
+    )
+    if old_path.exists() and old_path != target and not shared:
+        try:
+            old_path.unlink()
+        except Exception:
+            pass
+
+    # Ré-indexation incrémentale par le worker: seules les pages modifiées sont re-vectorisées
+    ingestion.enqueue(db, doc.id, target, doc.title)
+    log_event(db, user.id, "pdf_replace", {"doc_id": doc.id, "title": doc.title})
+    return doc
+
+
 @router.delete("/documents/{doc_id}")
 async def delete_doc(doc_id: int, db: Session = Depends(get_db), user: User = Depends(get_actor_user)):
     doc = db.query(PdfDocument).filter(PdfDocument.id == doc_id).first()
@@ -94,11 +150,15 @@ async def delete_doc(doc_id: int, db: Session = Depends(get_db), user: User = De
         raise HTTPException(status_code=404, detail="Document introuvable")
 
     filename = doc.filename
+    p = pdf_path(doc)
+    shared = bool(doc.sha256) and (
+        db.query(PdfDocument).filter(PdfDocument.sha256 == doc.sha256, PdfDocument.id != doc.id).count() > 0
+    )
+    await ingestion.cancel_document_jobs(doc_id)
     db.delete(doc)
     db.commit()
 
-    p = _pdf_storage_path(filename)
-    if p.exists():
+    if p.exists() and not shared:
         try:
             p.unlink()
         except Exception:
@@ -1,10 +1,11 @@
 import sqlite3
 
-import httpx
 from fastapi import APIRouter
-from qdrant_client import QdrantClient
 
 from app.core.config import settings
+from app.services import answer_cache, embedding_cache, vector_store, warmup
+from app.services.ollama import check_ollama, health_state, pool_stats
+from app.services.rag import cache_stats, qdrant
 
 router = APIRouter(prefix="/system", tags=["system"])
 
@@ -12,15 +13,12 @@ router = APIRouter(prefix="/system", tags=["system"])
 @router.get("/health")
 async def health():
     status = {"api": "ok", "ollama": "down", "qdrant": "down", "storage": "ok", "db": "ok"}
+    ok, _ = await check_ollama()
+    if ok:
+        status["ollama"] = "ok"
+    status["ollama_state"] = health_state()
     try:
-        async with httpx.AsyncClient(timeout=5) as client:
-            r = await client.get(f"{settings.ollama_url}/api/tags")
-            if r.status_code == 200:
-                status["ollama"] = "ok"
-    except Exception:
-        pass
-    try:
-        QdrantClient(url=settings.qdrant_url).get_collections()
+        await qdrant().get_collections()
         status["qdrant"] = "ok"
     except Exception:
         pass
@@ -30,3 +28,15 @@ async def health():
     except Exception:
         status["db"] = "down"
     return status
+
+
+@router.get("/stats")
+async def stats():
+    return {
+        "ollama_pool": pool_stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "rag_cache": cache_stats(),
+        "answer_cache": answer_cache.stats(),
+        "local_vectors": vector_store.stats(),
+        "warmup": warmup.stats(),
+    }
@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.context import approx_tokens
+
+
+# Cache sémantique des réponses (opt-in): même mode, même modèle, mêmes documents et question
+# proche (cosinus >= seuil) -> réponse déjà générée, sans nouvel appel au LLM.
+_lock = threading.Lock()
+# Par clé: entrées et matrice de leurs vecteurs normalisés (une ligne par entrée, même ordre)
+_buckets: OrderedDict[tuple, dict] = OrderedDict()
+_stats = {"lookups": 0, "hits": 0, "stores": 0, "invalidations": 0, "tokens_saved": 0}
+
+
+def cache_key(mode: str, model: str | None, doc_ids: list[int] | None, use_rag: bool = True) -> tuple:
+    # Sans RAG, la réponse ne dépend d'aucun document: None (jamais invalidé par la bibliothèque)
+    docs = tuple(sorted({int(d) for d in doc_ids or []})) if use_rag else None
+    return (mode, model or settings.ollama_chat_model, docs)
+
+
+def _normalize(vector: list[float]) -> np.ndarray:
+    v = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(v))
+    return v / norm if norm else v
+
+
+def _size() -> int:
+    return sum(len(bucket["entries"]) for bucket in _buckets.values())
+
+
+def _drop_expired(bucket: dict, now: float):
+    keep = [i for i, e in enumerate(bucket["entries"]) if e["expires_at"] > now]
+    if len(keep) != len(bucket["entries"]):
+        bucket["entries"] = [bucket["entries"][i] for i in keep]
+        bucket["matrix"] = bucket["matrix"][keep]
+
+
+def lookup(key: tuple, vector: list[float]) -> dict | None:
+    query = _normalize(vector)
+    now = time.monotonic()
+    with _lock:
+        _stats["lookups"] += 1
+        bucket = _buckets.get(key)
+        if not bucket:
+            return None
+        _drop_expired(bucket, now)
+        if not bucket["entries"] or bucket["matrix"].shape[1] != query.shape[0]:
+            return None
+        # Cosinus contre toutes les entrées en un seul produit matrice-vecteur
+        scores = bucket["matrix"] @ query
+        index = int(np.argmax(scores))
+        score = float(scores[index])
+        if score < settings.answer_cache_threshold:
+            return None
+        best = bucket["entries"][index]
+        _buckets.move_to_end(key)
+        _stats["hits"] += 1
+        _stats["tokens_saved"] += best["tokens"]
+        return {"answer": best["answer"], "citations": best["citations"], "similarity": round(score, 4)}
+
+
+def store(key: tuple, vector: list[float], answer: str, citations: list[dict]):
+    if not answer.strip():
+        return
+    row = _normalize(vector)
+    entry = {
+        "answer": answer,
+        "citations": citations,
+        "tokens": approx_tokens(answer),
+        "expires_at": time.monotonic() + settings.answer_cache_ttl_seconds,
+    }
+    with _lock:
+        bucket = _buckets.get(key)
+        if bucket is None or bucket["matrix"].shape[1] != row.shape[0]:
+            # Nouvelle clé, ou vecteurs d'une autre dimension (modèle d'embedding changé): groupe repris à zéro
+            bucket = _buckets[key] = {"entries": [], "matrix": np.empty((0, row.shape[0]), dtype=np.float32)}
+        bucket["entries"].append(entry)
+        bucket["matrix"] = np.vstack([bucket["matrix"], row[None, :]])
+        _buckets.move_to_end(key)
+        _stats["stores"] += 1
+        # Éviction: les plus anciennes entrées des groupes les moins récemment utilisés
+        while _size() > settings.answer_cache_max_entries:
+            oldest_key = next(iter(_buckets))
+            oldest = _buckets[oldest_key]
+            oldest["entries"].pop(0)
+            oldest["matrix"] = oldest["matrix"][1:]
+            if not oldest["entries"]:
+                del _buckets[oldest_key]
+
+
+def invalidate_documents(doc_ids: list[int]):
+    touched = {int(d) for d in doc_ids}
+    with _lock:
+        # Clé sans documents = toute la bibliothèque: périmée dès qu'un document change
+        stale = [key for key in _buckets if key[2] is not None and (not key[2] or touched.intersection(key[2]))]
+        for key in stale:
+            del _buckets[key]
+        _stats["invalidations"] += len(stale)
+
+
+def clear():
+    with _lock:
+        _buckets.clear()
+
+
+def stats() -> dict:
+    with _lock:
+        entries = _size()
+    return {
+        **_stats,
+        "entries": entries,
+        "hit_rate": round(_stats["hits"] / _stats["lookups"], 3) if _stats["lookups"] else None,
+        "enabled": settings.answer_cache_enabled,
+    }
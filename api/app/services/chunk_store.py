@@ -0,0 +1,208 @@
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from app.core.config import settings
+
+
+# Copie locale des chunks dans une seule base SQLite: accès direct par id de point ou (doc_id, seq),
+# titre stocké une fois par document, remplacement d'un document en une transaction.
+_write_lock = threading.Lock()
+_ready_paths: set[str] = set()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunk_docs (
+    doc_id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    doc_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    point_id TEXT,
+    page INTEGER NOT NULL,
+    chunk INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    indexed INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (doc_id, seq)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_chunks_point_id ON chunks (point_id);
+CREATE TABLE IF NOT EXISTS chunks_staging (
+    doc_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    point_id TEXT,
+    page INTEGER NOT NULL,
+    chunk INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    indexed INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (doc_id, seq)
+);
+"""
+
+_COLUMNS = "c.doc_id, c.seq, c.point_id, c.page, c.chunk, c.text, c.indexed, d.title"
+
+
+def _store_path() -> Path:
+    return Path(settings.storage_root) / "chunks.sqlite3"
+
+
+def _connect() -> sqlite3.Connection:
+    path = _store_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), timeout=30)
+    if str(path) not in _ready_paths:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        _ready_paths.add(str(path))
+    return conn
+
+
+@contextmanager
+def _session():
+    conn = _connect()
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _row(chunk: dict, doc_id: int, seq: int) -> tuple:
+    return (
+        doc_id,
+        seq,
+        chunk.get("id"),
+        int(chunk.get("page", 0)),
+        int(chunk.get("chunk", 0)),
+        chunk.get("text", ""),
+        int(chunk.get("indexed", True)),
+    )
+
+
+def _chunk(row: tuple) -> dict:
+    doc_id, seq, point_id, page, index, text, indexed, title = row
+    chunk = {"page": page, "chunk": index, "text": text, "doc_id": doc_id, "title": title}
+    if point_id:
+        chunk["id"] = point_id
+    if not indexed:
+        chunk["indexed"] = False
+    return chunk
+
+
+def _replace_document(conn: sqlite3.Connection, doc_id: int, title: str, chunks: list[dict]):
+    conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+    conn.execute("INSERT OR REPLACE INTO chunk_docs (doc_id, title) VALUES (?, ?)", (doc_id, title))
+    conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?)", [_row(c, doc_id, i) for i, c in enumerate(chunks)])
+
+
+def save_document(doc_id: int, chunks: list[dict]):
+    title = chunks[0].get("title", "") if chunks else ""
+    with _write_lock, _session() as conn:
+        if chunks:
+            _replace_document(conn, doc_id, title, chunks)
+        else:
+            _remove_document(conn, doc_id)
+
+
+def load_documents(doc_ids: list[int] | None = None) -> list[dict]:
+    sql = f"SELECT {_COLUMNS} FROM chunks c JOIN chunk_docs d ON d.doc_id = c.doc_id"
+    params: list = []
+    if doc_ids:
+        sql += f" WHERE c.doc_id IN ({','.join('?' * len(doc_ids))})"
+        params = [int(d) for d in doc_ids]
+    with _session() as conn:
+        return [_chunk(row) for row in conn.execute(sql + " ORDER BY c.doc_id, c.seq", params)]
+
+
+def fetch_refs(refs: list[dict]) -> list[dict]:
+    # Lecture par clé primaire (doc_id, seq), dans l'ordre des références
+    if not refs:
+        return []
+    found: dict[tuple, dict] = {}
+    with _session() as conn:
+        for ref in refs:
+            row = conn.execute(
+                f"SELECT {_COLUMNS} FROM chunks c JOIN chunk_docs d ON d.doc_id = c.doc_id WHERE c.doc_id = ? AND c.seq = ?",
+                (int(ref["doc_id"]), int(ref["seq"])),
+            ).fetchone()
+            if row:
+                found[(ref["doc_id"], ref["seq"])] = _chunk(row)
+    return [found[(r["doc_id"], r["seq"])] for r in refs if (r["doc_id"], r["seq"]) in found]
+
+
+def fetch_ids(point_ids: list[str]) -> dict[str, dict]:
+    out: dict[str, dict] = {}
+    with _session() as conn:
+        for i in range(0, len(point_ids), 500):
+            part = point_ids[i : i + 500]
+            rows = conn.execute(
+                f"SELECT {_COLUMNS} FROM chunks c JOIN chunk_docs d ON d.doc_id = c.doc_id "
+                f"WHERE c.point_id IN ({','.join('?' * len(part))})",
+                part,
+            )
+            out.update((row[2], _chunk(row)) for row in rows)
+    return out
+
+
+def _remove_document(conn: sqlite3.Connection, doc_id: int):
+    conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+    conn.execute("DELETE FROM chunks_staging WHERE doc_id = ?", (doc_id,))
+    conn.execute("DELETE FROM chunk_docs WHERE doc_id = ?", (doc_id,))
+
+
+def remove_document(doc_id: int):
+    with _write_lock, _session() as conn:
+        _remove_document(conn, doc_id)
+
+
+def doc_ids() -> list[int]:
+    with _session() as conn:
+        return [row[0] for row in conn.execute("SELECT DISTINCT doc_id FROM chunks ORDER BY doc_id")]
+
+
+class DocumentWriter:
+    # Écriture au fil de l'eau dans une table de préparation, publiée en une transaction au commit
+    def __init__(self, doc_id: int, title: str):
+        self.doc_id = doc_id
+        self.title = title
+        self.count = 0
+        with _write_lock, _session() as conn:
+            conn.execute("DELETE FROM chunks_staging WHERE doc_id = ?", (doc_id,))
+
+    def write(self, chunks: list[dict]):
+        with _write_lock, _session() as conn:
+            conn.executemany(
+                "INSERT INTO chunks_staging VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [_row(c, self.doc_id, self.count + i) for i, c in enumerate(chunks)],
+            )
+        self.count += len(chunks)
+
+    def commit(self):
+        with _write_lock, _session() as conn:
+            if self.count:
+                conn.execute("DELETE FROM chunks WHERE doc_id = ?", (self.doc_id,))
+                conn.execute("INSERT OR REPLACE INTO chunk_docs (doc_id, title) VALUES (?, ?)", (self.doc_id, self.title))
+                conn.execute("INSERT INTO chunks SELECT * FROM chunks_staging WHERE doc_id = ?", (self.doc_id,))
+            conn.execute("DELETE FROM chunks_staging WHERE doc_id = ?", (self.doc_id,))
+
+    def abort(self):
+        with _write_lock, _session() as conn:
+            conn.execute("DELETE FROM chunks_staging WHERE doc_id = ?", (self.doc_id,))
+
+
+def migrate_json(directory: Path) -> int:
+    # Anciens caches data/chunks/{doc_id}.json: importés puis supprimés (fichier retiré après le commit)
+    migrated = 0
+    for f in sorted(directory.glob("*.json")) if directory.exists() else []:
+        if not f.stem.isdigit():
+            continue
+        try:
+            chunks = json.loads(f.read_text(encoding="utf-8"))
+        except Exception:
+            continue
+        if chunks:
+            save_document(int(f.stem), chunks)
+        f.unlink()
+        migrated += 1
+    return migrated
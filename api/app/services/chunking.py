@@ -0,0 +1,103 @@
+import re
+from bisect import bisect_right
+
+from app.core.config import settings
+
+
+# Découpage structurel: paragraphes et phrases, cible en tokens (approximés en caractères),
+# pages courtes jointes. Les frontières sont calculées une seule fois sur tout le texte.
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_END_RE = re.compile(r"[.!?…:;][\"»)\]]*(?=\s+[\"«(\[]?[A-ZÀ-ÖØ-Þ0-9•\-–])")
+_BULLET_RE = re.compile(r"\n(?=\s*[•\-–*]\s)")
+_PAGE_SEPARATOR = "\n\n"
+
+
+def _tokens(n_chars: int) -> float:
+    return n_chars / settings.context_chars_per_token
+
+
+def boundary_offsets(text: str) -> tuple[list[int], set[int]]:
+    # Offsets de fin de segment (phrase ou paragraphe) triés; les fins de paragraphe sont aussi renvoyées à part
+    paragraph_ends = {m.start() for m in _PARAGRAPH_RE.finditer(text)}
+    ends = paragraph_ends | {m.end() for m in _SENTENCE_END_RE.finditer(text)}
+    ends |= {m.start() for m in _BULLET_RE.finditer(text)}
+    ends.add(len(text))
+    return sorted(ends), paragraph_ends
+
+
+def _split_long(text: str, start: int, end: int, max_chars: int) -> list[tuple[int, int]]:
+    # Segment plus long que le maximum (tableau, texte sans ponctuation): coupe sur un espace
+    spans = []
+    while end - start > max_chars:
+        cut = text.rfind(" ", start + max_chars // 2, start + max_chars)
+        cut = cut if cut > start else start + max_chars
+        spans.append((start, cut))
+        start = cut
+    spans.append((start, end))
+    return spans
+
+
+def chunk_spans(
+    text: str,
+    target_tokens: int | None = None,
+    max_tokens: int | None = None,
+    overlap_segments: int | None = None,
+) -> list[tuple[int, int]]:
+    target_tokens = target_tokens or settings.chunk_target_tokens
+    max_tokens = max(target_tokens, max_tokens or settings.chunk_max_tokens)
+    overlap_segments = settings.chunk_overlap_sentences if overlap_segments is None else overlap_segments
+    max_chars = int(max_tokens * settings.context_chars_per_token)
+
+    ends, paragraph_ends = boundary_offsets(text)
+    segments: list[tuple[int, int]] = []
+    start = 0
+    for end in ends:
+        if text[start:end].strip():
+            segments.extend(_split_long(text, start, end, max_chars))
+        start = end
+
+    spans: list[tuple[int, int]] = []
+    current: list[tuple[int, int]] = []
+    fresh = 0
+
+    def emit():
+        nonlocal current, fresh
+        spans.append((current[0][0], current[-1][1]))
+        current = current[-overlap_segments:] if overlap_segments else []
+        fresh = 0
+
+    for seg in segments:
+        if current and _tokens(seg[1] - current[0][0]) > max_tokens:
+            if fresh:
+                emit()
+            if current and _tokens(seg[1] - current[0][0]) > max_tokens:
+                current = []
+        current.append(seg)
+        fresh += 1
+        size = _tokens(seg[1] - current[0][0])
+        # Coupe à la cible, ou dès 60 % de la cible sur une fin de paragraphe
+        if size >= target_tokens or (seg[1] in paragraph_ends and size >= 0.6 * target_tokens):
+            emit()
+    if fresh:
+        emit()
+    return spans
+
+
+def chunk_pages(pages: list[tuple[int, str]], **options) -> list[tuple[int, list[str]]]:
+    # Les pages sont concaténées: un chunk peut chevaucher deux pages et est rattaché à sa page de début
+    starts: list[int] = []
+    parts: list[str] = []
+    offset = 0
+    for _, page_text in pages:
+        starts.append(offset)
+        parts.append(page_text)
+        offset += len(page_text) + len(_PAGE_SEPARATOR)
+    text = _PAGE_SEPARATOR.join(parts)
+
+    by_page: list[list[str]] = [[] for _ in pages]
+    for start, end in chunk_spans(text, **options):
+        chunk = text[start:end].strip()
+        if chunk:
+            lead = len(text[start:end]) - len(text[start:end].lstrip())
+            by_page[bisect_right(starts, start + lead) - 1].append(chunk)
+    return [(page, chunks) for (page, _), chunks in zip(pages, by_page)]
@@ -0,0 +1,77 @@
+import time
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} indisponible (circuit ouvert), réessayer dans {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    # closed: appels normaux; open: échec immédiat jusqu'à reset_seconds;
+    # half_open: un seul appel d'essai, dont le résultat referme ou rouvre le circuit.
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.last_error: str | None = None
+
+    def retry_after(self) -> float:
+        if self.state == "closed":
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_seconds - time.monotonic())
+
+    def before_call(self):
+        if self.state == "open":
+            remaining = self.retry_after()
+            if remaining > 0:
+                raise CircuitOpenError(self.name, remaining)
+            self.state = "half_open"
+            self.trial_in_flight = False
+        if self.state == "half_open":
+            if self.trial_in_flight:
+                raise CircuitOpenError(self.name, max(1.0, self.retry_after()))
+            self.trial_in_flight = True
+
+    def check(self):
+        # Même refus que before_call, sans réserver l'appel d'essai: permet un 503 avant d'ouvrir un flux
+        if self.state == "open" and self.retry_after() > 0:
+            raise CircuitOpenError(self.name, self.retry_after())
+        if self.state == "half_open" and self.trial_in_flight:
+            raise CircuitOpenError(self.name, max(1.0, self.retry_after()))
+
+    def probe_succeeded(self):
+        # Une sonde légère qui répond ne prouve pas que chat/embeddings tiennent la charge:
+        # le circuit passe au plus en half_open et un vrai appel d'essai tranche
+        if self.state == "open":
+            self.state = "half_open"
+            self.trial_in_flight = False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.trial_in_flight = False
+
+    def record_failure(self, error: Exception | str | None = None):
+        self.failures += 1
+        self.trial_in_flight = False
+        self.last_error = str(error) if error else self.last_error
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        # Appel interrompu (annulation client): ni succès ni échec
+        self.trial_in_flight = False
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "retry_after": round(self.retry_after(), 1),
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,66 @@
+import math
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.entities import Message
+
+
+def approx_tokens(text: str) -> int:
+    # Approximation sans tokenizer: ~4 caractères par token (français/anglais)
+    return math.ceil(len(text or "") / settings.context_chars_per_token)
+
+
+def fit_text(text: str, budget_tokens: int) -> str:
+    max_chars = int(max(0, budget_tokens) * settings.context_chars_per_token)
+    return text if len(text) <= max_chars else text[:max_chars]
+
+
+def fit_citations(citations: list[dict], budget_tokens: int | None = None) -> tuple[list[dict], str]:
+    # Tranche réservée aux sources RAG: on garde les meilleures citations tant qu'elles tiennent
+    budget = settings.context_sources_tokens if budget_tokens is None else budget_tokens
+    kept: list[dict] = []
+    lines: list[str] = []
+    used = 0
+    for c in citations:
+        line = f"- {c['title']} p.{c['page']}: {c['excerpt']}"
+        cost = approx_tokens(line)
+        if used + cost > budget:
+            break
+        kept.append(c)
+        lines.append(line)
+        used += cost
+    if not lines:
+        return kept, ""
+    return kept, "\n\nSources PDF:\n" + "\n".join(lines)
+
+
+def build_chat_messages(
+    db: Session,
+    conversation_id: int,
+    system_prompt: str,
+    current_message_id: int,
+    current_content: str,
+) -> list[dict]:
+    # Budget total = système + historique + message courant (avec sources), moins la réserve de réponse
+    system = fit_text(system_prompt, settings.context_system_tokens)
+    budget = settings.context_max_tokens - settings.context_answer_tokens - approx_tokens(system)
+    current = fit_text(current_content, budget)
+    budget -= approx_tokens(current)
+
+    recent = (
+        db.query(Message.id, Message.role, Message.content)
+        .filter(Message.conversation_id == conversation_id, Message.id != current_message_id)
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .limit(settings.context_history_max_messages)
+        .all()
+    )
+    history: list[dict] = []
+    for _, role, content in recent:
+        cost = approx_tokens(content)
+        if cost > budget:
+            break
+        history.append({"role": role, "content": content})
+        budget -= cost
+
+    return [{"role": "system", "content": system}, *reversed(history), {"role": "user", "content": current}]
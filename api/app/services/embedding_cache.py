@@ -0,0 +1,118 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from pathlib import Path
+
+from app.core.config import settings
+
+
+_write_lock = threading.Lock()
+_ready_paths: set[str] = set()
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    text_hash TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (model, text_hash)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used);
+"""
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _cache_path() -> Path:
+    return Path(settings.storage_root) / "embeddings.sqlite3"
+
+
+def _connect() -> sqlite3.Connection:
+    path = _cache_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), timeout=30)
+    if str(path) not in _ready_paths:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        _ready_paths.add(str(path))
+    return conn
+
+
+@contextmanager
+def _session():
+    conn = _connect()
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _encode(vector: list[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _decode(blob: bytes) -> list[float]:
+    values = array("f")
+    values.frombytes(blob)
+    return values.tolist()
+
+
+def get_many(model: str, texts: list[str], count: bool = True) -> list[list[float] | None]:
+    # count=False pour les lectures internes (MMR, synchronisation): le taux de succès ne mesure que embed_texts
+    hashes = [text_hash(t) for t in texts]
+    found: dict[str, list[float]] = {}
+    with _session() as conn:
+        unique = list(dict.fromkeys(hashes))
+        # Lots de 500 pour rester sous la limite de paramètres SQLite
+        for i in range(0, len(unique), 500):
+            part = unique[i : i + 500]
+            rows = conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(part))})",
+                [model, *part],
+            )
+            found.update((h, _decode(blob)) for h, blob in rows)
+        if found:
+            with _write_lock:
+                now = time.time()
+                conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, h) for h in found],
+                )
+    out = [found.get(h) for h in hashes]
+    if count:
+        hits = sum(1 for v in out if v is not None)
+        _stats["hits"] += hits
+        _stats["misses"] += len(out) - hits
+    return out
+
+
+def put_many(model: str, texts: list[str], vectors: list[list[float]]):
+    if not texts:
+        return
+    now = time.time()
+    with _write_lock, _session() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+            [(model, text_hash(t), _encode(v), now) for t, v in zip(texts, vectors)],
+        )
+        overflow = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - settings.embedding_cache_max_entries
+        if overflow > 0:
+            # Éviction LRU: on retire les entrées les moins récemment utilisées
+            conn.execute(
+                "DELETE FROM embeddings WHERE (model, text_hash) IN "
+                "(SELECT model, text_hash FROM embeddings ORDER BY last_used LIMIT ?)",
+                (overflow,),
+            )
+            _stats["evictions"] += overflow
+
+
+def stats() -> dict:
+    total = _stats["hits"] + _stats["misses"]
+    return {**_stats, "hit_rate": round(_stats["hits"] / total, 3) if total else None}
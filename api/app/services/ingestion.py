@@ -0,0 +1,271 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.entities import IngestionJob, PdfDocument
+from app.services.rag import reindex_document
+from app.services.storage import pdf_path
+
+
+# Worker d'ingestion: file persistante (table ingestion_jobs), concurrence bornée,
+# priorité inférieure aux échanges de chat interactifs.
+_wake: asyncio.Event | None = None
+_loop: asyncio.AbstractEventLoop | None = None
+_dispatcher: asyncio.Task | None = None
+_running: dict[int, asyncio.Task] = {}
+_stopping = False
+_active_interactive = 0
+
+
+@asynccontextmanager
+async def interactive():
+    global _active_interactive
+    _active_interactive += 1
+    try:
+        yield
+    finally:
+        _active_interactive -= 1
+
+
+async def yield_to_interactive():
+    # Avant chaque lot d'embeddings: on laisse passer les chats en cours, sans bloquer indéfiniment
+    deadline = time.monotonic() + settings.ingest_interactive_max_wait_seconds
+    while _active_interactive > 0 and time.monotonic() < deadline:
+        await asyncio.sleep(0.2)
+
+
+def _notify():
+    # Appelable depuis un thread (enqueue via to_thread): le réveil est posté sur la boucle du worker
+    wake, loop = _wake, _loop
+    if wake is None or loop is None:
+        return
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        wake.set()
+    elif not loop.is_closed():
+        loop.call_soon_threadsafe(wake.set)
+
+
+def enqueue(db: Session, doc_id: int, path: Path, title: str, priority: int = 0) -> IngestionJob:
+    job = IngestionJob(doc_id=doc_id, path=str(path), title=title, priority=priority, status="queued")
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    _notify()
+    return job
+
+
+def recover_jobs():
+    # Jobs interrompus par un arrêt/crash: remis en file. Les documents "processing" sans job en reçoivent un.
+    with SessionLocal() as db:
+        db.query(IngestionJob).filter(IngestionJob.status == "processing").update(
+            {IngestionJob.status: "queued"}, synchronize_session=False
+        )
+        tracked = {doc_id for (doc_id,) in db.query(IngestionJob.doc_id).filter(IngestionJob.status == "queued")}
+        for doc in db.query(PdfDocument).filter(PdfDocument.status == "processing").all():
+            path = pdf_path(doc)
+            if doc.id not in tracked and path.exists():
+                db.add(IngestionJob(doc_id=doc.id, path=str(path), title=doc.title, status="queued"))
+        db.commit()
+
+
+def _claim_next() -> int | None:
+    # Un seul job actif par document: deux ingestions concurrentes se disputeraient chunks, index et points
+    busy = select(IngestionJob.doc_id).where(IngestionJob.status == "processing")
+    with SessionLocal() as db:
+        job = (
+            db.query(IngestionJob)
+            .filter(IngestionJob.status == "queued", IngestionJob.doc_id.not_in(busy))
+            .order_by(IngestionJob.priority.desc(), IngestionJob.id.asc())
+            .first()
+        )
+        if not job:
+            return None
+        job.status = "processing"
+        job.attempts += 1
+        job.started_at = datetime.utcnow()
+        job.error = None
+        db.commit()
+        return job.id
+
+
+def _requeue_failed():
+    # Échec transitoire (Ollama, Qdrant): dernier job du document remis en file après un délai croissant
+    latest = select(func.max(IngestionJob.id)).group_by(IngestionJob.doc_id)
+    now = datetime.utcnow()
+    with SessionLocal() as db:
+        jobs = (
+            db.query(IngestionJob)
+            .filter(
+                IngestionJob.status == "failed",
+                IngestionJob.attempts < settings.ingest_max_attempts,
+                IngestionJob.id.in_(latest),
+            )
+            .all()
+        )
+        for job in jobs:
+            delay = settings.ingest_requeue_delay_seconds * 2 ** max(0, job.attempts - 1)
+            if not job.finished_at or (now - job.finished_at).total_seconds() >= delay:
+                job.status = "queued"
+        db.commit()
+
+
+def last_job_failed(db: Session, doc_id: int) -> bool:
+    job = db.query(IngestionJob).filter(IngestionJob.doc_id == doc_id).order_by(IngestionJob.id.desc()).first()
+    return job is not None and job.status == "failed"
+
+
+def _save_progress(job_id: int, summary: dict):
+    with SessionLocal() as db:
+        job = db.get(IngestionJob, job_id)
+        if job:
+            job.pages_total = summary.get("pages_total", 0)
+            job.pages_done = summary.get("pages", 0)
+            job.chunks_total = summary.get("chunks", 0)
+            job.chunks_embedded = summary.get("vectors", 0)
+            db.commit()
+
+
+class _ProgressWriter:
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+        self.last_write = 0.0
+
+    def __call__(self, summary: dict):
+        now = time.monotonic()
+        if now - self.last_write >= settings.ingest_progress_interval_seconds:
+            self.last_write = now
+            _save_progress(self.job_id, summary)
+
+
+async def _run_job(job_id: int):
+    with SessionLocal() as db:
+        job = db.get(IngestionJob, job_id)
+        doc_id, path, title = job.doc_id, Path(job.path), job.title
+
+    summary: dict = {}
+    try:
+        summary = await reindex_document(
+            doc_id, path, title, on_progress=_ProgressWriter(job_id), throttle=yield_to_interactive
+        )
+        error = summary.get("error")
+        # Vectorisation incomplète: job en échec, relancé plus tard (_requeue_failed)
+        status = "failed" if error else "ready"
+    except Exception as exc:
+        status, error = "failed", str(exc)
+    # Copie locale publiée: document consultable en recherche lexicale même si les vecteurs manquent
+    doc_status = "ready" if status == "ready" or summary.get("chunks") else "failed"
+
+    if summary:
+        _save_progress(job_id, summary)
+    with SessionLocal() as db:
+        job = db.get(IngestionJob, job_id)
+        if job:
+            job.status = status
+            job.error = error
+            job.finished_at = datetime.utcnow()
+        doc = db.get(PdfDocument, doc_id)
+        if doc:
+            doc.status = doc_status
+        db.commit()
+
+
+def _on_job_done(job_id: int):
+    _running.pop(job_id, None)
+    _notify()
+
+
+async def _dispatch():
+    # Drapeau explicite: sous Python 3.11, wait_for peut absorber une annulation arrivée pendant que _wake est levé
+    while not _stopping:
+        _requeue_failed()
+        while len(_running) < max(1, settings.ingest_max_concurrency):
+            job_id = _claim_next()
+            if job_id is None:
+                break
+            task = asyncio.create_task(_run_job(job_id))
+            _running[job_id] = task
+            task.add_done_callback(lambda _, j=job_id: _on_job_done(j))
+        try:
+            await asyncio.wait_for(_wake.wait(), timeout=settings.ingest_poll_interval_seconds)
+        except asyncio.TimeoutError:
+            pass
+        _wake.clear()
+
+
+async def cancel_document_jobs(doc_id: int):
+    # Document supprimé: jobs en file ou en cours annulés (jamais relancés), tâches en cours attendues
+    with SessionLocal() as db:
+        jobs = (
+            db.query(IngestionJob)
+            .filter(IngestionJob.doc_id == doc_id, IngestionJob.status.in_(("queued", "processing")))
+            .all()
+        )
+        for job in jobs:
+            job.status = "cancelled"
+            job.error = "Document supprimé"
+            job.finished_at = datetime.utcnow()
+        db.commit()
+        job_ids = [job.id for job in jobs]
+    tasks = [_running[job_id] for job_id in job_ids if job_id in _running]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def start_worker():
+    global _wake, _loop, _dispatcher, _stopping
+    if _dispatcher is not None:
+        return
+    _stopping = False
+    recover_jobs()
+    _wake = asyncio.Event()
+    _loop = asyncio.get_running_loop()
+    _dispatcher = asyncio.create_task(_dispatch())
+
+
+async def stop_worker():
+    global _wake, _dispatcher, _stopping
+    if _dispatcher is None:
+        return
+    _stopping = True
+    tasks = [_dispatcher, *_running.values()]
+    for task in tasks:
+        task.cancel()
+    # Les jobs annulés restent "processing" et seront repris au prochain démarrage
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _running.clear()
+    _dispatcher = None
+    _wake = None
+
+
+def job_progress(job: IngestionJob) -> dict:
+    eta = None
+    if job.status == "processing" and job.started_at and job.pages_total and job.pages_done:
+        # Estimation du nombre total de chunks à partir des pages déjà extraites
+        expected_chunks = job.chunks_total * job.pages_total / job.pages_done
+        done = (job.pages_done / job.pages_total + (job.chunks_embedded / expected_chunks if expected_chunks else 1)) / 2
+        elapsed = (datetime.utcnow() - job.started_at).total_seconds()
+        if done > 0:
+            eta = round(elapsed * (1 - done) / done, 1)
+    return {
+        "job_id": job.id,
+        "job_status": job.status,
+        "attempts": job.attempts,
+        "pages_done": job.pages_done,
+        "pages_total": job.pages_total,
+        "chunks_total": job.chunks_total,
+        "chunks_embedded": job.chunks_embedded,
+        "eta_seconds": eta,
+        "error": job.error,
+    }
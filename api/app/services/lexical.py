@@ -0,0 +1,206 @@
+import heapq
+import math
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+from contextlib import contextmanager
+from operator import itemgetter
+from pathlib import Path
+
+from app.core.config import settings
+
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Mots vides français, sans accents (les termes sont normalisés avant comparaison)
+FRENCH_STOPWORDS = frozenset(
+    """
+    au aux avec ce ces cet cette ci dans de des du elle elles en entre est et etc etre ete eu il ils
+    je la le les leur leurs lui ma mais me meme mes moi mon ne ni nos notre nous on ou par pas peu
+    peut plus pour qu que quel quelle quels quelles qui quoi sa sans se ses si son sont sur ta te tes
+    toi ton tous tout toute toutes tres tu un une vos votre vous ya car donc comme aussi ainsi alors
+    avoir fait faire dont cela ceci celui celle ceux celles chez sous vers
+    """.split()
+)
+
+_TOKEN_RE = re.compile(r"\w+")
+_write_lock = threading.Lock()
+_ready_paths: set[str] = set()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lex_chunks (
+    id INTEGER PRIMARY KEY,
+    doc_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_lex_chunks_doc ON lex_chunks (doc_id, seq);
+CREATE TABLE IF NOT EXISTS lex_postings (
+    term TEXT NOT NULL,
+    chunk_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term, chunk_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_lex_postings_chunk ON lex_postings (chunk_id);
+CREATE TABLE IF NOT EXISTS lex_terms (
+    term TEXT PRIMARY KEY,
+    df INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS lex_stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    chunks INTEGER NOT NULL,
+    total_length INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO lex_stats (id, chunks, total_length) VALUES (1, 0, 0);
+"""
+
+
+def normalize_terms(text: str) -> list[str]:
+    folded = unicodedata.normalize("NFKD", (text or "").lower())
+    folded = "".join(c for c in folded if not unicodedata.combining(c))
+    return [t for t in _TOKEN_RE.findall(folded) if len(t) >= 2 and t not in FRENCH_STOPWORDS]
+
+
+def _index_path() -> Path:
+    return Path(settings.storage_root) / "lexical.sqlite3"
+
+
+def _connect() -> sqlite3.Connection:
+    path = _index_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), timeout=30)
+    if str(path) not in _ready_paths:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        _ready_paths.add(str(path))
+    return conn
+
+
+@contextmanager
+def _session():
+    conn = _connect()
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _remove_document(conn: sqlite3.Connection, doc_id: int):
+    df_changes = conn.execute(
+        "SELECT p.term, COUNT(*) FROM lex_postings p JOIN lex_chunks c ON c.id = p.chunk_id "
+        "WHERE c.doc_id = ? GROUP BY p.term",
+        (doc_id,),
+    ).fetchall()
+    conn.executemany("UPDATE lex_terms SET df = df - ? WHERE term = ?", [(n, t) for t, n in df_changes])
+    conn.execute("DELETE FROM lex_terms WHERE df <= 0")
+    conn.execute("DELETE FROM lex_postings WHERE chunk_id IN (SELECT id FROM lex_chunks WHERE doc_id = ?)", (doc_id,))
+    count, total = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM lex_chunks WHERE doc_id = ?", (doc_id,)
+    ).fetchone()
+    conn.execute("UPDATE lex_stats SET chunks = chunks - ?, total_length = total_length - ? WHERE id = 1", (count, total))
+    conn.execute("DELETE FROM lex_chunks WHERE doc_id = ?", (doc_id,))
+
+
+def _add_chunks(conn: sqlite3.Connection, doc_id: int, start_seq: int, texts: list[str]):
+    df_changes: Counter = Counter()
+    total_length = 0
+    for offset, text in enumerate(texts):
+        terms = Counter(normalize_terms(text))
+        length = sum(terms.values())
+        total_length += length
+        chunk_id = conn.execute(
+            "INSERT INTO lex_chunks (doc_id, seq, length) VALUES (?, ?, ?)",
+            (doc_id, start_seq + offset, length),
+        ).lastrowid
+        conn.executemany(
+            "INSERT INTO lex_postings (term, chunk_id, tf) VALUES (?, ?, ?)",
+            [(term, chunk_id, tf) for term, tf in terms.items()],
+        )
+        df_changes.update(terms.keys())
+    conn.executemany(
+        "INSERT INTO lex_terms (term, df) VALUES (?, ?) ON CONFLICT(term) DO UPDATE SET df = df + excluded.df",
+        list(df_changes.items()),
+    )
+    conn.execute(
+        "UPDATE lex_stats SET chunks = chunks + ?, total_length = total_length + ? WHERE id = 1",
+        (len(texts), total_length),
+    )
+
+
+def index_document(doc_id: int, texts: list[str]):
+    with _write_lock, _session() as conn:
+        _remove_document(conn, doc_id)
+        _add_chunks(conn, doc_id, 0, texts)
+
+
+def remove_document(doc_id: int):
+    with _write_lock, _session() as conn:
+        _remove_document(conn, doc_id)
+
+
+def indexed_doc_ids() -> set[int]:
+    with _session() as conn:
+        return {row[0] for row in conn.execute("SELECT DISTINCT doc_id FROM lex_chunks")}
+
+
+def _doc_filter(doc_ids: list[int] | None) -> tuple[str, list]:
+    if not doc_ids:
+        return "", []
+    return f" AND c.doc_id IN ({','.join('?' * len(doc_ids))})", [int(d) for d in doc_ids]
+
+
+def search(query: str, doc_ids: list[int] | None = None, top_k: int = 4) -> list[dict]:
+    terms = set(normalize_terms(query))
+    if not terms:
+        return []
+    with _session() as conn:
+        n_chunks, total_length = conn.execute("SELECT chunks, total_length FROM lex_stats WHERE id = 1").fetchone()
+        if not n_chunks:
+            return []
+        avgdl = total_length / n_chunks or 1.0
+        doc_sql, doc_params = _doc_filter(doc_ids)
+        scores: dict[int, float] = {}
+        for term in terms:
+            row = conn.execute("SELECT df FROM lex_terms WHERE term = ?", (term,)).fetchone()
+            if not row:
+                continue
+            df = row[0]
+            idf = math.log(1 + (n_chunks - df + 0.5) / (df + 0.5))
+            postings = conn.execute(
+                "SELECT p.chunk_id, p.tf, c.length FROM lex_postings p JOIN lex_chunks c ON c.id = p.chunk_id "
+                "WHERE p.term = ?" + doc_sql,
+                [term, *doc_params],
+            )
+            for chunk_id, tf, length in postings:
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avgdl)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+
+        best = heapq.nlargest(top_k, scores.items(), key=itemgetter(1))
+        if not best:
+            return []
+        refs = {
+            chunk_id: (doc_id, seq)
+            for chunk_id, doc_id, seq in conn.execute(
+                f"SELECT id, doc_id, seq FROM lex_chunks WHERE id IN ({','.join('?' * len(best))})",
+                [chunk_id for chunk_id, _ in best],
+            )
+        }
+    return [
+        {"doc_id": refs[chunk_id][0], "seq": refs[chunk_id][1], "score": score}
+        for chunk_id, score in best
+        if chunk_id in refs
+    ]
+
+
+def first_chunks(doc_ids: list[int] | None = None, limit: int = 4) -> list[dict]:
+    doc_sql, doc_params = _doc_filter(doc_ids)
+    with _session() as conn:
+        rows = conn.execute(
+            "SELECT c.doc_id, c.seq FROM lex_chunks c WHERE 1 = 1" + doc_sql + " ORDER BY c.id LIMIT ?",
+            [*doc_params, limit],
+        ).fetchall()
+    return [{"doc_id": doc_id, "seq": seq, "score": 0.0} for doc_id, seq in rows]
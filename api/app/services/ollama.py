@@ -1,50 +1,272 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
 import httpx
 
 from app.core.config import settings
+from app.services import embedding_cache
+from app.services.circuit import CircuitBreaker
+from app.services.singleflight import SingleFlight
 
 
-async def check_ollama() -> tuple[bool, str | None]:
+# Pool HTTP partagé (keep-alive) pour tout le processus, ouvert/fermé par le lifespan de l'app
+_client: httpx.AsyncClient | None = None
+_pool_stats = {"requests": 0, "in_flight": 0, "peak_in_flight": 0, "pool_timeouts": 0}
+
+
+def _timeout(read: float) -> httpx.Timeout:
+    return httpx.Timeout(
+        connect=settings.ollama_connect_timeout,
+        read=read,
+        write=read,
+        pool=settings.ollama_pool_timeout,
+    )
+
+
+def _probe_timeout() -> httpx.Timeout:
+    return _timeout(settings.ollama_probe_read_timeout)
+
+
+def _chat_timeout() -> httpx.Timeout:
+    return _timeout(settings.ollama_chat_read_timeout)
+
+
+def _embed_timeout() -> httpx.Timeout:
+    return _timeout(settings.ollama_embed_read_timeout)
+
+
+def _pull_timeout() -> httpx.Timeout:
+    return _timeout(600)
+
+
+def _build_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=_chat_timeout(),
+        limits=httpx.Limits(
+            max_connections=settings.ollama_pool_max_connections,
+            max_keepalive_connections=settings.ollama_pool_max_keepalive,
+            keepalive_expiry=settings.ollama_pool_keepalive_expiry,
+        ),
+    )
+
+
+async def start_http_client():
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def http_client() -> httpx.AsyncClient:
+    # Création paresseuse si le lifespan n'a pas tourné (scripts, tests)
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+@asynccontextmanager
+async def _tracked():
+    _pool_stats["requests"] += 1
+    _pool_stats["in_flight"] += 1
+    _pool_stats["peak_in_flight"] = max(_pool_stats["peak_in_flight"], _pool_stats["in_flight"])
     try:
-        async with httpx.AsyncClient(timeout=5) as client:
-            resp = await client.get(f"{settings.ollama_url}/api/tags")
+        yield
+    except httpx.PoolTimeout:
+        _pool_stats["pool_timeouts"] += 1
+        raise
+    finally:
+        _pool_stats["in_flight"] -= 1
+
+
+def pool_stats() -> dict:
+    max_connections = settings.ollama_pool_max_connections
+    stats = {
+        **_pool_stats,
+        "max_connections": max_connections,
+        "max_keepalive_connections": settings.ollama_pool_max_keepalive,
+        "saturation": round(_pool_stats["in_flight"] / max_connections, 3) if max_connections else None,
+        "open_connections": None,
+        "idle_connections": None,
+    }
+    # httpcore expose les connexions du pool; best-effort car attribut interne à httpx
+    pool = getattr(getattr(_client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    if connections is not None:
+        stats["open_connections"] = len(connections)
+        stats["idle_connections"] = sum(1 for c in connections if c.is_idle())
+    return stats
+
+
+# Disjoncteur partagé par chat et embeddings: échec immédiat quand Ollama est en panne/surchargé
+breaker = CircuitBreaker(
+    "Ollama",
+    failure_threshold=settings.ollama_breaker_failure_threshold,
+    reset_seconds=settings.ollama_breaker_reset_seconds,
+)
+_health: dict = {"ok": None, "error": None, "checked_at": 0.0}
+_monitor: asyncio.Task | None = None
+
+
+def _is_outage(exc: BaseException) -> bool:
+    # Une réponse 4xx prouve qu'Ollama répond: seules les erreurs réseau/timeouts/5xx comptent
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return isinstance(exc, (httpx.TransportError, asyncio.TimeoutError))
+
+
+async def _guarded(fn, *args):
+    breaker.before_call()
+    try:
+        result = await fn(*args)
+    except Exception as exc:
+        if _is_outage(exc):
+            breaker.record_failure(exc)
+        else:
+            breaker.record_success()
+        raise
+    breaker.record_success()
+    return result
+
+
+async def probe_ollama() -> tuple[bool, str | None]:
+    try:
+        async with _tracked():
+            resp = await http_client().get(f"{settings.ollama_url}/api/tags", timeout=_probe_timeout())
             resp.raise_for_status()
-        return True, None
+        ok, error = True, None
     except Exception as exc:
-        return False, str(exc)
+        ok, error = False, str(exc)
+    _health.update(ok=ok, error=error, checked_at=time.monotonic())
+    if ok:
+        breaker.probe_succeeded()
+    elif not ok and breaker.state == "closed":
+        breaker.record_failure(error)
+    return ok, error
+
+
+async def check_ollama() -> tuple[bool, str | None]:
+    # État mis en cache (TTL court) et rafraîchi par le moniteur: pas d'aller-retour /api/tags à chaque tour
+    if _health["ok"] is not None and time.monotonic() - _health["checked_at"] < settings.ollama_health_ttl_seconds:
+        return _health["ok"], _health["error"]
+    return await probe_ollama()
+
+
+async def _monitor_loop():
+    while True:
+        await probe_ollama()
+        await asyncio.sleep(settings.ollama_health_interval_seconds)
+
+
+async def start_health_monitor():
+    global _monitor
+    if _monitor is None:
+        _monitor = asyncio.create_task(_monitor_loop())
+
+
+async def stop_health_monitor():
+    global _monitor
+    if _monitor is not None:
+        _monitor.cancel()
+        await asyncio.gather(_monitor, return_exceptions=True)
+        _monitor = None
+
+
+def health_state() -> dict:
+    age = time.monotonic() - _health["checked_at"] if _health["checked_at"] else None
+    return {
+        "ok": _health["ok"],
+        "error": _health["error"],
+        "age_seconds": round(age, 1) if age is not None else None,
+        "breaker": breaker.snapshot(),
+    }
 
 
 async def chat_stream(messages: list[dict], model: str | None = None):
-    payload = {"model": model or settings.ollama_chat_model, "messages": messages, "stream": True}
-    async with httpx.AsyncClient(timeout=120) as client:
-        async with client.stream("POST", f"{settings.ollama_url}/api/chat", json=payload) as response:
-            response.raise_for_status()
-            async for line in response.aiter_lines():
-                if line:
-                    yield line
+    payload = {
+        "model": model or settings.ollama_chat_model,
+        "messages": messages,
+        "stream": True,
+        "keep_alive": settings.ollama_keep_alive,
+    }
+    breaker.before_call()
+    try:
+        async with _tracked():
+            async with http_client().stream(
+                "POST", f"{settings.ollama_url}/api/chat", json=payload, timeout=_chat_timeout()
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if line:
+                        yield line
+    except (asyncio.CancelledError, GeneratorExit):
+        breaker.release_trial()
+        raise
+    except Exception as exc:
+        if _is_outage(exc):
+            breaker.record_failure(exc)
+        else:
+            breaker.record_success()
+        raise
+    breaker.record_success()
+
+
+async def _post_warm(path: str, payload: dict) -> dict:
+    resp = await http_client().post(f"{settings.ollama_url}{path}", json=payload, timeout=_chat_timeout())
+    resp.raise_for_status()
+    return resp.json()
+
+
+async def warm_model(model: str, embedding: bool = False, keep_alive: str | None = None) -> float:
+    # Requête vide: Ollama charge le modèle en mémoire sans rien générer; renvoie la durée de chargement (ms)
+    if embedding:
+        path, payload = "/api/embed", {"model": model, "input": []}
+    else:
+        path, payload = "/api/generate", {"model": model, "prompt": ""}
+    payload["keep_alive"] = keep_alive or settings.ollama_keep_alive
+    async with _tracked():
+        data = await _guarded(_post_warm, path, payload)
+    return (data.get("load_duration") or 0) / 1e6
 
 
 async def list_models() -> list[str]:
     try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            resp = await client.get(f"{settings.ollama_url}/api/tags")
+        async with _tracked():
+            resp = await http_client().get(f"{settings.ollama_url}/api/tags", timeout=_probe_timeout())
             resp.raise_for_status()
-            names = [m.get("name") for m in resp.json().get("models", []) if m.get("name")]
-            return names or [settings.ollama_chat_model]
+        names = [m.get("name") for m in resp.json().get("models", []) if m.get("name")]
+        return names or [settings.ollama_chat_model]
     except Exception:
         return [settings.ollama_chat_model]
 
 
-async def pull_model(model: str) -> dict:
-    model = (model or "").strip()
-    if not model:
-        raise ValueError("Nom de modèle requis")
-    async with httpx.AsyncClient(timeout=600) as client:
+# Un seul téléchargement par modèle, partagé par l'API /models/pull et les sondages d'embedding
+_pulls = SingleFlight()
+
+
+async def _post_pull(client: httpx.AsyncClient, model: str) -> dict:
+    async with _tracked():
         resp = await client.post(
             f"{settings.ollama_url}/api/pull",
             json={"name": model, "stream": False},
+            timeout=_pull_timeout(),
         )
         resp.raise_for_status()
-        return resp.json()
+    return resp.json()
+
+
+async def pull_model(model: str) -> dict:
+    model = (model or "").strip()
+    if not model:
+        raise ValueError("Nom de modèle requis")
+    return await _pulls.do(model, _post_pull, http_client(), model)
 
 
 def _is_model_not_found(resp: httpx.Response) -> bool:
@@ -55,7 +277,8 @@ def _is_model_not_found(resp: httpx.Response) -> bool:
 async def _embed_via_legacy(client: httpx.AsyncClient, text: str, model: str) -> list[float]:
     resp = await client.post(
         f"{settings.ollama_url}/api/embeddings",
-        json={"model": model, "prompt": text},
+        json={"model": model, "prompt": text, "keep_alive": settings.ollama_keep_alive},
+        timeout=_embed_timeout(),
     )
     resp.raise_for_status()
     data = resp.json()
@@ -65,67 +288,140 @@ async def _embed_via_legacy(client: httpx.AsyncClient, text: str, model: str) ->
     return vector
 
 
-async def _embed_via_current(client: httpx.AsyncClient, text: str, model: str) -> list[float]:
+async def _embed_via_current(client: httpx.AsyncClient, texts: list[str], model: str) -> list[list[float]]:
     resp = await client.post(
         f"{settings.ollama_url}/api/embed",
-        json={"model": model, "input": text},
+        json={"model": model, "input": texts, "keep_alive": settings.ollama_keep_alive},
+        timeout=_embed_timeout(),
     )
     resp.raise_for_status()
     data = resp.json()
     embeds = data.get("embeddings") or []
-    if not embeds:
+    if len(embeds) != len(texts):
         raise ValueError("Réponse /api/embed sans embeddings")
-    return embeds[0]
+    return embeds
 
 
 async def _attempt_pull_model(client: httpx.AsyncClient, model: str):
-    resp = await client.post(
-        f"{settings.ollama_url}/api/pull",
-        json={"name": model, "stream": False},
-        timeout=600,
-    )
-    resp.raise_for_status()
+    await _pulls.do(model, _post_pull, client, model)
 
 
-async def _embed_one_text(client: httpx.AsyncClient, text: str, model: str) -> list[float]:
+# Route d'embedding retenue (modèle + endpoint) pour ne plus re-sonder à chaque appel
+_embed_route: dict[str, str] = {}
+
+
+def _embed_model_candidates() -> list[str]:
+    candidates = [settings.ollama_embedding_model]
+    if settings.ollama_chat_model not in candidates:
+        candidates.append(settings.ollama_chat_model)
+    return candidates
+
+
+async def _embed_batch(client: httpx.AsyncClient, texts: list[str], model: str, endpoint: str) -> list[list[float]]:
+    if endpoint == "embed":
+        return await _embed_via_current(client, texts, model)
+    return [await _embed_via_legacy(client, text, model) for text in texts]
+
+
+async def _embed_batch_any_endpoint(client: httpx.AsyncClient, texts: list[str], model: str) -> tuple[list[list[float]], str]:
     try:
-        return await _embed_via_legacy(client, text, model)
-    except httpx.HTTPStatusError as exc_legacy:
-        if exc_legacy.response.status_code == 404:
-            return await _embed_via_current(client, text, model)
+        return await _embed_via_current(client, texts, model), "embed"
+    except httpx.HTTPStatusError as exc:
+        # 404 sans "model not found": ancienne version d'Ollama sans /api/embed
+        if exc.response.status_code == 404 and not _is_model_not_found(exc.response):
+            return await _embed_batch(client, texts, model, "embeddings"), "embeddings"
         raise
 
 
-async def embed_texts(texts: list[str]) -> list[list[float]]:
-    embeddings: list[list[float]] = []
-    model_candidates = [settings.ollama_embedding_model]
-    if settings.ollama_chat_model not in model_candidates:
-        model_candidates.append(settings.ollama_chat_model)
-
-    async with httpx.AsyncClient(timeout=120) as client:
-        for text in texts:
-            if not text or not text.strip():
-                continue
-            last_exc: Exception | None = None
-            embedded = False
-            for model in model_candidates:
-                for attempt in range(2):
-                    try:
-                        embeddings.append(await _embed_one_text(client, text, model))
-                        embedded = True
-                        break
-                    except httpx.HTTPStatusError as exc:
-                        last_exc = exc
-                        if attempt == 0 and _is_model_not_found(exc.response):
-                            await _attempt_pull_model(client, model)
-                            continue
-                        if exc.response.status_code in (404, 400, 422) and _is_model_not_found(exc.response):
-                            break
-                        raise
-                if embedded:
+async def _probe_embed_batch(client: httpx.AsyncClient, texts: list[str]) -> list[list[float]]:
+    last_exc: Exception | None = None
+    for model in _embed_model_candidates():
+        for attempt in range(2):
+            try:
+                vectors, endpoint = await _embed_batch_any_endpoint(client, texts, model)
+                _embed_route.update(model=model, endpoint=endpoint)
+                return vectors
+            except httpx.HTTPStatusError as exc:
+                last_exc = exc
+                if attempt == 0 and _is_model_not_found(exc.response):
+                    await _attempt_pull_model(client, model)
+                    continue
+                if exc.response.status_code in (404, 400, 422) and _is_model_not_found(exc.response):
                     break
-            if not embedded:
-                if last_exc:
-                    raise last_exc
-                raise RuntimeError("Aucun embedding produit")
-    return embeddings
+                raise
+    if last_exc:
+        raise last_exc
+    raise RuntimeError("Aucun embedding produit")
+
+
+async def _embed_routed_batch(client: httpx.AsyncClient, texts: list[str]) -> list[list[float]]:
+    if not _embed_route:
+        return await _probe_embed_batch(client, texts)
+    try:
+        return await _embed_batch(client, texts, _embed_route["model"], _embed_route["endpoint"])
+    except httpx.HTTPStatusError as exc:
+        if _is_model_not_found(exc.response):
+            # Modèle supprimé entre-temps: on oublie la route et on re-sonde
+            _embed_route.clear()
+            return await _probe_embed_batch(client, texts)
+        raise
+
+
+async def _embed_uncached(pending: list[str]) -> list[list[float]]:
+    batch_size = max(1, settings.ollama_embed_batch_size)
+    batches = [pending[i : i + batch_size] for i in range(0, len(pending), batch_size)]
+    results: list[list[list[float]]] = [[] for _ in batches]
+
+    client = http_client()
+    first = 0
+    if not _embed_route:
+        # Route inconnue: premier lot seul pour résoudre modèle/endpoint une fois avant de paralléliser
+        async with _tracked():
+            results[0] = await _guarded(_embed_routed_batch, client, batches[0])
+        first = 1
+    if len(batches) > first:
+        semaphore = asyncio.Semaphore(max(1, settings.ollama_embed_concurrency))
+
+        async def _run(index: int):
+            async with semaphore, _tracked():
+                results[index] = await _guarded(_embed_routed_batch, client, batches[index])
+
+        await asyncio.gather(*(_run(i) for i in range(first, len(batches))))
+
+    return [vector for batch in results for vector in batch]
+
+
+def current_embedding_model() -> str:
+    return _embed_route.get("model") or settings.ollama_embedding_model
+
+
+async def embed_texts(texts: list[str]) -> list[list[float] | None]:
+    # Une entrée par texte, dans l'ordre: les textes vides ne sont pas envoyés et valent None
+    positions = [i for i, text in enumerate(texts) if text and text.strip()]
+    results: list[list[float] | None] = [None] * len(texts)
+    if positions:
+        for i, vector in zip(positions, await _embed_non_blank([texts[i] for i in positions])):
+            results[i] = vector
+    return results
+
+
+async def _embed_non_blank(pending: list[str]) -> list[list[float]]:
+    if not settings.embedding_cache_enabled:
+        return await _embed_uncached(pending)
+
+    model = current_embedding_model()
+    vectors = await asyncio.to_thread(embedding_cache.get_many, model, pending)
+    misses = [i for i, v in enumerate(vectors) if v is None]
+    if not misses:
+        return vectors
+
+    fresh = await _embed_uncached([pending[i] for i in misses])
+    resolved = _embed_route.get("model", model)
+    if resolved != model and len(misses) < len(pending):
+        # Le sondage a retenu un autre modèle: les vecteurs en cache ne sont pas comparables
+        misses = list(range(len(pending)))
+        fresh = await _embed_uncached(pending)
+    for i, vector in zip(misses, fresh):
+        vectors[i] = vector
+    await asyncio.to_thread(embedding_cache.put_many, resolved, [pending[i] for i in misses], fresh)
+    return vectors
@@ -1,14 +1,27 @@
+import asyncio
+import hashlib
 import json
-import re
+import multiprocessing
+import time
 import uuid
+from array import array
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import httpx
+import numpy as np
 from pypdf import PdfReader
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient
 from qdrant_client.http.models import Distance, PointStruct, VectorParams
 
 from app.core.config import settings
-from app.services.ollama import embed_texts
+from app.services import answer_cache, chunk_store, embedding_cache, lexical, vector_store
+from app.services.cache import TTLCache
+from app.services.chunking import chunk_pages
+from app.services.ollama import current_embedding_model, embed_texts
+from app.services.singleflight import SingleFlight
 
 
 def chunk_text(text: str, chunk_size: int = 900, overlap: int = 150) -> list[str]:
@@ -29,138 +42,831 @@ def extract_pdf_pages(path: Path) -> list[tuple[int, str]]:
     return pages
 
 
-def qdrant() -> QdrantClient:
-    return QdrantClient(url=settings.qdrant_url)
+# Pool de processus pour l'extraction/découpage PDF (CPU), hors de la boucle d'événements
+_extract_pool: ProcessPoolExecutor | None = None
 
 
-def _chunk_cache_dir() -> Path:
-    p = Path(settings.storage_root) / "chunks"
-    p.mkdir(parents=True, exist_ok=True)
-    return p
+def start_extraction_pool():
+    global _extract_pool
+    if _extract_pool is None and settings.pdf_extract_workers > 0:
+        _extract_pool = ProcessPoolExecutor(
+            max_workers=settings.pdf_extract_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+
+def close_extraction_pool():
+    global _extract_pool
+    if _extract_pool is not None:
+        _extract_pool.shutdown(wait=False, cancel_futures=True)
+        _extract_pool = None
+
+
+def _count_pdf_pages(path: str) -> int:
+    return len(PdfReader(path).pages)
+
+
+def _extract_page_range(path: str, start: int, end: int) -> list[tuple[int, list[str]]]:
+    reader = PdfReader(path)
+    pages = [(i + 1, reader.pages[i].extract_text() or "") for i in range(start, end)]
+    if settings.chunker == "window":
+        return [(page, chunk_text(text)) for page, text in pages]
+    # Découpage structurel de toute la plage en une passe (pages courtes jointes)
+    return chunk_pages(pages)
+
+
+async def count_pdf_pages(path: Path) -> int:
+    return await asyncio.get_running_loop().run_in_executor(_extract_pool, _count_pdf_pages, str(path))
+
+
+async def iter_page_chunks(path: Path, n_pages: int | None = None) -> AsyncIterator[tuple[int, list[str]]]:
+    # Sans pool (lifespan non démarré), l'exécuteur par défaut garde au moins la boucle libre
+    loop = asyncio.get_running_loop()
+    executor = _extract_pool
+    if n_pages is None:
+        n_pages = await count_pdf_pages(path)
+    span = n_pages if n_pages < settings.pdf_parallel_min_pages else max(1, settings.pdf_pages_per_task)
+    ranges = deque((start, min(n_pages, start + span)) for start in range(0, n_pages, span))
+    window = max(1, settings.pdf_extract_workers) * 2
+
+    in_flight: deque = deque()
+    while ranges or in_flight:
+        # Fenêtre bornée de plages en cours: les pages reviennent dans l'ordre, sans tout garder en mémoire
+        while ranges and len(in_flight) < window:
+            start, end = ranges.popleft()
+            in_flight.append(loop.run_in_executor(executor, _extract_page_range, str(path), start, end))
+        for page, chunks in await in_flight.popleft():
+            yield page, chunks
+
+
+# Client Qdrant asynchrone partagé, ouvert/fermé par le lifespan de l'app
+_qdrant: AsyncQdrantClient | None = None
+# Collections dont l'existence est déjà vérifiée (évite get_collections à chaque ingestion)
+_known_collections: set[str] = set()
+
+
+def _build_qdrant() -> AsyncQdrantClient:
+    return AsyncQdrantClient(
+        url=settings.qdrant_url,
+        timeout=settings.qdrant_timeout,
+        limits=httpx.Limits(
+            max_connections=settings.qdrant_pool_max_connections,
+            max_keepalive_connections=settings.qdrant_pool_max_connections,
+        ),
+    )
+
+
+async def start_qdrant():
+    global _qdrant
+    if _qdrant is None:
+        _qdrant = _build_qdrant()
+
+
+async def close_qdrant():
+    global _qdrant
+    if _qdrant is not None:
+        await _qdrant.close()
+        _qdrant = None
+    _known_collections.clear()
+
+
+def qdrant() -> AsyncQdrantClient:
+    # Création paresseuse si le lifespan n'a pas tourné (scripts, tests)
+    global _qdrant
+    if _qdrant is None:
+        _qdrant = _build_qdrant()
+    return _qdrant
+
+
+# Cache requête -> vecteur, puis (vecteur, doc_ids, top_k) -> résultats
+_query_vectors = TTLCache(settings.rag_cache_max_entries, settings.rag_cache_ttl_seconds)
+_retrievals = TTLCache(settings.rag_cache_max_entries, settings.rag_cache_ttl_seconds)
+# Requêtes identiques simultanées (classe entière sur la même consigne): un seul embedding/recherche
+_embed_flights = SingleFlight()
+_retrieve_flights = SingleFlight()
+_retrieval_stats = {
+    "vector_timeouts": 0,
+    "vector_errors": 0,
+    "lexical_timeouts": 0,
+    "lexical_errors": 0,
+    "local_vector_searches": 0,
+}
+_qdrant_down_until = [0.0]
+
+
+def _normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def _vector_key(vector: list[float]) -> str:
+    return hashlib.sha1(array("f", vector).tobytes()).hexdigest()
+
+
+def invalidate_documents(doc_ids: list[int]):
+    touched = set(doc_ids)
+    # Une recherche sans filtre couvre toute la bibliothèque: elle est aussi périmée
+    _retrievals.invalidate(lambda key: not key[1] or bool(touched.intersection(key[1])))
+    answer_cache.invalidate_documents(doc_ids)
+
+
+def cache_stats() -> dict:
+    return {
+        "query_vectors": _query_vectors.stats(),
+        "retrievals": _retrievals.stats(),
+        "embed_flights": _embed_flights.stats(),
+        "retrieve_flights": _retrieve_flights.stats(),
+        "retrieval_paths": dict(_retrieval_stats),
+    }
 
 
-def _cache_path(doc_id: int) -> Path:
-    return _chunk_cache_dir() / f"{doc_id}.json"
+async def _embed_query_uncached(key: tuple, query: str) -> list[float]:
+    vector = (await embed_texts([query]))[0]
+    if vector is None:
+        raise ValueError("Question vide: aucun embedding possible")
+    # Le routage a pu basculer sur le modèle de secours pendant l'appel: rangé sous le modèle effectif
+    _query_vectors.set((current_embedding_model(), key[1]), vector)
+    return vector
+
+
+async def embed_query(query: str) -> list[float]:
+    key = (current_embedding_model(), _normalize_query(query))
+    vector = _query_vectors.get(key)
+    if vector is None:
+        vector = await _embed_flights.do(key, _embed_query_uncached, key, query)
+    return vector
+
+
+def _chunk_cache_dir() -> Path:
+    # Ancien emplacement des caches JSON par document, lu uniquement par la migration
+    return Path(settings.storage_root) / "chunks"
 
 
 def _save_local_chunks(doc_id: int, chunks: list[dict]):
-    _cache_path(doc_id).write_text(json.dumps(chunks, ensure_ascii=False), encoding="utf-8")
+    chunk_store.save_document(doc_id, chunks)
 
 
 def _load_local_chunks(doc_ids: list[int] | None = None) -> list[dict]:
-    files = []
-    if doc_ids:
-        files = [_cache_path(did) for did in doc_ids if _cache_path(did).exists()]
-    else:
-        files = list(_chunk_cache_dir().glob("*.json"))
+    return chunk_store.load_documents(doc_ids)
 
-    out: list[dict] = []
-    for f in files:
-        try:
-            out.extend(json.loads(f.read_text(encoding="utf-8")))
-        except Exception:
+
+def _fetch_local_chunks(refs: list[dict]) -> list[dict]:
+    # Lecture directe des chunks référencés, sans charger leurs documents
+    return chunk_store.fetch_refs(refs)
+
+
+def migrate_local_chunks() -> int:
+    return chunk_store.migrate_json(_chunk_cache_dir())
+
+
+def _reindex_lexical(doc_id: int):
+    # L'index lexical référence les chunks par (doc_id, seq): toujours reconstruit depuis les chunks publiés
+    lexical.index_document(doc_id, [c["text"] for c in chunk_store.load_documents([doc_id])])
+
+
+def _sync_lexical_index():
+    indexed = lexical.indexed_doc_ids()
+    for doc_id in chunk_store.doc_ids():
+        if doc_id not in indexed:
+            _reindex_lexical(doc_id)
+
+
+def _sync_local_vectors():
+    # Documents ingérés avant la copie locale: vecteurs repris du cache d'embeddings s'ils y sont tous
+    if not settings.local_vectors_enabled:
+        return
+    stored = vector_store.indexed_doc_ids()
+    model = current_embedding_model()
+    for doc_id in chunk_store.doc_ids():
+        if doc_id in stored:
+            continue
+        chunks = [c for c in chunk_store.load_documents([doc_id]) if c.get("id")]
+        if not chunks:
             continue
-    return out
+        vectors = embedding_cache.get_many(model, [c["text"] for c in chunks], count=False)
+        if all(v is not None for v in vectors):
+            vector_store.add_points(chunks, vectors)
 
 
-def _lexical_score(query: str, text: str) -> int:
-    q_terms = {t for t in re.findall(r"\w+", query.lower()) if len(t) >= 3}
-    if not q_terms:
-        return 0
-    t_terms = set(re.findall(r"\w+", (text or "").lower()))
-    return len(q_terms.intersection(t_terms))
+async def sync_local_vectors():
+    await asyncio.to_thread(_sync_local_vectors)
+
+
+async def sync_lexical_index():
+    # Migre les anciens caches JSON puis indexe les documents antérieurs à l'index lexical
+    await asyncio.to_thread(migrate_local_chunks)
+    await asyncio.to_thread(_sync_lexical_index)
 
 
 async def ensure_collection(vector_size: int = 768):
+    name = settings.qdrant_collection
+    if name in _known_collections:
+        return
     client = qdrant()
-    collections = [c.name for c in client.get_collections().collections]
-    if settings.qdrant_collection not in collections:
-        client.create_collection(
-            collection_name=settings.qdrant_collection,
+    if not await client.collection_exists(name):
+        await client.create_collection(
+            collection_name=name,
             vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE),
         )
+    _known_collections.add(name)
 
 
-async def ingest_document(doc_id: int, path: Path, title: str):
-    page_chunks = []
-    for page, text in extract_pdf_pages(path):
-        for chunk in chunk_text(text):
-            page_chunks.append({"page": page, "text": chunk, "doc_id": doc_id, "title": title})
+def _checkpoint_path(doc_id: int) -> Path:
+    p = Path(settings.storage_root) / "ingest"
+    p.mkdir(parents=True, exist_ok=True)
+    return p / f"{doc_id}.json"
 
-    if not page_chunks:
-        return
 
-    # Toujours garder une copie locale: permet une recherche lexicale de secours
-    _save_local_chunks(doc_id, page_chunks)
+def _load_checkpoint(doc_id: int) -> int:
+    try:
+        return int(json.loads(_checkpoint_path(doc_id).read_text(encoding="utf-8")).get("committed", 0))
+    except Exception:
+        return 0
+
 
-    # Ingestion vectorielle (best-effort)
+def _save_checkpoint(doc_id: int, committed: int, purge: bool = False):
+    path = _checkpoint_path(doc_id)
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps({"committed": committed, "purge": purge}), encoding="utf-8")
+    tmp.replace(path)
+
+
+def _checkpoint_purge(doc_id: int) -> bool:
+    # Points Qdrant orphelins (diff interrompu): le document sera purgé avant sa ré-ingestion
     try:
-        vectors = await embed_texts([c["text"] for c in page_chunks])
-        await ensure_collection(len(vectors[0]))
-        points = [
-            PointStruct(
-                id=str(uuid.uuid4()),
-                vector=vector,
-                payload={
-                    "doc_id": ch["doc_id"],
-                    "title": ch["title"],
-                    "page": ch["page"],
-                    "text": ch["text"],
-                },
-            )
-            for vector, ch in zip(vectors, page_chunks)
-        ]
-        qdrant().upsert(collection_name=settings.qdrant_collection, points=points)
+        return bool(json.loads(_checkpoint_path(doc_id).read_text(encoding="utf-8")).get("purge"))
+    except Exception:
+        return False
+
+
+def _ingest_batch_size() -> int:
+    # 0 = un tour complet d'embeddings parallèles (lots Ollama x concurrence) par lot d'ingestion
+    if settings.ingest_batch_size > 0:
+        return settings.ingest_batch_size
+    return max(1, settings.ollama_embed_batch_size) * max(1, settings.ollama_embed_concurrency)
+
+
+def _has_checkpoint(doc_id: int) -> bool:
+    # Présent du début de l'ingestion jusqu'à sa fin complète, même avant le premier lot validé
+    return _checkpoint_path(doc_id).exists()
+
+
+def _clear_checkpoint(doc_id: int):
+    _checkpoint_path(doc_id).unlink(missing_ok=True)
+
+
+async def _with_retries(fn, *args):
+    attempts = max(0, settings.ingest_batch_retries) + 1
+    for attempt in range(attempts):
+        try:
+            return await fn(*args)
+        except Exception:
+            if attempt == attempts - 1:
+                raise
+            await asyncio.sleep(settings.ingest_retry_backoff_seconds * 2**attempt)
+
+
+# Espace de noms fixe: un même chunk (document, page, rang, contenu) garde toujours le même id de point
+_POINT_NAMESPACE = uuid.UUID("5b0d7c1e-3f7a-4a55-9a51-6f0c1d2e8b41")
+
+
+def chunk_point_id(doc_id: int, page: int, index: int, text: str) -> str:
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return str(uuid.uuid5(_POINT_NAMESPACE, f"{doc_id}:{page}:{index}:{digest}"))
+
+
+def _chunk_record(doc_id: int, title: str, page: int, index: int, text: str) -> dict:
+    return {
+        "id": chunk_point_id(doc_id, page, index, text),
+        "page": page,
+        "chunk": index,
+        "text": text,
+        "doc_id": doc_id,
+        "title": title,
+    }
+
+
+def _point_id(chunk: dict) -> str:
+    return chunk.get("id") or chunk_point_id(chunk["doc_id"], chunk["page"], chunk.get("chunk", 0), chunk["text"])
+
+
+def _store_local_vectors(chunks: list[dict], vectors: list[list[float]]):
+    # Copie locale best-effort: la recherche sémantique de secours ne doit jamais bloquer l'ingestion
+    if not settings.local_vectors_enabled:
+        return
+    try:
+        vector_store.add_points([{**c, "id": _point_id(c)} for c in chunks], vectors)
     except Exception:
-        # On laisse la voie locale active même si embeddings/Qdrant indisponibles.
         pass
 
 
+async def _upsert_batch(chunks: list[dict], vectors: list[list[float] | None]):
+    # Texte vide (vecteur None): rien à indexer pour ce chunk
+    pairs = [(ch, vector) for ch, vector in zip(chunks, vectors) if vector is not None]
+    if not pairs:
+        return
+    chunks, vectors = [ch for ch, _ in pairs], [vector for _, vector in pairs]
+    await asyncio.to_thread(_store_local_vectors, chunks, vectors)
+    await ensure_collection(len(vectors[0]))
+    points = [
+        PointStruct(
+            id=_point_id(ch),
+            vector=vector,
+            payload={
+                "doc_id": ch["doc_id"],
+                "title": ch["title"],
+                "page": ch["page"],
+                "chunk": ch.get("chunk", 0),
+                "text": ch["text"],
+            },
+        )
+        for vector, ch in zip(vectors, chunks)
+    ]
+    try:
+        await qdrant().upsert(collection_name=settings.qdrant_collection, points=points)
+    except Exception:
+        # La collection a pu être supprimée: on revérifiera au prochain ensure_collection.
+        _known_collections.discard(settings.qdrant_collection)
+        raise
+
+
+async def ingest_document(
+    doc_id: int,
+    path: Path,
+    title: str,
+    on_progress: Callable[[dict], None] | None = None,
+    throttle: Callable[[], Awaitable[None]] | None = None,
+) -> dict:
+    # Pipeline en flux: pages -> lots de chunks -> embeddings -> upserts, files bornées entre étapes.
+    # Le dernier lot vectoriel validé est mémorisé: une ingestion échouée reprend à partir de là.
+    committed = _load_checkpoint(doc_id)
+    await asyncio.to_thread(_save_checkpoint, doc_id, committed)
+    batch_size = _ingest_batch_size()
+    chunk_queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, settings.ingest_queue_size))
+    vector_queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, settings.ingest_queue_size))
+    summary = {"pages_total": 0, "pages": 0, "chunks": 0, "vectors": committed, "complete": False, "error": None}
+
+    def report():
+        if on_progress:
+            on_progress(summary)
+
+    async def produce():
+        writer = await asyncio.to_thread(chunk_store.DocumentWriter, doc_id, title)
+        try:
+            # Toujours garder une copie locale: permet une recherche lexicale de secours
+            batch: list[dict] = []
+
+            async def flush():
+                await asyncio.to_thread(writer.write, list(batch))
+                await chunk_queue.put((summary["chunks"], list(batch)))
+                summary["chunks"] += len(batch)
+                batch.clear()
+
+            summary["pages_total"] = await count_pdf_pages(path)
+            report()
+            async for page, chunks in iter_page_chunks(path, summary["pages_total"]):
+                summary["pages"] += 1
+                for index, chunk in enumerate(chunks):
+                    batch.append(_chunk_record(doc_id, title, page, index, chunk))
+                    if len(batch) >= batch_size:
+                        await flush()
+                report()
+            if batch:
+                await flush()
+            await asyncio.to_thread(writer.commit)
+            # Index lexical remplacé seulement une fois les chunks publiés: après un abandon, l'ancien reste cohérent
+            await asyncio.to_thread(_reindex_lexical, doc_id)
+        except BaseException:
+            writer.abort()
+            raise
+        await chunk_queue.put(None)
+
+    async def embed():
+        # Ingestion vectorielle (best-effort): après échec, on draine la file sans bloquer la copie locale
+        while (item := await chunk_queue.get()) is not None:
+            start, batch = item
+            if summary["error"] or start + len(batch) <= committed:
+                continue
+            if start < committed:
+                batch, start = batch[committed - start :], committed
+            if throttle:
+                await throttle()
+            try:
+                vectors = await _with_retries(embed_texts, [c["text"] for c in batch])
+            except Exception as exc:
+                summary["error"] = f"embeddings: {exc}"
+                continue
+            await vector_queue.put((start, batch, vectors))
+        await vector_queue.put(None)
+
+    async def upsert():
+        while (item := await vector_queue.get()) is not None:
+            start, batch, vectors = item
+            if summary["error"]:
+                continue
+            try:
+                await _with_retries(_upsert_batch, batch, vectors)
+            except Exception as exc:
+                summary["error"] = f"qdrant: {exc}"
+                continue
+            summary["vectors"] = start + len(batch)
+            await asyncio.to_thread(_save_checkpoint, doc_id, summary["vectors"])
+            report()
+
+    try:
+        async with asyncio.TaskGroup() as group:
+            group.create_task(produce())
+            group.create_task(embed())
+            group.create_task(upsert())
+    except ExceptionGroup as eg:
+        raise eg.exceptions[0]
+    finally:
+        invalidate_documents([doc_id])
+
+    if not summary["error"] and summary["vectors"] >= summary["chunks"]:
+        summary["complete"] = True
+        await asyncio.to_thread(_clear_checkpoint, doc_id)
+    report()
+    return summary
+
+
+async def _delete_points(ids: list[str]):
+    from qdrant_client.http.models import PointIdsList
+
+    await asyncio.to_thread(vector_store.remove_points, ids)
+    await qdrant().delete(collection_name=settings.qdrant_collection, points_selector=PointIdsList(points=ids))
+
+
+async def _delete_document_points(doc_id: int):
+    from qdrant_client.http.models import FieldCondition, Filter, MatchValue
+
+    await asyncio.to_thread(vector_store.remove_document, doc_id)
+    await qdrant().delete(
+        collection_name=settings.qdrant_collection,
+        points_selector=Filter(must=[FieldCondition(key="doc_id", match=MatchValue(value=doc_id))]),
+    )
+
+
+async def _existing_point_ids(ids: list[str]) -> set[str]:
+    # Points réellement présents dans Qdrant: la collection a pu être vidée ou recréée depuis l'ingestion
+    client = qdrant()
+    if not ids or not await client.collection_exists(settings.qdrant_collection):
+        return set()
+    found: set[str] = set()
+    for start in range(0, len(ids), 256):
+        points = await client.retrieve(
+            collection_name=settings.qdrant_collection, ids=ids[start : start + 256], with_payload=False, with_vectors=False
+        )
+        found.update(str(p.id) for p in points)
+    return found
+
+
+async def reindex_document(
+    doc_id: int,
+    path: Path,
+    title: str,
+    on_progress: Callable[[dict], None] | None = None,
+    throttle: Callable[[], Awaitable[None]] | None = None,
+) -> dict:
+    # Ré-ingestion incrémentale: diff entre les chunks extraits et ceux déjà indexés (ids déterministes).
+    # Seuls les chunks nouveaux ou modifiés sont vectorisés; les points disparus sont supprimés.
+    previous = await asyncio.to_thread(_load_local_chunks, [doc_id])
+    if not previous or _has_checkpoint(doc_id):
+        # Première ingestion ou reprise après échec: pipeline complet
+        if _checkpoint_purge(doc_id):
+            await _with_retries(_delete_document_points, doc_id)
+        return await ingest_document(doc_id, path, title, on_progress=on_progress, throttle=throttle)
+    if any("id" not in c for c in previous):
+        # Points antérieurs aux ids déterministes (uuid4): on repart d'une collection propre
+        await _with_retries(_delete_document_points, doc_id)
+        return await ingest_document(doc_id, path, title, on_progress=on_progress, throttle=throttle)
+
+    summary = {"pages_total": 0, "pages": 0, "chunks": 0, "vectors": 0, "complete": False, "error": None, "reused": 0, "deleted": 0}
+
+    def report():
+        if on_progress:
+            on_progress(summary)
+
+    summary["pages_total"] = await count_pdf_pages(path)
+    report()
+    chunks: list[dict] = []
+    async for page, texts in iter_page_chunks(path, summary["pages_total"]):
+        summary["pages"] += 1
+        chunks.extend(_chunk_record(doc_id, title, page, index, text) for index, text in enumerate(texts))
+        report()
+    summary["chunks"] = len(chunks)
+
+    current = {c["id"] for c in chunks}
+    vanished = list({c["id"] for c in previous} - current)
+    local = {c["id"] for c in previous if c.get("indexed", True)}
+    for chunk in chunks:
+        if chunk["id"] not in local:
+            chunk["indexed"] = False
+    # Nouveau texte publié avant toute opération Qdrant: la recherche lexicale reste à jour si Qdrant est indisponible
+    await asyncio.to_thread(_save_local_chunks, doc_id, chunks)
+    await asyncio.to_thread(lexical.index_document, doc_id, [c["text"] for c in chunks])
+    invalidate_documents([doc_id])
+
+    try:
+        # Réutilisés: marqués indexés localement et encore présents dans Qdrant
+        indexed = await _with_retries(_existing_point_ids, sorted(local & current))
+        if vanished:
+            await _with_retries(_delete_points, vanished)
+            summary["deleted"] = len(vanished)
+    except Exception as exc:
+        summary["error"] = f"qdrant: {exc}"
+        if vanished:
+            # Les points disparus ne sont plus référencés localement: purge complète au prochain passage
+            await asyncio.to_thread(_save_checkpoint, doc_id, 0, True)
+        report()
+        return summary
+    changed = [c for c in chunks if c["id"] not in indexed]
+    summary["reused"] = summary["vectors"] = len(chunks) - len(changed)
+
+    batch_size = _ingest_batch_size()
+    for start in range(0, len(changed), batch_size):
+        batch = changed[start : start + batch_size]
+        if throttle:
+            await throttle()
+        try:
+            vectors = await _with_retries(embed_texts, [c["text"] for c in batch])
+            await _with_retries(_upsert_batch, batch, vectors)
+        except Exception as exc:
+            # Chunks restants marqués non indexés: repris au prochain ré-indexage
+            summary["error"] = f"reindex: {exc}"
+            for chunk in changed[start:]:
+                chunk["indexed"] = False
+            break
+        for chunk in batch:
+            chunk["indexed"] = True
+        summary["vectors"] += len(batch)
+        report()
+
+    await asyncio.to_thread(_save_local_chunks, doc_id, chunks)
+    invalidate_documents([doc_id])
+    summary["complete"] = summary["error"] is None
+    report()
+    return summary
+
+
 async def retrieve(query: str, doc_ids: list[int] | None = None, top_k: int = 4):
-    # 1) tentative vectorielle
+    key = (_normalize_query(query), tuple(sorted({int(d) for d in doc_ids or []})), top_k)
+    return list(await _retrieve_flights.do(key, _retrieve, query, doc_ids, top_k))
+
+
+async def _vector_hits(query: str, doc_ids: list[int] | None, limit: int) -> tuple[list[float], list[dict], str]:
+    vector = await embed_query(query)
+    cache_key = (_vector_key(vector), tuple(sorted({int(d) for d in doc_ids or []})), limit)
+    cached = _retrievals.get(cache_key)
+    if cached is not None:
+        return vector, list(cached), "vector"
+    if time.monotonic() < _qdrant_down_until[0]:
+        return vector, await asyncio.to_thread(_local_vector_hits, vector, doc_ids, limit), "local_vector"
+    flt = None
+    if doc_ids:
+        from qdrant_client.http.models import FieldCondition, Filter, MatchAny
+
+        flt = Filter(must=[FieldCondition(key="doc_id", match=MatchAny(any=doc_ids))])
     try:
-        vector = (await embed_texts([query]))[0]
-        flt = None
-        if doc_ids:
-            from qdrant_client.http.models import FieldCondition, Filter, MatchAny
-
-            flt = Filter(must=[FieldCondition(key="doc_id", match=MatchAny(any=doc_ids))])
-        hits = qdrant().search(collection_name=settings.qdrant_collection, query_vector=vector, limit=top_k, query_filter=flt)
-        payloads = [h.payload for h in hits]
-        if payloads:
-            return payloads
+        hits = await qdrant().search(
+            collection_name=settings.qdrant_collection, query_vector=vector, limit=limit, query_filter=flt, with_vectors=True
+        )
     except Exception:
-        pass
+        # Qdrant injoignable: recherche cosinus sur la copie locale, sans re-tenter Qdrant pendant un moment
+        _qdrant_down_until[0] = time.monotonic() + settings.qdrant_retry_seconds
+        return vector, await asyncio.to_thread(_local_vector_hits, vector, doc_ids, limit), "local_vector"
+    _qdrant_down_until[0] = 0.0
+    # Vecteurs stockés gardés (float32) pour la diversification MMR
+    payloads = [
+        {**h.payload, "_vector": np.asarray(h.vector, dtype=np.float32)} if getattr(h, "vector", None) else h.payload
+        for h in hits
+    ]
+    if payloads:
+        _retrievals.set(cache_key, payloads)
+    return vector, payloads, "vector"
+
+
+def _local_vector_hits(vector: list[float], doc_ids: list[int] | None, limit: int) -> list[dict]:
+    if not settings.local_vectors_enabled:
+        return []
+    matches = vector_store.search(vector, doc_ids, limit)
+    by_id = chunk_store.fetch_ids([m["point_id"] for m in matches])
+    stored = vector_store.get_vectors([m["point_id"] for m in matches])
+    _retrieval_stats["local_vector_searches"] += 1
+    return [
+        {**by_id[m["point_id"]], "_vector": stored[m["point_id"]]} if m["point_id"] in stored else by_id[m["point_id"]]
+        for m in matches
+        if m["point_id"] in by_id
+    ]
+
+
+async def _lexical_hits(query: str, doc_ids: list[int] | None, limit: int) -> list[dict]:
+    refs = await asyncio.to_thread(lexical.search, query, doc_ids, limit)
+    return await asyncio.to_thread(_fetch_local_chunks, refs)
+
+
+def _hit_key(hit: dict) -> tuple:
+    return (hit.get("doc_id"), hit.get("page"), hit.get("text"))
+
+
+def fuse_rrf(ranked: dict[str, list[dict]], top_k: int) -> list[dict]:
+    # Reciprocal-rank fusion: score = somme des 1 / (k + rang) sur chaque voie ayant trouvé le passage
+    fused: dict[tuple, dict] = {}
+    for source, hits in ranked.items():
+        for rank, hit in enumerate(hits, start=1):
+            entry = fused.setdefault(_hit_key(hit), {**hit, "sources": [], "rrf_score": 0.0})
+            if source not in entry["sources"]:
+                entry["sources"].append(source)
+                entry["rrf_score"] += 1.0 / (settings.retrieve_rrf_k + rank)
+    return sorted(fused.values(), key=lambda h: h["rrf_score"], reverse=True)[:top_k]
+
+
+def _attach_cached_vectors(hits: list[dict]):
+    # Passages trouvés par la seule voie lexicale: vecteurs repris du cache d'embeddings de l'ingestion
+    missing = [h for h in hits if "_vector" not in h]
+    if not missing:
+        return
+    vectors = embedding_cache.get_many(current_embedding_model(), [h["text"] for h in missing], count=False)
+    for hit, vector in zip(missing, vectors):
+        if vector is not None:
+            hit["_vector"] = np.asarray(vector, dtype=np.float32)
+
+
+def mmr_select(
+    hits: list[dict],
+    query_vector: list[float] | None,
+    top_k: int,
+    required_doc_ids: list[int] | None = None,
+    lambda_: float | None = None,
+) -> list[dict]:
+    # Maximal Marginal Relevance: lambda * pertinence - (1 - lambda) * similarité max aux passages déjà retenus.
+    # Les similarités sont calculées en une seule multiplication matricielle; un passage par document requis d'abord.
+    if len(hits) <= 1:
+        return hits[:top_k]
+    lambda_ = settings.mmr_lambda if lambda_ is None else lambda_
+    n = len(hits)
+    dims = {h["_vector"].shape[0] for h in hits if "_vector" in h}
+    if query_vector is not None:
+        dims.add(len(query_vector))
+    vectors = np.zeros((n, dims.pop() if len(dims) == 1 else 0), dtype=np.float32)
+    if vectors.shape[1]:
+        for i, hit in enumerate(hits):
+            if "_vector" in hit:
+                vectors[i] = hit["_vector"]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+    # Pertinence: cosinus à la requête si disponible, sinon rang de fusion
+    relevance = 1.0 / (1.0 + np.arange(n, dtype=np.float32))
+    if query_vector is not None and vectors.shape[1]:
+        q = np.asarray(query_vector, dtype=np.float32)
+        q /= np.linalg.norm(q) or 1.0
+        has_vector = np.linalg.norm(vectors, axis=1) > 0
+        cosine = vectors @ q
+        relevance = np.where(has_vector, cosine, cosine[has_vector].min() if has_vector.any() else 0.0)
+    similarity = vectors @ vectors.T if vectors.shape[1] else np.zeros((n, n), dtype=np.float32)
+
+    doc_of = np.array([int(h.get("doc_id", -1)) for h in hits])
+    available = np.ones(n, dtype=bool)
+    max_sim = np.full(n, -np.inf, dtype=np.float32)
+    selected: list[int] = []
+
+    def pick(mask: np.ndarray):
+        redundancy = np.where(np.isfinite(max_sim), max_sim, 0.0)
+        scores = np.where(mask & available, lambda_ * relevance - (1 - lambda_) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        if not np.isfinite(scores[best]):
+            return
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_sim, similarity[best], out=max_sim)
+
+    for doc_id in (required_doc_ids or [])[:top_k]:
+        pick(doc_of == int(doc_id))
+    while len(selected) < min(top_k, n):
+        before = len(selected)
+        pick(available)
+        if len(selected) == before:
+            break
+    return [hits[i] for i in selected]
+
+
+def _public_hit(hit: dict) -> dict:
+    return {k: v for k, v in hit.items() if k != "_vector"}
+
+
+async def _retrieve(query: str, doc_ids: list[int] | None, top_k: int):
+    # Voies vectorielle et lexicale (BM25) en parallèle, bornées par un budget de latence commun
+    limit = top_k * max(1, settings.retrieve_candidates_factor)
+    tasks = {
+        "vector": asyncio.create_task(_vector_hits(query, doc_ids, limit)),
+        "lexical": asyncio.create_task(_lexical_hits(query, doc_ids, limit)),
+    }
+    done, pending = await asyncio.wait(tasks.values(), timeout=settings.retrieve_budget_ms / 1000)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+    ranked: dict[str, list[dict]] = {}
+    query_vector = None
+    for source, task in tasks.items():
+        if task not in done:
+            _retrieval_stats[f"{source}_timeouts"] += 1
+        elif task.exception() is not None:
+            _retrieval_stats[f"{source}_errors"] += 1
+        elif source == "vector":
+            query_vector, hits, path = task.result()
+            ranked[path] = hits
+        else:
+            ranked[source] = task.result()
+    candidates = fuse_rrf(ranked, limit)
+    if candidates:
+        # Candidats sur-échantillonnés puis diversifiés (MMR), un passage par document sélectionné garanti
+        await asyncio.to_thread(_attach_cached_vectors, candidates)
+        required = doc_ids if doc_ids and len(doc_ids) > 1 else None
+        return [_public_hit(h) for h in mmr_select(candidates, query_vector, top_k, required)]
+
+    # Aucun résultat dans le budget: premiers passages des documents sélectionnés
+    refs = await asyncio.to_thread(lexical.first_chunks, doc_ids, top_k)
+    return [{**c, "sources": ["fallback"], "rrf_score": 0.0} for c in await asyncio.to_thread(_fetch_local_chunks, refs)]
+
+
+def _clone_local_vectors(chunks: list[dict], copies: list[dict]):
+    if not settings.local_vectors_enabled:
+        return
+    stored = vector_store.get_vectors([c["id"] for c in chunks if c.get("id")])
+    pairs = [(copy, stored[c["id"]]) for c, copy in zip(chunks, copies) if c.get("id") in stored]
+    if pairs:
+        vector_store.add_points([copy for copy, _ in pairs], [vector.tolist() for _, vector in pairs])
+
+
+async def clone_document_chunks(src_doc_id: int, doc_id: int, title: str) -> dict | None:
+    # Réutilise chunks, index lexical et vecteurs d'un document aux octets identiques.
+    # None si la source n'a pas de chunks; sinon un résumé, incomplet si des points Qdrant n'ont pas été copiés.
+    chunks = await asyncio.to_thread(_load_local_chunks, [src_doc_id])
+    if not chunks:
+        return None
+    copies = [
+        {**c, "id": chunk_point_id(doc_id, c["page"], c.get("chunk", 0), c["text"]), "doc_id": doc_id, "title": title, "indexed": False}
+        for c in chunks
+    ]
+    await asyncio.to_thread(_save_local_chunks, doc_id, copies)
+    await asyncio.to_thread(lexical.index_document, doc_id, [c["text"] for c in copies])
+    await asyncio.to_thread(_clone_local_vectors, chunks, copies)
+
+    copied: set[str] = set()
+    try:
+        from qdrant_client.http.models import FieldCondition, Filter, MatchValue
 
-    # 2) fallback local lexical
-    chunks = _load_local_chunks(doc_ids)
-    ranked = []
-    for ch in chunks:
-        score = _lexical_score(query, ch.get("text", ""))
-        if score > 0:
-            ranked.append((score, ch))
-    ranked.sort(key=lambda x: x[0], reverse=True)
-    if ranked:
-        return [ch for _, ch in ranked[:top_k]]
-    return chunks[:top_k]
+        flt = Filter(must=[FieldCondition(key="doc_id", match=MatchValue(value=src_doc_id))])
+        offset = None
+        while True:
+            points, offset = await qdrant().scroll(
+                collection_name=settings.qdrant_collection,
+                scroll_filter=flt,
+                limit=_ingest_batch_size(),
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            if points:
+                clones = [
+                    PointStruct(
+                        id=chunk_point_id(doc_id, p.payload["page"], p.payload.get("chunk", 0), p.payload["text"]),
+                        vector=p.vector,
+                        payload={**p.payload, "doc_id": doc_id, "title": title},
+                    )
+                    for p in points
+                ]
+                await qdrant().upsert(collection_name=settings.qdrant_collection, points=clones)
+                copied.update(str(point.id) for point in clones)
+            if offset is None:
+                break
+    except Exception:
+        # Comme à l'ingestion: la voie lexicale reste active si Qdrant est indisponible
+        pass
+    # Seuls les chunks dont le point a été copié sont indexés; les autres seront repris par un ré-indexage
+    for copy in copies:
+        copy["indexed"] = copy["id"] in copied
+    await asyncio.to_thread(_save_local_chunks, doc_id, copies)
+    invalidate_documents([doc_id])
+    vectors = sum(1 for c in copies if c["indexed"])
+    return {"chunks": len(copies), "vectors": vectors, "complete": vectors == len(copies)}
 
 
 async def remove_document_chunks(doc_id: int):
     try:
-        cp = _cache_path(doc_id)
-        if cp.exists():
-            cp.unlink()
+        await asyncio.to_thread(chunk_store.remove_document, doc_id)
     except Exception:
         pass
 
     try:
-        from qdrant_client.http.models import FieldCondition, Filter, MatchValue
+        await asyncio.to_thread(lexical.remove_document, doc_id)
+        _clear_checkpoint(doc_id)
+    except Exception:
+        pass
+    invalidate_documents([doc_id])
 
-        qdrant().delete(
-            collection_name=settings.qdrant_collection,
-            points_selector=Filter(
-                must=[FieldCondition(key="doc_id", match=MatchValue(value=doc_id))]
-            ),
-        )
+    try:
+        await _delete_document_points(doc_id)
     except Exception:
         pass
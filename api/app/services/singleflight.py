@@ -0,0 +1,39 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any
+
+
+class SingleFlight:
+    # Un seul appel en cours par clé: les appels concurrents identiques attendent le même résultat.
+    # Le travail tourne dans une tâche à part: l'annulation d'un appelant n'interrompt pas les autres.
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Task] = {}
+        self.leaders = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args) -> Any:
+        task = self._calls.get(key)
+        if task is None or task.done():
+            self.leaders += 1
+            task = asyncio.create_task(fn(*args))
+            self._calls[key] = task
+            task.add_done_callback(lambda t, k=key: self._forget(k, t))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Marque l'exception comme lue si tous les appelants ont été annulés
+            task.exception()
+
+    def stats(self) -> dict:
+        total = self.leaders + self.shared
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "shared": self.shared,
+            "shared_rate": round(self.shared / total, 3) if total else None,
+        }
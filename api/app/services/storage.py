@@ -0,0 +1,49 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from fastapi import UploadFile
+
+from app.core.config import settings
+from app.models.entities import PdfDocument
+
+
+def pdf_dir() -> Path:
+    p = Path(settings.storage_root) / "pdfs"
+    p.mkdir(parents=True, exist_ok=True)
+    return p
+
+
+def pdf_path(doc: PdfDocument) -> Path:
+    # Stockage adressé par contenu; les documents antérieurs restent rangés par nom de fichier
+    if doc.sha256:
+        return pdf_dir() / f"{doc.sha256}.pdf"
+    return pdf_dir() / doc.filename
+
+
+def _publish(tmp: Path, sha256: str) -> Path:
+    target = pdf_dir() / f"{sha256}.pdf"
+    if target.exists():
+        tmp.unlink()
+    else:
+        tmp.replace(target)
+    return target
+
+
+async def store_upload(upload: UploadFile) -> tuple[str, Path]:
+    # Écriture en flux vers un fichier temporaire, SHA-256 calculé au passage; E/S disque hors boucle
+    digest = hashlib.sha256()
+    fd, tmp_name = await asyncio.to_thread(tempfile.mkstemp, dir=pdf_dir(), suffix=".part")
+    tmp = Path(tmp_name)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := await upload.read(settings.upload_chunk_size):
+                digest.update(chunk)
+                await asyncio.to_thread(out.write, chunk)
+        sha256 = digest.hexdigest()
+        return sha256, await asyncio.to_thread(_publish, tmp, sha256)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
@@ -1,15 +1,166 @@
+import atexit
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
 
-from app.models.entities import TraceEvent
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.entities import TraceEvent, UserDailyStat
 
+logger = logging.getLogger(__name__)
 
-def log_event(db: Session, user_id: int, event_type: str, payload: dict, conversation_id: int | None = None, score: float | None = None):
-    event = TraceEvent(
-        user_id=user_id,
-        conversation_id=conversation_id,
-        event_type=event_type,
-        payload=payload,
-        score=score,
+def _rollup_key(user_id: int, event_type: str, payload: dict, created_at: datetime) -> tuple:
+    return (user_id, created_at.date(), event_type, int(bool((payload or {}).get("has_citations"))))
+
+
+def apply_rollups(db: Session, keys: Counter, sign: int = 1):
+    # Agrégats par utilisateur/jour/type incrémentés en place (upsert), lus par le dashboard
+    insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    totals: dict[tuple, list[int]] = {}
+    for (user_id, day, event_type, cited), n in keys.items():
+        row = totals.setdefault((user_id, day, event_type), [0, 0])
+        row[0] += n * sign
+        row[1] += n * cited * sign
+    for (user_id, day, event_type), (count, citations) in totals.items():
+        stmt = insert(UserDailyStat).values(
+            user_id=user_id, day=day, event_type=event_type, count=count, citations=citations
+        )
+        db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["user_id", "day", "event_type"],
+                set_={
+                    "count": UserDailyStat.count + stmt.excluded.count,
+                    "citations": UserDailyStat.citations + stmt.excluded.citations,
+                },
+            )
+        )
+
+
+def _write_events(db: Session, events: list[dict]):
+    db.add_all([TraceEvent(**e) for e in events])
+    apply_rollups(
+        db,
+        Counter(_rollup_key(e["user_id"], e["event_type"], e["payload"], e["created_at"]) for e in events),
     )
-    db.add(event)
     db.commit()
+
+
+class TraceWriter:
+    # Tampon en mémoire vidé par lots (taille ou délai) dans un thread dédié: une seule transaction par lot
+    def __init__(self):
+        self._pending: list[dict] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._failures = 0
+        self.dropped = 0
+        # Un seul hook de sortie par writer, quel que soit le nombre de redémarrages (lifespan, tests)
+        atexit.register(self.stop)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+
+    def _trim(self):
+        # Appelé sous _lock: base indisponible trop longtemps, les plus anciennes traces sont sacrifiées
+        overflow = len(self._pending) - max(1, settings.trace_max_pending)
+        if overflow > 0:
+            del self._pending[:overflow]
+            self.dropped += overflow
+
+    def submit(self, event: dict):
+        with self._lock:
+            self._pending.append(event)
+            self._trim()
+            full = len(self._pending) >= settings.trace_batch_size
+        if full:
+            self._wake.set()
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return
+            try:
+                with SessionLocal() as db:
+                    _write_events(db, batch)
+                self._failures = 0
+                return
+            except Exception:
+                self._failures += 1
+            if self._failures < max(1, settings.trace_max_retries):
+                # On garde le lot pour le prochain vidage plutôt que de perdre les traces
+                with self._lock:
+                    self._pending = batch + self._pending
+                    self._trim()
+                return
+            # Échecs répétés: ligne par ligne, pour qu'une trace invalide ne bloque pas les suivantes
+            self._failures = 0
+            self._write_rows(batch)
+
+    def _write_rows(self, batch: list[dict]):
+        for event in batch:
+            try:
+                with SessionLocal() as db:
+                    _write_events(db, [event])
+            except Exception:
+                self.dropped += 1
+                logger.warning("Trace %s abandonnée après échecs répétés", event.get("event_type"), exc_info=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(timeout=settings.trace_flush_interval_seconds)
+            self._wake.clear()
+            self.flush()
+
+
+trace_writer = TraceWriter()
+
+
+def log_event(db: Session, user_id: int, event_type: str, payload: dict, conversation_id: int | None = None, score: float | None = None):
+    event = {
+        "user_id": user_id,
+        "conversation_id": conversation_id,
+        "event_type": event_type,
+        "payload": payload,
+        "score": score,
+        "created_at": datetime.utcnow(),
+    }
+    if trace_writer.running and not settings.trace_sync:
+        trace_writer.submit(event)
+        return
+    _write_events(db, [event])
+
+
+def discard_events(db: Session, query):
+    # Supprime des événements en retirant leur contribution aux agrégats
+    trace_writer.flush()
+    events = query.all()
+    apply_rollups(db, Counter(_rollup_key(e.user_id, e.event_type, e.payload, e.created_at) for e in events), sign=-1)
+    query.delete(synchronize_session=False)
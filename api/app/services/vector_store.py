@@ -0,0 +1,298 @@
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Copie locale des embeddings: matrice mappée en mémoire (float16 ou int8, vecteurs normalisés)
+# et table id de point -> (doc_id, page, ligne). Sert de recherche sémantique de secours sans Qdrant.
+_write_lock = threading.Lock()
+_ready_paths: set[str] = set()
+_loaded: dict = {"key": None}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS vec_points (
+    point_id TEXT PRIMARY KEY,
+    doc_id INTEGER NOT NULL,
+    page INTEGER NOT NULL,
+    row INTEGER NOT NULL UNIQUE
+);
+CREATE INDEX IF NOT EXISTS ix_vec_points_doc ON vec_points (doc_id);
+CREATE TABLE IF NOT EXISTS vec_meta (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    dim INTEGER NOT NULL,
+    dtype TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO vec_meta (id, dim, dtype, rows, version) VALUES (1, 0, '', 0, 0);
+"""
+
+
+def _store_dir() -> Path:
+    p = Path(settings.storage_root) / "vectors"
+    p.mkdir(parents=True, exist_ok=True)
+    return p
+
+
+def _matrix_path() -> Path:
+    return _store_dir() / "vectors.bin"
+
+
+def _connect() -> sqlite3.Connection:
+    path = _store_dir() / "vectors.sqlite3"
+    conn = sqlite3.connect(str(path), timeout=30)
+    if str(path) not in _ready_paths:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        _ready_paths.add(str(path))
+    return conn
+
+
+@contextmanager
+def _session():
+    conn = _connect()
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _dtype(name: str) -> np.dtype:
+    return np.dtype(np.int8 if name == "int8" else np.float16)
+
+
+def _encode(vectors: np.ndarray, dtype_name: str) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+    if dtype_name == "int8":
+        return np.clip(np.rint(unit * 127), -127, 127).astype(np.int8)
+    return unit.astype(np.float16)
+
+
+def _meta(conn: sqlite3.Connection) -> tuple[int, str, int, int]:
+    return conn.execute("SELECT dim, dtype, rows, version FROM vec_meta WHERE id = 1").fetchone()
+
+
+def _update_loaded(version_before: int, version_after: int, update):
+    # Appelé après commit: l'état en mémoire est dérivé de l'ancien sans relire toute la table.
+    # S'il n'était pas à jour (ou vide), il sera simplement rechargé au prochain _load.
+    key = (str(_matrix_path()), version_before)
+    state = _loaded.get("state")
+    if _loaded["key"] != key or state is None:
+        _loaded.update(key=None, state=None)
+        return
+    _loaded.update(key=(str(_matrix_path()), version_after), state=update(state))
+
+
+def _with_appended(state: dict, appended: list[tuple], rows: int) -> dict:
+    return {
+        **state,
+        "matrix": np.memmap(_matrix_path(), dtype=_dtype(state["dtype"]), mode="r", shape=(rows, state["matrix"].shape[1])),
+        "rows": np.concatenate([state["rows"], np.array([a[3] for a in appended], dtype=np.int64)]),
+        "point_ids": state["point_ids"] + [a[0] for a in appended],
+        "doc_ids": np.concatenate([state["doc_ids"], np.array([a[1] for a in appended], dtype=np.int64)]),
+    }
+
+
+def _without(state: dict, keep: np.ndarray) -> dict:
+    return {
+        **state,
+        "rows": state["rows"][keep],
+        "point_ids": [pid for pid, kept in zip(state["point_ids"], keep) if kept],
+        "doc_ids": state["doc_ids"][keep],
+    }
+
+
+def add_points(chunks: list[dict], vectors: list[list[float]]):
+    # Upsert: un point déjà présent est réécrit à sa ligne, les nouveaux sont ajoutés en fin de matrice
+    if not chunks:
+        return
+    matrix = np.asarray(vectors, dtype=np.float32)
+    with _write_lock:
+        with _session() as conn:
+            dim, dtype_name, rows, version = _meta(conn)
+            if not dim:
+                dtype_name = settings.local_vectors_dtype
+                conn.execute("UPDATE vec_meta SET dim = ?, dtype = ? WHERE id = 1", (matrix.shape[1], dtype_name))
+            elif dim != matrix.shape[1]:
+                # Autre modèle d'embedding: on refuse plutôt que d'effacer la copie locale existante
+                logger.warning(
+                    "Vecteurs de dimension %s refusés (copie locale en %s); supprimer %s pour la reconstruire",
+                    matrix.shape[1], dim, _store_dir(),
+                )
+                return
+            encoded = _encode(matrix, dtype_name)
+            existing = dict(
+                conn.execute(
+                    f"SELECT point_id, row FROM vec_points WHERE point_id IN ({','.join('?' * len(chunks))})",
+                    [c["id"] for c in chunks],
+                ).fetchall()
+            )
+            itemsize = encoded.shape[1] * encoded.itemsize
+            path = _matrix_path()
+            with path.open("r+b" if path.exists() else "wb") as fh:
+                appended = []
+                for chunk, row_vector in zip(chunks, encoded):
+                    row = existing.get(chunk["id"])
+                    if row is None:
+                        row = rows + len(appended)
+                        appended.append((chunk["id"], int(chunk["doc_id"]), int(chunk["page"]), row))
+                    fh.seek(row * itemsize)
+                    fh.write(row_vector.tobytes())
+            conn.executemany("INSERT INTO vec_points (point_id, doc_id, page, row) VALUES (?, ?, ?, ?)", appended)
+            conn.execute("UPDATE vec_meta SET rows = rows + ?, version = version + 1 WHERE id = 1", (len(appended),))
+        _update_loaded(version, version + 1, lambda state: _with_appended(state, appended, rows + len(appended)))
+
+
+def get_vectors(point_ids: list[str]) -> dict[str, np.ndarray]:
+    state = _load()
+    if state is None or not point_ids:
+        return {}
+    with _session() as conn:
+        rows = conn.execute(
+            f"SELECT point_id, row FROM vec_points WHERE point_id IN ({','.join('?' * len(point_ids))})", point_ids
+        ).fetchall()
+    return {pid: _decode_rows(state, np.array([row]))[0] for pid, row in rows if row < state["matrix"].shape[0]}
+
+
+def remove_points(point_ids: list[str]):
+    # Les lignes libérées restent dans le fichier jusqu'au prochain compactage
+    if not point_ids:
+        return
+    removed = set(point_ids)
+    with _write_lock:
+        with _session() as conn:
+            version = _meta(conn)[3]
+            for i in range(0, len(point_ids), 500):
+                part = point_ids[i : i + 500]
+                conn.execute(f"DELETE FROM vec_points WHERE point_id IN ({','.join('?' * len(part))})", part)
+            conn.execute("UPDATE vec_meta SET version = version + 1 WHERE id = 1")
+            compacted = _maybe_compact(conn)
+        if compacted:
+            _loaded.update(key=None, state=None)
+        else:
+            _update_loaded(
+                version,
+                version + 1,
+                lambda state: _without(state, np.array([pid not in removed for pid in state["point_ids"]], dtype=bool)),
+            )
+
+
+def remove_document(doc_id: int):
+    with _write_lock:
+        with _session() as conn:
+            version = _meta(conn)[3]
+            conn.execute("DELETE FROM vec_points WHERE doc_id = ?", (doc_id,))
+            conn.execute("UPDATE vec_meta SET version = version + 1 WHERE id = 1")
+            compacted = _maybe_compact(conn)
+        if compacted:
+            _loaded.update(key=None, state=None)
+        else:
+            _update_loaded(version, version + 1, lambda state: _without(state, state["doc_ids"] != doc_id))
+
+
+def _maybe_compact(conn: sqlite3.Connection) -> bool:
+    dim, dtype_name, rows, _ = _meta(conn)
+    live = conn.execute("SELECT COUNT(*) FROM vec_points").fetchone()[0]
+    if not dim or rows - live <= max(settings.local_vectors_compact_min_rows, live):
+        return False
+    dtype = _dtype(dtype_name)
+    path = _matrix_path()
+    old = np.memmap(path, dtype=dtype, mode="r", shape=(rows, dim)) if rows else np.zeros((0, dim), dtype)
+    points = conn.execute("SELECT point_id, row FROM vec_points ORDER BY row").fetchall()
+    tmp = path.with_suffix(".tmp")
+    with tmp.open("wb") as fh:
+        for start in range(0, len(points), 4096):
+            part = points[start : start + 4096]
+            fh.write(np.ascontiguousarray(old[[row for _, row in part]]).tobytes())
+    del old
+    conn.executemany("UPDATE vec_points SET row = -1 - ? WHERE point_id = ?", [(i, pid) for i, (pid, _) in enumerate(points)])
+    conn.execute("UPDATE vec_points SET row = -1 - row")
+    conn.execute("UPDATE vec_meta SET rows = ?, version = version + 1 WHERE id = 1", (len(points),))
+    tmp.replace(path)
+    return True
+
+
+def _load() -> dict | None:
+    # Matrice mappée + table des lignes gardées en mémoire tant que la version ne change pas
+    with _session() as conn:
+        dim, dtype_name, rows, version = _meta(conn)
+        key = (str(_matrix_path()), version)
+        if _loaded["key"] == key:
+            return _loaded["state"]
+        if not dim or not rows or not _matrix_path().exists():
+            _loaded.update(key=key, state=None)
+            return None
+        points = conn.execute("SELECT row, point_id, doc_id FROM vec_points ORDER BY row").fetchall()
+    row_index = np.array([p[0] for p in points], dtype=np.int64)
+    state = {
+        "matrix": np.memmap(_matrix_path(), dtype=_dtype(dtype_name), mode="r", shape=(rows, dim)),
+        "dtype": dtype_name,
+        "rows": row_index,
+        "point_ids": [p[1] for p in points],
+        "doc_ids": np.array([p[2] for p in points], dtype=np.int64),
+    }
+    _loaded.update(key=key, state=state)
+    return state
+
+
+def _decode_rows(state: dict, rows: np.ndarray) -> np.ndarray:
+    block = np.asarray(state["matrix"][rows], dtype=np.float32)
+    return block / 127.0 if state["dtype"] == "int8" else block
+
+
+def search(query_vector: list[float], doc_ids: list[int] | None = None, top_k: int = 4) -> list[dict]:
+    # Cosinus par force brute (vecteurs stockés normalisés), masque sur doc_id, par blocs pour borner la mémoire
+    state = _load()
+    if state is None:
+        return []
+    q = np.asarray(query_vector, dtype=np.float32)
+    if q.shape[0] != state["matrix"].shape[1]:
+        return []
+    q /= np.linalg.norm(q) or 1.0
+    candidates = np.arange(len(state["rows"]))
+    if doc_ids:
+        candidates = candidates[np.isin(state["doc_ids"], np.asarray(doc_ids, dtype=np.int64))]
+    if not len(candidates):
+        return []
+
+    scores = np.empty(len(candidates), dtype=np.float32)
+    block = max(1, settings.local_vectors_block_rows)
+    for start in range(0, len(candidates), block):
+        part = candidates[start : start + block]
+        scores[start : start + len(part)] = _decode_rows(state, state["rows"][part]) @ q
+    k = min(top_k, len(scores))
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best])]
+    return [
+        {"point_id": state["point_ids"][candidates[i]], "doc_id": int(state["doc_ids"][candidates[i]]), "score": float(scores[i])}
+        for i in best
+    ]
+
+
+def indexed_doc_ids() -> set[int]:
+    with _session() as conn:
+        return {row[0] for row in conn.execute("SELECT DISTINCT doc_id FROM vec_points")}
+
+
+def stats() -> dict:
+    with _session() as conn:
+        dim, dtype_name, rows, version = _meta(conn)
+        live = conn.execute("SELECT COUNT(*) FROM vec_points").fetchone()[0]
+    path = _matrix_path()
+    return {
+        "points": live,
+        "rows": rows,
+        "dim": dim,
+        "dtype": dtype_name or settings.local_vectors_dtype,
+        "bytes": path.stat().st_size if path.exists() else 0,
+        "version": version,
+    }
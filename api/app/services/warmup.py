@@ -0,0 +1,116 @@
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.entities import TraceEvent
+from app.services import ollama
+
+
+# Préchargement des modèles Ollama: au démarrage, puis pendant les heures de cours pour les
+# modèles réellement utilisés (événements chat_turn récents), afin d'éviter le chargement à froid.
+_scheduler: asyncio.Task | None = None
+_state: dict = {"last_run": None, "models": [], "errors": {}}
+_ttft: dict[str, dict] = {
+    "cold": {"count": 0, "total_ms": 0.0, "max_ms": 0.0},
+    "warm": {"count": 0, "total_ms": 0.0, "max_ms": 0.0},
+}
+
+
+def _minutes(value: str) -> int:
+    hours, minutes = value.strip().split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def _parse_class_hours() -> tuple[int, int]:
+    start, end = settings.ollama_class_hours.split("-")
+    return _minutes(start), _minutes(end)
+
+
+def in_class_hours(now: datetime | None = None) -> bool:
+    now = now or datetime.now()
+    days = {int(d) for d in settings.ollama_class_days.split(",") if d.strip()}
+    if now.weekday() not in days:
+        return False
+    start, end = _parse_class_hours()
+    minutes = now.hour * 60 + now.minute
+    return start <= minutes < end
+
+
+def popular_chat_models(limit: int | None = None) -> list[str]:
+    limit = limit or settings.ollama_warm_models_max
+    since = datetime.utcnow() - timedelta(days=settings.ollama_warm_lookback_days)
+    with SessionLocal() as db:
+        payloads = (
+            db.query(TraceEvent.payload)
+            .filter(TraceEvent.event_type == "chat_turn", TraceEvent.created_at >= since)
+            .order_by(TraceEvent.id.desc())
+            .limit(1000)
+            .all()
+        )
+    counts = Counter((payload or {}).get("model") or settings.ollama_chat_model for (payload,) in payloads)
+    models = [model for model, _ in counts.most_common(limit)]
+    return models or [settings.ollama_chat_model]
+
+
+async def warm_models(chat_models: list[str], keep_alive: str | None = None) -> dict:
+    targets = [(model, False) for model in chat_models] + [(settings.ollama_embedding_model, True)]
+    results = await asyncio.gather(
+        *(ollama.warm_model(model, embedding=embedding, keep_alive=keep_alive) for model, embedding in targets),
+        return_exceptions=True,
+    )
+    loaded, errors = {}, {}
+    for (model, _), result in zip(targets, results):
+        if isinstance(result, Exception):
+            errors[model] = str(result)
+        else:
+            loaded[model] = round(result, 1)
+    _state.update(last_run=datetime.utcnow().isoformat(), models=list(loaded), errors=errors)
+    return loaded
+
+
+async def _scheduler_loop():
+    if settings.ollama_warmup_on_startup:
+        await warm_models([settings.ollama_chat_model])
+    while True:
+        await asyncio.sleep(settings.ollama_warm_interval_seconds)
+        if in_class_hours() and ollama.breaker.state == "closed":
+            models = await asyncio.to_thread(popular_chat_models)
+            await warm_models(models, keep_alive=settings.ollama_warm_keep_alive)
+
+
+async def start_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = asyncio.create_task(_scheduler_loop())
+
+
+async def stop_scheduler():
+    global _scheduler
+    if _scheduler is not None:
+        _scheduler.cancel()
+        await asyncio.gather(_scheduler, return_exceptions=True)
+        _scheduler = None
+
+
+def record_ttft(ttft_ms: float, load_ms: float) -> bool:
+    # Démarrage à froid: Ollama a dû (re)charger le modèle pour ce tour
+    cold = load_ms >= settings.ollama_cold_start_threshold_ms
+    bucket = _ttft["cold" if cold else "warm"]
+    bucket["count"] += 1
+    bucket["total_ms"] += ttft_ms
+    bucket["max_ms"] = max(bucket["max_ms"], ttft_ms)
+    return cold
+
+
+def stats() -> dict:
+    ttft = {
+        kind: {
+            "count": b["count"],
+            "avg_ms": round(b["total_ms"] / b["count"], 1) if b["count"] else None,
+            "max_ms": round(b["max_ms"], 1),
+        }
+        for kind, b in _ttft.items()
+    }
+    return {**_state, "class_hours": in_class_hours(), "ttft": ttft}
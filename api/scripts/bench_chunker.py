@@ -0,0 +1,76 @@
+import argparse
+import math
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.core.config import settings  # noqa: E402
+from app.services.chunking import chunk_pages  # noqa: E402
+from app.services.rag import chunk_text, extract_pdf_pages  # noqa: E402
+
+WORDS = (
+    "élève séance échauffement passe réception coopération opposition motricité évaluation critère "
+    "réussite consigne situation apprentissage handball basket volley course endurance rythme "
+    "espace partenaire adversaire règle sécurité progression objectif compétence"
+).split()
+
+
+def synthetic_pages(n_pages: int, seed: int = 7) -> list[tuple[int, str]]:
+    rng = random.Random(seed)
+    pages = []
+    for page in range(1, n_pages + 1):
+        paragraphs = []
+        # Quelques pages presque vides (titres, schémas) comme dans les guides réels
+        for _ in range(1 if rng.random() < 0.2 else rng.randint(3, 6)):
+            sentences = [
+                " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 22))).capitalize() + "."
+                for _ in range(rng.randint(2, 6))
+            ]
+            paragraphs.append(" ".join(sentences))
+        pages.append((page, "\n\n".join(paragraphs)))
+    return pages
+
+
+def measure(name: str, pages: list[tuple[int, str]], chunk, repeat: int) -> dict:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        chunks = chunk(pages)
+    elapsed = (time.perf_counter() - started) / repeat
+    source_chars = sum(len(text) for _, text in pages)
+    embedded_chars = sum(len(c) for c in chunks)
+    # Chunk terminé sur un caractère alphanumérique: coupé en plein mot ou en pleine phrase
+    cut_words = sum(1 for c in chunks if c[-1:].isalnum())
+    return {
+        "chunker": name,
+        "chunks": len(chunks),
+        "embed_calls": math.ceil(len(chunks) / max(1, settings.ollama_embed_batch_size)),
+        "avg_tokens": round(embedded_chars / max(1, len(chunks)) / settings.context_chars_per_token, 1),
+        "duplication": round(embedded_chars / max(1, source_chars) - 1, 3),
+        "mid_word_ends": cut_words,
+        "mb_per_s": round(source_chars / 1e6 / elapsed, 2) if elapsed else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare chunk_text (fenêtre fixe) et le découpage structurel")
+    parser.add_argument("pdf", nargs="?", help="PDF à découper (sinon texte synthétique)")
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pages = extract_pdf_pages(Path(args.pdf)) if args.pdf else synthetic_pages(args.pages)
+    results = [
+        measure("window", pages, lambda ps: [c for _, text in ps for c in chunk_text(text)], args.repeat),
+        measure("structured", pages, lambda ps: [c for _, cs in chunk_pages(ps) for c in cs], args.repeat),
+    ]
+    columns = list(results[0])
+    print(" | ".join(f"{c:>13}" for c in columns))
+    for row in results:
+        print(" | ".join(f"{str(row[c]):>13}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
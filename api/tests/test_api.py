@@ -1,3 +1,5 @@
+import time
+
 from fastapi.testclient import TestClient
 
 from app.main import app
@@ -20,3 +22,169 @@ def test_artifact_versioning_with_pseudo():
     versions = client.get(f"/artefacts/{created['id']}/versions", headers=headers)
     assert versions.status_code == 200
     assert len(versions.json()) >= 2
+
+
+def test_upload_same_pdf_reuses_ready_chunks(tmp_path, monkeypatch):
+    from io import BytesIO
+
+    from pypdf import PdfWriter
+
+    from app.core.database import SessionLocal
+    from app.models.entities import PdfDocument
+    from app.services import rag
+
+    monkeypatch.setattr(rag.settings, "storage_root", str(tmp_path))
+    writer = PdfWriter()
+    writer.add_blank_page(width=100, height=123)
+    buf = BytesIO()
+    writer.write(buf)
+    headers = {"X-Pseudo": "UploadPseudo"}
+
+    first = client.post("/library/upload", headers=headers, data={"title": "Guide"}, files={"file": ("guide.pdf", buf.getvalue())})
+    assert first.status_code == 200
+    with SessionLocal() as db:
+        doc = db.get(PdfDocument, first.json()["id"])
+        doc.status = "ready"
+        db.commit()
+        doc_id, sha256 = doc.id, doc.sha256
+    rag._save_local_chunks(doc_id, [{"page": 1, "text": "passe et va", "doc_id": doc_id, "title": "Guide"}])
+
+    second = client.post("/library/upload", headers=headers, data={"title": "Guide v2"}, files={"file": ("autre.pdf", buf.getvalue())})
+    assert second.status_code == 200
+    assert second.json()["status"] == "ready"
+    with SessionLocal() as db:
+        assert db.get(PdfDocument, second.json()["id"]).sha256 == sha256
+    assert rag._load_local_chunks([second.json()["id"]])[0]["title"] == "Guide v2"
+
+
+def test_conversations_are_scoped_to_owner():
+    owner = {"X-Pseudo": "OwnerPseudo"}
+    other = {"X-Pseudo": "OtherPseudo"}
+    conv = client.post("/chat/conversations", headers=owner, json={"title": "Mon fil"}).json()
+
+    assert conv["id"] in [c["id"] for c in client.get("/chat/conversations", headers=owner).json()]
+    assert conv["id"] not in [c["id"] for c in client.get("/chat/conversations", headers=other).json()]
+    assert client.patch(f"/chat/conversations/{conv['id']}", headers=other, json={"title": "Volé"}).status_code == 404
+    assert client.patch(f"/chat/conversations/{conv['id']}", headers=owner, json={"title": "Renommé"}).json()["title"] == "Renommé"
+
+
+def test_dashboard_reads_rollups():
+    headers = {"X-Pseudo": "DashboardPseudo"}
+    before = client.get("/dashboard/me", headers=headers).json()
+    client.post("/artefacts", headers=headers, json={"title": "Plan B", "content_md": "v1"})
+    art_id = max(a["id"] for a in client.get("/artefacts", headers=headers).json())
+    client.post(f"/artefacts/{art_id}/versions", headers=headers, json={"content_md": "v2"})
+
+    me = client.get("/dashboard/me", headers=headers).json()
+    assert me["metrics"]["iterations"] == before["metrics"]["iterations"] + 1
+    assert me["timeline"][-1]["type"] == "artifact_iteration"
+    assert len(me["timeline"]) <= 50
+
+    cohort = client.get("/dashboard/cohort", headers=headers).json()
+    assert any(stats["iterations"] >= 1 for stats in cohort.values())
+
+
+def test_stream_fails_fast_with_retry_after_when_breaker_open(monkeypatch):
+    from app.services import ollama
+
+    headers = {"X-Pseudo": "BreakerPseudo"}
+    conv = client.post("/chat/conversations", headers=headers, json={"title": "Panne"}).json()
+    monkeypatch.setattr(ollama.breaker, "state", "open")
+    monkeypatch.setattr(ollama.breaker, "opened_at", time.monotonic())
+
+    r = client.post(f"/chat/conversations/{conv['id']}/stream", headers=headers, json={"content": "Bonjour"})
+    assert r.status_code == 503
+    assert int(r.headers["Retry-After"]) >= 1
+
+    # Essai half_open déjà en cours: même refus, avant l'ouverture du flux SSE
+    monkeypatch.setattr(ollama.breaker, "state", "half_open")
+    monkeypatch.setattr(ollama.breaker, "trial_in_flight", True)
+    r = client.post(f"/chat/conversations/{conv['id']}/stream", headers=headers, json={"content": "Bonjour"})
+    assert r.status_code == 503
+    assert int(r.headers["Retry-After"]) >= 1
+
+
+def test_stream_coalesces_tokens_into_frames(monkeypatch):
+    import orjson
+
+    from app.routers import chat
+
+    async def fake_check():
+        return True, None
+
+    async def fake_stream(messages, model=None):
+        for token in ["Bon", "jour", " à", " tous", "!"]:
+            yield orjson.dumps({"message": {"content": token}, "done": False}).decode()
+        yield orjson.dumps({"message": {"content": ""}, "done": True}).decode()
+
+    monkeypatch.setattr(chat, "check_ollama", fake_check)
+    monkeypatch.setattr(chat, "chat_stream", fake_stream)
+    monkeypatch.setattr(chat.settings, "sse_coalesce_ms", 10_000)
+    monkeypatch.setattr(chat.settings, "sse_coalesce_max_chars", 6)
+
+    headers = {"X-Pseudo": "StreamPseudo"}
+    conv = client.post("/chat/conversations", headers=headers, json={"title": "Flux"}).json()
+    r = client.post(f"/chat/conversations/{conv['id']}/stream", headers=headers, json={"content": "Salut", "use_rag": False})
+    frames = [orjson.loads(line[len("data: "):]) for line in r.text.split("\n\n") if line]
+
+    tokens = [f["token"] for f in frames if "token" in f]
+    assert tokens == ["Bonjour", " à tous", "!"]
+    assert frames[-1]["done"] is True
+    messages = client.get(f"/chat/conversations/{conv['id']}/messages", headers=headers).json()
+    assert messages[-1]["content"] == "Bonjour à tous!"
+
+
+def test_answer_cache_serves_similar_first_questions(monkeypatch):
+    import orjson
+
+    from app.routers import chat
+    from app.services import answer_cache
+
+    calls = []
+
+    async def fake_check():
+        return True, None
+
+    async def fake_embed(query):
+        return [1.0, 0.0] if "passe" in query else [0.0, 1.0]
+
+    async def fake_stream(messages, model=None):
+        calls.append(messages)
+        yield orjson.dumps({"message": {"content": "Passe à dix."}, "done": False}).decode()
+        yield orjson.dumps({"message": {"content": ""}, "done": True}).decode()
+
+    monkeypatch.setattr(chat, "check_ollama", fake_check)
+    monkeypatch.setattr(chat, "embed_query", fake_embed)
+    monkeypatch.setattr(chat, "chat_stream", fake_stream)
+    monkeypatch.setattr(chat.settings, "answer_cache_enabled", True)
+    answer_cache.clear()
+
+    headers = {"X-Pseudo": "CachePseudo"}
+    body = {"content": "Jeu de passe ?", "use_rag": False}
+    first = client.post("/chat/conversations", headers=headers, json={"title": "A"}).json()
+    client.post(f"/chat/conversations/{first['id']}/stream", headers=headers, json=body)
+    second = client.post("/chat/conversations", headers=headers, json={"title": "B"}).json()
+    r = client.post(f"/chat/conversations/{second['id']}/stream", headers=headers, json=body)
+
+    frames = [orjson.loads(line[len("data: "):]) for line in r.text.split("\n\n") if line]
+    assert len(calls) == 1
+    assert "".join(f.get("token", "") for f in frames) == "Passe à dix."
+    assert frames[-1]["cached"] is True
+    messages = client.get(f"/chat/conversations/{second['id']}/messages", headers=headers).json()
+    assert messages[-1]["metadata_json"]["cached"] is True
+    assert answer_cache.stats()["tokens_saved"] > 0
+
+    # Question de suivi (historique présent): pas de cache
+    client.post(f"/chat/conversations/{second['id']}/stream", headers=headers, json=body)
+    assert len(calls) == 2
+
+    # RAG en échec: réponse dégradée jamais mise en cache
+    async def failing_retrieve(query, doc_ids=None, top_k=4):
+        raise RuntimeError("qdrant down")
+
+    monkeypatch.setattr(chat, "retrieve", failing_retrieve)
+    rag_body = {"content": "Jeu de passe ?", "use_rag": True, "collection_ids": [1]}
+    for title in ("C", "D"):
+        conv = client.post("/chat/conversations", headers=headers, json={"title": title}).json()
+        client.post(f"/chat/conversations/{conv['id']}/stream", headers=headers, json=rag_body)
+    assert len(calls) == 4
@@ -0,0 +1,32 @@
+from app.core.database import SessionLocal
+from app.main import app  # noqa: F401  (crée les tables)
+from app.models.entities import Conversation, Message
+from app.services import context
+
+
+def test_history_is_packed_into_token_budget(monkeypatch):
+    monkeypatch.setattr(context.settings, "context_max_tokens", 100)
+    monkeypatch.setattr(context.settings, "context_answer_tokens", 40)
+    monkeypatch.setattr(context.settings, "context_chars_per_token", 1.0)
+
+    with SessionLocal() as db:
+        conv = Conversation(title="Budget")
+        db.add(conv)
+        db.commit()
+        for role, content in [("user", "a" * 30), ("assistant", "b" * 15), ("user", "c" * 10)]:
+            db.add(Message(conversation_id=conv.id, role=role, content=content))
+        current = Message(conversation_id=conv.id, role="user", content="question")
+        db.add(current)
+        db.commit()
+
+        messages = context.build_chat_messages(db, conv.id, "sys", current.id, "question + sources")
+
+    # 100 - 40 (réponse) - 3 (système) - 18 (message courant) = 39 tokens d'historique
+    assert [m["content"] for m in messages] == ["sys", "b" * 15, "c" * 10, "question + sources"]
+
+
+def test_fit_citations_respects_sources_budget():
+    citations = [{"title": "Guide", "page": i, "excerpt": "x" * 100} for i in range(5)]
+    kept, block = context.fit_citations(citations, budget_tokens=60)
+    assert len(kept) == 2
+    assert block.startswith("\n\nSources PDF:\n- Guide p.0")
@@ -0,0 +1,114 @@
+import asyncio
+
+from app.core.database import SessionLocal
+from app.main import app  # noqa: F401  (crée les tables)
+from app.models.entities import IngestionJob, PdfDocument, User
+from app.services import ingestion
+
+
+def _make_doc(db) -> PdfDocument:
+    user = db.query(User).filter(User.email == "ingestion-test@cope.local").first()
+    if not user:
+        user = User(email="ingestion-test@cope.local", full_name="Ingestion", role="teacher", hashed_password="x")
+        db.add(user)
+        db.commit()
+    doc = PdfDocument(title="Guide", filename="guide.pdf", uploaded_by_id=user.id, status="processing")
+    db.add(doc)
+    db.commit()
+    db.refresh(doc)
+    return doc
+
+
+def test_worker_runs_queued_job_and_records_progress(tmp_path, monkeypatch):
+    calls = []
+
+    async def fake_ingest(doc_id, path, title, on_progress=None, throttle=None):
+        calls.append(doc_id)
+        await throttle()
+        summary = {"pages_total": 4, "pages": 4, "chunks": 10, "vectors": 10, "complete": True, "error": None}
+        on_progress(summary)
+        return summary
+
+    monkeypatch.setattr(ingestion, "reindex_document", fake_ingest)
+
+    async def scenario():
+        with SessionLocal() as db:
+            doc = _make_doc(db)
+            job = ingestion.enqueue(db, doc.id, tmp_path / "guide.pdf", doc.title)
+            doc_id, job_id = doc.id, job.id
+        await ingestion.start_worker()
+        try:
+            for _ in range(100):
+                with SessionLocal() as db:
+                    if db.get(IngestionJob, job_id).status != "queued" and not ingestion._running:
+                        break
+                await asyncio.sleep(0.05)
+        finally:
+            await ingestion.stop_worker()
+        return doc_id, job_id
+
+    doc_id, job_id = asyncio.run(scenario())
+
+    assert doc_id in calls
+    with SessionLocal() as db:
+        job = db.get(IngestionJob, job_id)
+        assert db.get(PdfDocument, doc_id).status == "ready"
+        progress = ingestion.job_progress(job)
+    assert progress["job_status"] == "ready"
+    assert (progress["pages_done"], progress["pages_total"], progress["chunks_embedded"]) == (4, 4, 10)
+
+
+def test_stop_worker_returns_when_a_wake_up_races_the_cancel():
+    async def scenario():
+        await ingestion.start_worker()
+        await asyncio.sleep(0.05)
+        # Réveil juste avant l'annulation: wait_for absorbe le cancel, le drapeau d'arrêt doit suffire
+        ingestion._notify()
+        await asyncio.sleep(0)
+        await asyncio.wait_for(ingestion.stop_worker(), timeout=2)
+
+    asyncio.run(scenario())
+    assert ingestion._dispatcher is None
+
+
+def test_claim_skips_documents_with_a_running_job_and_delete_cancels_queued(tmp_path):
+    with SessionLocal() as db:
+        doc = _make_doc(db)
+        other = _make_doc(db)
+        first = ingestion.enqueue(db, doc.id, tmp_path / "a.pdf", doc.title, priority=100)
+        second = ingestion.enqueue(db, doc.id, tmp_path / "a.pdf", doc.title, priority=100)
+        third = ingestion.enqueue(db, other.id, tmp_path / "b.pdf", other.title, priority=99)
+        doc_id, job_ids = doc.id, (first.id, second.id, third.id)
+
+    assert ingestion._claim_next() == job_ids[0]
+    # Le second job du même document attend la fin du premier
+    assert ingestion._claim_next() == job_ids[2]
+
+    asyncio.run(ingestion.cancel_document_jobs(doc_id))
+    with SessionLocal() as db:
+        assert [db.get(IngestionJob, j).status for j in job_ids] == ["cancelled", "cancelled", "processing"]
+        db.get(IngestionJob, job_ids[2]).status = "ready"
+        db.commit()
+
+
+def test_failed_jobs_are_requeued_after_a_growing_delay(tmp_path, monkeypatch):
+    from datetime import datetime, timedelta
+
+    monkeypatch.setattr(ingestion.settings, "ingest_requeue_delay_seconds", 60)
+    monkeypatch.setattr(ingestion.settings, "ingest_max_attempts", 3)
+    with SessionLocal() as db:
+        docs = [_make_doc(db) for _ in range(3)]
+        jobs = [ingestion.enqueue(db, d.id, tmp_path / "a.pdf", d.title) for d in docs]
+        for job, (attempts, age) in zip(jobs, [(2, 150), (2, 90), (3, 3600)]):
+            job.status, job.attempts = "failed", attempts
+            job.finished_at = datetime.utcnow() - timedelta(seconds=age)
+        db.commit()
+        job_ids = [j.id for j in jobs]
+
+    ingestion._requeue_failed()
+    with SessionLocal() as db:
+        # 2e tentative: délai de 120 s; tentatives épuisées: plus de relance
+        assert [db.get(IngestionJob, j).status for j in job_ids] == ["queued", "failed", "failed"]
+        for j in job_ids:
+            db.get(IngestionJob, j).status = "ready"
+        db.commit()
@@ -0,0 +1,20 @@
+from app.services import lexical
+
+
+def test_normalize_terms_folds_accents_and_drops_stopwords():
+    assert lexical.normalize_terms("L'élève et la séance d'EPS") == ["eleve", "seance", "eps"]
+
+
+def test_bm25_search_ranks_and_updates_incrementally(tmp_path, monkeypatch):
+    monkeypatch.setattr(lexical.settings, "storage_root", str(tmp_path))
+    lexical.index_document(1, ["évaluation formative en badminton", "échauffement collectif"])
+    lexical.index_document(2, ["badminton: le volant, la raquette et le badminton en double"])
+
+    hits = lexical.search("Badminton évaluation", top_k=2)
+    assert [(h["doc_id"], h["seq"]) for h in hits] == [(1, 0), (2, 0)]
+
+    assert [h["doc_id"] for h in lexical.search("badminton", doc_ids=[2])] == [2]
+
+    lexical.remove_document(2)
+    assert [h["doc_id"] for h in lexical.search("badminton")] == [1]
+    assert lexical.indexed_doc_ids() == {1}
@@ -0,0 +1,208 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.services import ollama
+
+
+def _mock_embed_server(calls: list):
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = request.read().decode()
+        calls.append((request.url.path, body))
+        if request.url.path == "/api/embed":
+            inputs = json.loads(body)["input"]
+            return httpx.Response(200, json={"embeddings": [[float(len(t))] for t in inputs]})
+        return httpx.Response(404, text="not found")
+
+    return handler
+
+
+def test_embed_texts_batches_and_keeps_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(ollama.settings, "storage_root", str(tmp_path))
+    calls: list = []
+    transport = httpx.MockTransport(_mock_embed_server(calls))
+    monkeypatch.setattr(ollama, "_client", httpx.AsyncClient(transport=transport))
+    monkeypatch.setattr(ollama.settings, "ollama_embed_batch_size", 2)
+    ollama._embed_route.clear()
+
+    texts = ["a", "bbb", "cc", "dddd", "eeeee"]
+    vectors = asyncio.run(ollama.embed_texts(texts))
+
+    assert vectors == [[1.0], [3.0], [2.0], [4.0], [5.0]]
+    assert all(path == "/api/embed" for path, _ in calls)
+    assert len(calls) == 3
+    assert ollama._embed_route["endpoint"] == "embed"
+
+    # Textes vides: jamais envoyés, None à leur position pour garder l'alignement
+    assert asyncio.run(ollama.embed_texts(["a", "   ", "", "bbb"])) == [[1.0], None, None, [3.0]]
+    assert len(calls) == 3
+    assert asyncio.run(ollama.embed_texts(["  ", "ffffff"])) == [None, [6.0]]
+    assert json.loads(calls[-1][1])["input"] == ["ffffff"]
+
+
+def test_embed_batches_run_concurrently_once_route_is_known(monkeypatch):
+    active = {"now": 0, "max": 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        await asyncio.sleep(0.02)
+        active["now"] -= 1
+        inputs = json.loads(request.read().decode())["input"]
+        return httpx.Response(200, json={"embeddings": [[float(len(t))] for t in inputs]})
+
+    monkeypatch.setattr(ollama, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(ollama.settings, "embedding_cache_enabled", False)
+    monkeypatch.setattr(ollama.settings, "ollama_embed_batch_size", 1)
+    monkeypatch.setattr(ollama.settings, "ollama_embed_concurrency", 4)
+    monkeypatch.setattr(ollama, "_embed_route", {"model": "nomic-embed-text", "endpoint": "embed"})
+
+    assert asyncio.run(ollama.embed_texts(["a", "bb", "ccc", "dddd"])) == [[1.0], [2.0], [3.0], [4.0]]
+    assert active["max"] == 4
+
+
+def test_pool_stats_track_in_flight_requests(monkeypatch):
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, json={"models": [{"name": "m1"}]}))
+    monkeypatch.setattr(ollama, "_client", httpx.AsyncClient(transport=transport))
+    before = ollama.pool_stats()["requests"]
+
+    assert asyncio.run(ollama.list_models()) == ["m1"]
+
+    stats = ollama.pool_stats()
+    assert stats["requests"] == before + 1
+    assert stats["in_flight"] == 0
+    assert stats["max_connections"] == ollama.settings.ollama_pool_max_connections
+
+
+def test_embed_texts_only_sends_cache_misses(tmp_path, monkeypatch):
+    monkeypatch.setattr(ollama.settings, "storage_root", str(tmp_path))
+    calls: list = []
+    monkeypatch.setattr(ollama, "_client", httpx.AsyncClient(transport=httpx.MockTransport(_mock_embed_server(calls))))
+    ollama._embed_route.clear()
+    before = ollama.embedding_cache.stats()
+
+    asyncio.run(ollama.embed_texts(["alpha", "beta"]))
+    vectors = asyncio.run(ollama.embed_texts(["beta", "gamma!", "alpha"]))
+
+    assert vectors == [[4.0], [6.0], [5.0]]
+    assert [json.loads(body)["input"] for _, body in calls] == [["alpha", "beta"], ["gamma!"]]
+    stats = ollama.embedding_cache.stats()
+    assert stats["hits"] - before["hits"] == 2
+    assert stats["misses"] - before["misses"] == 3
+
+    # Lectures internes (MMR, synchronisation): hors statistiques
+    ollama.embedding_cache.get_many(ollama.current_embedding_model(), ["alpha", "zeta"], count=False)
+    assert ollama.embedding_cache.stats()["hits"] == stats["hits"]
+    assert ollama.embedding_cache.stats()["misses"] == stats["misses"]
+
+
+def test_circuit_breaker_opens_and_fails_fast(monkeypatch):
+    from app.services.circuit import CircuitBreaker, CircuitOpenError
+
+    attempts = []
+
+    def handler(request):
+        attempts.append(request.url.path)
+        raise httpx.ConnectError("refused")
+
+    breaker = CircuitBreaker("Ollama", failure_threshold=2, reset_seconds=30)
+    monkeypatch.setattr(ollama, "breaker", breaker)
+    monkeypatch.setattr(ollama, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(ollama.settings, "embedding_cache_enabled", False)
+
+    for _ in range(2):
+        try:
+            asyncio.run(ollama.embed_texts(["x"]))
+        except httpx.ConnectError:
+            pass
+    assert breaker.state == "open"
+
+    calls_before = len(attempts)
+    try:
+        asyncio.run(ollama.embed_texts(["x"]))
+        raise AssertionError("CircuitOpenError attendu")
+    except CircuitOpenError as exc:
+        assert exc.retry_after > 0
+    assert len(attempts) == calls_before
+
+    breaker.opened_at -= 31
+    monkeypatch.setattr(ollama, "_client", httpx.AsyncClient(transport=httpx.MockTransport(_mock_embed_server([]))))
+    ollama._embed_route.clear()
+    assert asyncio.run(ollama.embed_texts(["abc"])) == [[3.0]]
+    assert breaker.state == "closed"
+
+
+def test_successful_probe_only_half_opens_the_breaker(monkeypatch):
+    from app.services.circuit import CircuitBreaker, CircuitOpenError
+
+    breaker = CircuitBreaker("Ollama", failure_threshold=1, reset_seconds=30)
+    breaker.record_failure("timeout")
+    monkeypatch.setattr(ollama, "breaker", breaker)
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, json={"models": []}))
+    monkeypatch.setattr(ollama, "_client", httpx.AsyncClient(transport=transport))
+
+    assert asyncio.run(ollama.probe_ollama())[0] is True
+    assert breaker.state == "half_open"
+    # Un seul appel d'essai: le suivant est refusé tant qu'il n'a pas abouti
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_failure("timeout")
+    asyncio.run(ollama.probe_ollama())
+    assert breaker.state == "half_open"
+
+
+def test_warm_models_loads_chat_and_embedding_models(monkeypatch):
+    from datetime import datetime
+
+    from app.services import warmup
+
+    calls: list = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append((request.url.path, json.loads(request.read())))
+        return httpx.Response(200, json={"load_duration": 2_000_000_000})
+
+    monkeypatch.setattr(ollama, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    ollama.breaker.record_success()
+
+    loaded = asyncio.run(warmup.warm_models(["m1"], keep_alive="30m"))
+
+    assert loaded == {"m1": 2000.0, ollama.settings.ollama_embedding_model: 2000.0}
+    assert {path for path, _ in calls} == {"/api/generate", "/api/embed"}
+    assert all(body["keep_alive"] == "30m" for _, body in calls)
+
+    monkeypatch.setattr(warmup.settings, "ollama_class_hours", "08:00-18:00")
+    monkeypatch.setattr(warmup.settings, "ollama_class_days", "0,1,2,3,4")
+    assert warmup.in_class_hours(datetime(2024, 3, 4, 9, 30))
+    assert not warmup.in_class_hours(datetime(2024, 3, 4, 19, 0))
+    assert not warmup.in_class_hours(datetime(2024, 3, 9, 10, 0))
+    assert warmup.record_ttft(2500.0, 2000.0) is True
+    assert warmup.stats()["ttft"]["cold"]["count"] >= 1
+
+
+def test_concurrent_pulls_of_same_model_are_coalesced(monkeypatch):
+    pulls: list = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        pulls.append(json.loads(request.read())["name"])
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"status": "success"})
+
+    monkeypatch.setattr(ollama, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    async def run():
+        client = ollama.http_client()
+        return await asyncio.gather(
+            ollama.pull_model("m1"),
+            ollama.pull_model("m1"),
+            ollama._attempt_pull_model(client, "m1"),
+            ollama.pull_model("m2"),
+        )
+
+    results = asyncio.run(run())
+
+    assert sorted(pulls) == ["m1", "m2"]
+    assert results[0] == results[1] == {"status": "success"}
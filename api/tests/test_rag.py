@@ -1,3 +1,8 @@
+import asyncio
+
+import pytest
+
+from app.services import rag
 from app.services.rag import chunk_text
 
 
@@ -6,3 +11,470 @@ def test_chunk_text():
     chunks = chunk_text(text, chunk_size=200, overlap=50)
     assert len(chunks) > 1
     assert all(len(c) <= 200 for c in chunks)
+
+
+class _FakeQdrant:
+    def __init__(self):
+        self.exists_calls = 0
+        self.created = []
+
+    async def collection_exists(self, name):
+        self.exists_calls += 1
+        return bool(self.created)
+
+    async def create_collection(self, collection_name, vectors_config):
+        self.created.append(collection_name)
+
+
+def test_ensure_collection_is_cached(monkeypatch):
+    fake = _FakeQdrant()
+    monkeypatch.setattr(rag, "_qdrant", fake)
+    monkeypatch.setattr(rag, "_known_collections", set())
+
+    asyncio.run(rag.ensure_collection(8))
+    asyncio.run(rag.ensure_collection(8))
+
+    assert fake.exists_calls == 1
+    assert fake.created == [rag.settings.qdrant_collection]
+
+
+class _Hit:
+    def __init__(self, payload):
+        self.payload = payload
+
+
+class _SearchQdrant:
+    def __init__(self):
+        self.searches = 0
+
+    async def search(self, **kwargs):
+        self.searches += 1
+        return [_Hit({"doc_id": 3, "title": "T", "page": 1, "text": "x"})]
+
+
+def test_retrieve_caches_query_vectors_and_hits_until_invalidated(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag.settings, "storage_root", str(tmp_path))
+    embeds = []
+
+    async def fake_embed(texts):
+        embeds.append(texts)
+        return [[0.1, 0.2]]
+
+    fake = _SearchQdrant()
+    monkeypatch.setattr(rag, "embed_texts", fake_embed)
+    monkeypatch.setattr(rag, "_qdrant", fake)
+    rag._query_vectors.clear()
+    rag._retrievals.clear()
+
+    asyncio.run(rag.retrieve("Le Volley ?", [3, 1], top_k=2))
+    asyncio.run(rag.retrieve("le  volley ?", [1, 3], top_k=2))
+    assert len(embeds) == 1 and fake.searches == 1
+
+    rag.invalidate_documents([5])
+    asyncio.run(rag.retrieve("le volley ?", [1, 3], top_k=2))
+    assert fake.searches == 1
+
+    rag.invalidate_documents([3])
+    asyncio.run(rag.retrieve("le volley ?", [1, 3], top_k=2))
+    assert fake.searches == 2
+
+    # Bascule sur le modèle de secours: les vecteurs de l'autre modèle ne sont pas réutilisés
+    monkeypatch.setattr(rag, "current_embedding_model", lambda: "fallback-embed")
+    asyncio.run(rag.embed_query("le volley ?"))
+    assert len(embeds) == 2
+
+
+def test_concurrent_identical_retrievals_share_one_search(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag.settings, "storage_root", str(tmp_path))
+    embeds = []
+
+    async def slow_embed(texts):
+        embeds.append(texts)
+        await asyncio.sleep(0.05)
+        return [[0.3, 0.4]]
+
+    fake = _SearchQdrant()
+    monkeypatch.setattr(rag, "embed_texts", slow_embed)
+    monkeypatch.setattr(rag, "_qdrant", fake)
+    rag._query_vectors.clear()
+    rag._retrievals.clear()
+
+    async def classroom():
+        return await asyncio.gather(*(rag.retrieve("Règles du handball", [2, 3], top_k=2) for _ in range(30)))
+
+    results = asyncio.run(classroom())
+
+    assert len(embeds) == 1 and fake.searches == 1
+    assert all(r == results[0] for r in results)
+    assert results[0] is not results[1]
+
+
+def test_retrieve_fuses_paths_and_cancels_slow_vector_search(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag.settings, "storage_root", str(tmp_path))
+    chunks = [
+        {"doc_id": 9, "title": "Basket", "page": 1, "text": "dribble et passe en basket"},
+        {"doc_id": 9, "title": "Basket", "page": 2, "text": "tir en course"},
+    ]
+    rag._save_local_chunks(9, chunks)
+    rag.lexical.index_document(9, [c["text"] for c in chunks])
+    rag._query_vectors.clear()
+    rag._retrievals.clear()
+
+    class _VectorQdrant:
+        async def search(self, **kwargs):
+            return [_Hit(chunks[1]), _Hit(chunks[0])]
+
+    async def fast_embed(texts):
+        return [[0.5, 0.5]]
+
+    monkeypatch.setattr(rag, "_qdrant", _VectorQdrant())
+    monkeypatch.setattr(rag, "embed_texts", fast_embed)
+    hits = asyncio.run(rag.retrieve("passe basket", [9], top_k=2))
+    assert hits[0]["text"] == chunks[0]["text"]
+    assert hits[0]["sources"] == ["vector", "lexical"]
+    assert hits[1]["sources"] == ["vector"]
+
+    async def stuck_embed(texts):
+        await asyncio.sleep(5)
+
+    monkeypatch.setattr(rag, "embed_texts", stuck_embed)
+    monkeypatch.setattr(rag.settings, "retrieve_budget_ms", 100)
+    before = rag.cache_stats()["retrieval_paths"]["vector_timeouts"]
+    hits = asyncio.run(rag.retrieve("tir course", [9], top_k=2))
+    assert [h["sources"] for h in hits] == [["lexical"]]
+    assert rag.cache_stats()["retrieval_paths"]["vector_timeouts"] == before + 1
+
+
+def test_iter_page_chunks_streams_pages_in_order_from_process_pool(tmp_path, monkeypatch):
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for _ in range(7):
+        writer.add_blank_page(width=200, height=200)
+    pdf = tmp_path / "doc.pdf"
+    with pdf.open("wb") as f:
+        writer.write(f)
+
+    monkeypatch.setattr(rag.settings, "pdf_extract_workers", 2)
+    monkeypatch.setattr(rag.settings, "pdf_parallel_min_pages", 4)
+    monkeypatch.setattr(rag.settings, "pdf_pages_per_task", 3)
+    rag.start_extraction_pool()
+    try:
+
+        async def collect():
+            return [item async for item in rag.iter_page_chunks(pdf)]
+
+        pages = asyncio.run(collect())
+    finally:
+        rag.close_extraction_pool()
+
+    assert pages == [(i, []) for i in range(1, 8)]
+
+
+class _UpsertQdrant:
+    def __init__(self):
+        self.upserted = []
+        self.deleted = []
+        self.points = set()
+
+    async def collection_exists(self, name):
+        return True
+
+    async def upsert(self, collection_name, points):
+        self.upserted.extend(p.payload["text"] for p in points)
+        self.points.update(str(p.id) for p in points)
+
+    async def retrieve(self, collection_name, ids, with_payload=True, with_vectors=False):
+        from types import SimpleNamespace
+
+        if getattr(self, "down", False):
+            raise ConnectionError("qdrant down")
+        return [SimpleNamespace(id=i) for i in ids if i in self.points]
+
+    async def delete(self, collection_name, points_selector):
+        self.deleted.append(points_selector)
+
+
+def test_ingest_pipeline_resumes_from_last_committed_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag.settings, "storage_root", str(tmp_path))
+    monkeypatch.setattr(rag.settings, "ingest_batch_size", 2)
+    monkeypatch.setattr(rag.settings, "ingest_batch_retries", 0)
+    monkeypatch.setattr(rag, "_known_collections", set())
+    fake = _UpsertQdrant()
+    monkeypatch.setattr(rag, "_qdrant", fake)
+
+    async def fake_count(path):
+        return 3
+
+    async def fake_pages(path, n_pages=None):
+        for page in range(1, 4):
+            yield page, [f"p{page}a", f"p{page}b"]
+
+    failing = {"on": True}
+
+    async def fake_embed(texts):
+        if failing["on"] and "p2a" in texts:
+            raise RuntimeError("ollama down")
+        return [[1.0, 0.0] for _ in texts]
+
+    monkeypatch.setattr(rag, "count_pdf_pages", fake_count)
+    monkeypatch.setattr(rag, "iter_page_chunks", fake_pages)
+    monkeypatch.setattr(rag, "embed_texts", fake_embed)
+
+    first = asyncio.run(rag.ingest_document(9, tmp_path / "x.pdf", "Doc"))
+    assert first["complete"] is False and first["chunks"] == 6 and first["vectors"] == 2
+    assert fake.upserted == ["p1a", "p1b"]
+    assert [c["text"] for c in rag._load_local_chunks([9])] == ["p1a", "p1b", "p2a", "p2b", "p3a", "p3b"]
+
+    failing["on"] = False
+    second = asyncio.run(rag.ingest_document(9, tmp_path / "x.pdf", "Doc"))
+    assert second["complete"] is True and second["vectors"] == 6
+    assert fake.upserted == ["p1a", "p1b", "p2a", "p2b", "p3a", "p3b"]
+    assert rag._load_checkpoint(9) == 0
+
+
+def test_failed_ingestion_keeps_lexical_index_consistent_with_chunks(tmp_path, monkeypatch):
+    from app.services import lexical
+
+    monkeypatch.setattr(rag.settings, "storage_root", str(tmp_path))
+    monkeypatch.setattr(rag, "_known_collections", set())
+    monkeypatch.setattr(rag, "_qdrant", _UpsertQdrant())
+    pages = {1: ["dribble croisé"], 2: ["tir en course"]}
+
+    async def fake_count(path):
+        return len(pages)
+
+    async def fake_pages(path, n_pages=None):
+        for page, texts in pages.items():
+            if texts is None:
+                raise RuntimeError("pdf illisible")
+            yield page, list(texts)
+
+    async def fake_embed(texts):
+        return [[1.0, 0.0] for _ in texts]
+
+    monkeypatch.setattr(rag, "count_pdf_pages", fake_count)
+    monkeypatch.setattr(rag, "iter_page_chunks", fake_pages)
+    monkeypatch.setattr(rag, "embed_texts", fake_embed)
+    asyncio.run(rag.ingest_document(6, tmp_path / "x.pdf", "Basket"))
+
+    # Extraction interrompue: chunks publiés et index lexical gardent tous deux l'ancienne version
+    pages.update({1: ["passe à terre"], 2: None})
+    with pytest.raises(RuntimeError):
+        asyncio.run(rag.ingest_document(6, tmp_path / "x.pdf", "Basket"))
+    refs = lexical.search("tir course", doc_ids=[6])
+    assert [c["text"] for c in rag._fetch_local_chunks(refs)] == ["tir en course"]
+
+
+def test_reindex_only_embeds_changed_chunks_and_deletes_vanished(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag.settings, "storage_root", str(tmp_path))
+    monkeypatch.setattr(rag, "_known_collections", set())
+    fake = _UpsertQdrant()
+    monkeypatch.setattr(rag, "_qdrant", fake)
+    pages = {1: ["intro"], 2: ["echauffement", "jeu"], 3: ["bilan"]}
+    embedded = []
+
+    async def fake_count(path):
+        return len(pages)
+
+    async def fake_pages(path, n_pages=None):
+        for page, texts in pages.items():
+            yield page, list(texts)
+
+    async def fake_embed(texts):
+        embedded.extend(texts)
+        return [[1.0, 0.0] for _ in texts]
+
+    monkeypatch.setattr(rag, "count_pdf_pages", fake_count)
+    monkeypatch.setattr(rag, "iter_page_chunks", fake_pages)
+    monkeypatch.setattr(rag, "embed_texts", fake_embed)
+
+    first = asyncio.run(rag.reindex_document(4, tmp_path / "x.pdf", "Doc"))
+    assert first["complete"] and embedded == ["intro", "echauffement", "jeu", "bilan"]
+    ids = {c["text"]: c["id"] for c in rag._load_local_chunks([4])}
+    assert ids["jeu"] == rag.chunk_point_id(4, 2, 1, "jeu")
+
+    embedded.clear()
+    pages[2] = ["echauffement", "jeu modifie"]
+    second = asyncio.run(rag.reindex_document(4, tmp_path / "x.pdf", "Doc"))
+
+    assert embedded == ["jeu modifie"]
+    assert second["reused"] == 3 and second["deleted"] == 1 and second["vectors"] == 4
+    assert fake.deleted[-1].points == [ids["jeu"]]
+    assert [c["text"] for c in rag._load_local_chunks([4])] == ["intro", "echauffement", "jeu modifie", "bilan"]
+
+
+def test_reindex_embeds_chunks_never_vectorized_or_missing_from_qdrant(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag.settings, "storage_root", str(tmp_path))
+    monkeypatch.setattr(rag.settings, "ingest_batch_retries", 0)
+    monkeypatch.setattr(rag, "_known_collections", set())
+    fake = _UpsertQdrant()
+    monkeypatch.setattr(rag, "_qdrant", fake)
+    failing = {"on": True}
+
+    async def fake_count(path):
+        return 1
+
+    async def fake_pages(path, n_pages=None):
+        yield 1, ["passe", "tir"]
+
+    async def fake_embed(texts):
+        if failing["on"]:
+            raise RuntimeError("ollama down")
+        return [[1.0, 0.0] for _ in texts]
+
+    monkeypatch.setattr(rag, "count_pdf_pages", fake_count)
+    monkeypatch.setattr(rag, "iter_page_chunks", fake_pages)
+    monkeypatch.setattr(rag, "embed_texts", fake_embed)
+
+    # Échec avant le premier lot validé: la reprise doit tout vectoriser
+    first = asyncio.run(rag.reindex_document(2, tmp_path / "x.pdf", "Doc"))
+    assert first["complete"] is False and first["vectors"] == 0
+    failing["on"] = False
+    second = asyncio.run(rag.reindex_document(2, tmp_path / "x.pdf", "Doc"))
+    assert second["complete"] is True and fake.upserted == ["passe", "tir"]
+
+    # Collection vidée entre-temps: les chunks marqués indexés sont revectorisés
+    fake.points.clear()
+    third = asyncio.run(rag.reindex_document(2, tmp_path / "x.pdf", "Doc"))
+    assert third["complete"] is True and third["reused"] == 0
+    assert fake.upserted == ["passe", "tir", "passe", "tir"]
+
+
+def test_reindex_publishes_new_text_when_qdrant_is_down(tmp_path, monkeypatch):
+    from app.services import lexical
+
+    monkeypatch.setattr(rag.settings, "storage_root", str(tmp_path))
+    monkeypatch.setattr(rag.settings, "ingest_batch_retries", 0)
+    monkeypatch.setattr(rag, "_known_collections", set())
+    fake = _UpsertQdrant()
+    monkeypatch.setattr(rag, "_qdrant", fake)
+    pages = {1: ["dribble croisé"], 2: ["tir en course"]}
+
+    async def fake_count(path):
+        return len(pages)
+
+    async def fake_pages(path, n_pages=None):
+        for page, texts in pages.items():
+            yield page, list(texts)
+
+    async def fake_embed(texts):
+        return [[1.0, 0.0] for _ in texts]
+
+    monkeypatch.setattr(rag, "count_pdf_pages", fake_count)
+    monkeypatch.setattr(rag, "iter_page_chunks", fake_pages)
+    monkeypatch.setattr(rag, "embed_texts", fake_embed)
+    asyncio.run(rag.reindex_document(8, tmp_path / "x.pdf", "Basket"))
+
+    fake.down = True
+    pages[2] = ["contre-attaque rapide"]
+    failed = asyncio.run(rag.reindex_document(8, tmp_path / "x.pdf", "Basket"))
+    assert failed["error"].startswith("qdrant")
+    refs = lexical.search("contre-attaque", doc_ids=[8])
+    assert [c["text"] for c in rag._fetch_local_chunks(refs)] == ["contre-attaque rapide"]
+    assert rag._load_local_chunks([8])[1]["indexed"] is False
+
+    # Qdrant revenu: purge des points orphelins puis ré-ingestion complète
+    fake.down = False
+    fake.deleted.clear()
+    fixed = asyncio.run(rag.reindex_document(8, tmp_path / "x.pdf", "Basket"))
+    assert fixed["complete"] is True and len(fake.deleted) == 1
+    assert fake.upserted[-2:] == ["dribble croisé", "contre-attaque rapide"]
+
+
+def test_clone_marks_copies_unindexed_when_qdrant_copy_fails(tmp_path, monkeypatch):
+    from types import SimpleNamespace
+
+    monkeypatch.setattr(rag.settings, "storage_root", str(tmp_path))
+    monkeypatch.setattr(rag, "_known_collections", set())
+    fake = _UpsertQdrant()
+
+    async def scroll(collection_name, scroll_filter, limit, offset, with_payload, with_vectors):
+        if getattr(fake, "down", False):
+            raise ConnectionError("qdrant down")
+        payload = {"page": 1, "chunk": 0, "text": "passe décisive", "doc_id": 3}
+        return [SimpleNamespace(payload=payload, vector=[1.0, 0.0])], None
+
+    fake.scroll = scroll
+    monkeypatch.setattr(rag, "_qdrant", fake)
+    source = {"id": rag.chunk_point_id(3, 1, 0, "passe décisive"), "doc_id": 3, "page": 1, "chunk": 0,
+              "text": "passe décisive", "title": "Basket", "indexed": True}
+    rag._save_local_chunks(3, [source])
+    assert asyncio.run(rag.clone_document_chunks(99, 4, "Copie")) is None
+
+    fake.down = True
+    summary = asyncio.run(rag.clone_document_chunks(3, 4, "Copie"))
+    assert summary == {"chunks": 1, "vectors": 0, "complete": False}
+    assert rag._load_local_chunks([4])[0]["indexed"] is False
+
+    fake.down = False
+    summary = asyncio.run(rag.clone_document_chunks(3, 5, "Copie"))
+    assert summary == {"chunks": 1, "vectors": 1, "complete": True}
+    assert rag._load_local_chunks([5])[0].get("indexed", True) is True
+
+
+def test_structured_chunker_keeps_sentences_and_joins_short_pages():
+    from app.services.chunking import chunk_pages
+
+    sentence = "Les élèves enchaînent passe et réception en mouvement."
+    pages = [(1, " ".join([sentence] * 6)), (2, "Schéma"), (3, "\n\n".join([sentence] * 4))]
+
+    result = chunk_pages(pages, target_tokens=30, max_tokens=40, overlap_segments=0)
+
+    assert [page for page, _ in result] == [1, 2, 3]
+    chunks = [c for _, cs in result for c in cs]
+    assert all(c.endswith(".") or c.endswith("Schéma") for c in chunks)
+    # La page 2 (quasi vide) est jointe au début de la page 3
+    assert len(result[1][1]) == 1 and result[1][1][0].startswith("Schéma\n\n" + sentence)
+    assert sum(c.count(sentence) for c in chunks) == 10
+
+
+def test_mmr_skips_near_duplicates_and_covers_required_documents():
+    import numpy as np
+
+    def hit(doc_id, text, vector):
+        return {"doc_id": doc_id, "page": 1, "text": text, "_vector": np.asarray(vector, dtype=np.float32)}
+
+    hits = [
+        hit(1, "a", [1.0, 0.2, 0.0]),
+        hit(1, "a bis", [1.0, 0.21, 0.0]),
+        hit(1, "b", [0.5, 1.0, 0.0]),
+        hit(2, "c", [0.2, 0.0, 1.0]),
+    ]
+    query = [1.0, 0.3, 0.0]
+
+    assert [h["text"] for h in rag.mmr_select(hits, query, top_k=2, lambda_=1.0)] == ["a bis", "a"]
+    assert [h["text"] for h in rag.mmr_select(hits, query, top_k=2, lambda_=0.5)] == ["a bis", "b"]
+    picked = rag.mmr_select(hits, query, top_k=2, required_doc_ids=[1, 2], lambda_=0.5)
+    assert [h["doc_id"] for h in picked] == [1, 2]
+
+
+def test_chunk_store_migrates_json_and_fetches_by_id(tmp_path, monkeypatch):
+    import json
+
+    from app.services import chunk_store
+
+    monkeypatch.setattr(rag.settings, "storage_root", str(tmp_path))
+    legacy = [rag._chunk_record(3, "Basket", 1, 0, "dribble"), rag._chunk_record(3, "Basket", 2, 0, "tir en course")]
+    (tmp_path / "chunks").mkdir()
+    (tmp_path / "chunks" / "3.json").write_text(json.dumps(legacy), encoding="utf-8")
+
+    assert rag.migrate_local_chunks() == 1
+    assert not (tmp_path / "chunks" / "3.json").exists()
+    assert chunk_store.doc_ids() == [3]
+
+    # Écriture en préparation: invisible jusqu'au commit, puis remplace le document entier
+    writer = chunk_store.DocumentWriter(4, "Volley")
+    writer.write([rag._chunk_record(4, "Volley", 1, 0, "manchette")])
+    assert chunk_store.doc_ids() == [3]
+    writer.commit()
+
+    by_id = chunk_store.fetch_ids([legacy[1]["id"]])
+    assert by_id[legacy[1]["id"]]["text"] == "tir en course"
+    assert [c["title"] for c in rag._load_local_chunks([4])] == ["Volley"]
+    assert [c["text"] for c in rag._fetch_local_chunks([{"doc_id": 3, "seq": 1}, {"doc_id": 4, "seq": 0}])] == [
+        "tir en course",
+        "manchette",
+    ]
+    chunk_store.remove_document(3)
+    assert chunk_store.doc_ids() == [4]
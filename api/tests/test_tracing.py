@@ -0,0 +1,91 @@
+from app.core.database import SessionLocal
+from app.main import app  # noqa: F401  (crée les tables)
+from app.models.entities import TraceEvent, User
+from app.services import tracing
+from app.services.tracing import TraceWriter, log_event
+
+
+def _user_id(db) -> int:
+    user = db.query(User).filter(User.email == "tracing-test@cope.local").first()
+    if not user:
+        user = User(email="tracing-test@cope.local", full_name="Tracing", role="student", hashed_password="x")
+        db.add(user)
+        db.commit()
+    return user.id
+
+
+def _count(db, user_id: int) -> int:
+    return db.query(TraceEvent).filter(TraceEvent.user_id == user_id, TraceEvent.event_type == "trace_test").count()
+
+
+def test_log_event_is_buffered_and_flushed_in_batches(monkeypatch):
+    writer = TraceWriter()
+    monkeypatch.setattr(tracing, "trace_writer", writer)
+    monkeypatch.setattr(tracing.settings, "trace_flush_interval_seconds", 60)
+    monkeypatch.setattr(tracing.settings, "trace_batch_size", 1000)
+
+    with SessionLocal() as db:
+        user_id = _user_id(db)
+        before = _count(db, user_id)
+
+        writer.start()
+        for i in range(3):
+            log_event(db, user_id, "trace_test", {"i": i})
+        assert writer.pending() == 3
+        assert _count(db, user_id) == before
+
+        writer.stop()
+        assert writer.pending() == 0
+        assert _count(db, user_id) == before + 3
+
+
+def test_log_event_sync_mode_writes_immediately(monkeypatch):
+    writer = TraceWriter()
+    monkeypatch.setattr(tracing, "trace_writer", writer)
+    monkeypatch.setattr(tracing.settings, "trace_sync", True)
+    writer.start()
+    try:
+        with SessionLocal() as db:
+            user_id = _user_id(db)
+            before = _count(db, user_id)
+            log_event(db, user_id, "trace_test", {})
+            assert _count(db, user_id) == before + 1
+    finally:
+        writer.stop()
+
+
+def test_failing_trace_is_dropped_after_retries_and_buffer_is_capped(monkeypatch):
+    writer = TraceWriter()
+    written = []
+
+    def fake_write(db, events):
+        if any(e["payload"].get("bad") for e in events):
+            raise ValueError("contrainte violée")
+        written.extend(e["payload"]["i"] for e in events)
+
+    monkeypatch.setattr(tracing, "_write_events", fake_write)
+    monkeypatch.setattr(tracing.settings, "trace_max_retries", 2)
+    monkeypatch.setattr(tracing.settings, "trace_max_pending", 3)
+
+    for i in range(2):
+        writer.submit({"event_type": "trace_test", "payload": {"i": i, "bad": i == 0}})
+    writer.flush()
+    assert writer.pending() == 2 and written == []
+    writer.flush()
+    assert writer.pending() == 0 and written == [1] and writer.dropped == 1
+
+    for i in range(5):
+        writer.submit({"event_type": "trace_test", "payload": {"i": i}})
+    assert writer.pending() == 3 and writer.dropped == 3
+
+
+def test_restarting_writer_registers_a_single_exit_hook(monkeypatch):
+    registered = []
+    monkeypatch.setattr(tracing.atexit, "register", registered.append)
+    monkeypatch.setattr(tracing.settings, "trace_flush_interval_seconds", 60)
+
+    writer = TraceWriter()
+    for _ in range(3):
+        writer.start()
+        writer.stop()
+    assert registered == [writer.stop]
@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from app.services import rag, vector_store
+
+
+def _chunk(point_id, doc_id, page=1):
+    return {"id": point_id, "doc_id": doc_id, "page": page}
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_local_search_masks_documents_and_compacts(tmp_path, monkeypatch, dtype):
+    monkeypatch.setattr(vector_store.settings, "storage_root", str(tmp_path))
+    monkeypatch.setattr(vector_store.settings, "local_vectors_dtype", dtype)
+    monkeypatch.setattr(vector_store.settings, "local_vectors_compact_min_rows", 0)
+
+    vector_store.add_points(
+        [_chunk("a", 1), _chunk("b", 1), _chunk("c", 2)],
+        [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.9, 0.1, 0.0]],
+    )
+    assert [m["point_id"] for m in vector_store.search([1.0, 0.05, 0.0], top_k=2)] == ["a", "c"]
+    assert [m["point_id"] for m in vector_store.search([1.0, 0.05, 0.0], doc_ids=[2])] == ["c"]
+
+    # Upsert sur place, puis suppression et compactage de la matrice
+    vector_store.add_points([_chunk("a", 1)], [[0.0, 0.0, 1.0]])
+    assert vector_store.stats()["rows"] == 3
+    vector_store.remove_document(1)
+    stats = vector_store.stats()
+    assert stats["points"] == stats["rows"] == 1
+    match = vector_store.search([1.0, 0.0, 0.0], top_k=3)
+    assert [m["point_id"] for m in match] == ["c"]
+    assert match[0]["score"] == pytest.approx(0.9 / (0.82**0.5), abs=0.01)
+
+
+def test_retrieve_falls_back_to_local_vectors_when_qdrant_is_down(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag.settings, "storage_root", str(tmp_path))
+    chunks = [rag._chunk_record(5, "Volley", 1, 0, "manchette"), rag._chunk_record(5, "Volley", 2, 0, "service smashé")]
+    rag._save_local_chunks(5, chunks)
+    vector_store.add_points(chunks, [[0.0, 1.0], [1.0, 0.0]])
+
+    class _DownQdrant:
+        async def search(self, **kwargs):
+            raise ConnectionError("qdrant down")
+
+    async def fake_embed(texts):
+        return [[0.9, 0.1]]
+
+    monkeypatch.setattr(rag, "_qdrant", _DownQdrant())
+    monkeypatch.setattr(rag, "embed_texts", fake_embed)
+    monkeypatch.setattr(rag, "_qdrant_down_until", [0.0])
+    rag._query_vectors.clear()
+    rag._retrievals.clear()
+
+    hits = asyncio.run(rag.retrieve("zzz", [5], top_k=1))
+
+    assert [(h["text"], h["sources"]) for h in hits] == [("service smashé", ["local_vector"])]
+    assert "_vector" not in hits[0]
+
+
+def test_writes_update_loaded_state_and_refuse_other_dimensions(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_store.settings, "storage_root", str(tmp_path))
+    vector_store.add_points([_chunk("a", 1), _chunk("b", 2)], [[1.0, 0.0], [0.0, 1.0]])
+    assert vector_store.search([1.0, 0.0], top_k=1)[0]["point_id"] == "a"
+
+    # Écritures suivantes: état en mémoire mis à jour (clé à la version courante), sans relire toute la table
+    assert vector_store._loaded["state"] is not None
+    vector_store.add_points([_chunk("c", 3)], [[0.6, 0.8]])
+    vector_store.remove_points(["a"])
+    key = vector_store._loaded["key"]
+    assert key is not None and key[1] == vector_store.stats()["version"]
+    assert [m["point_id"] for m in vector_store.search([1.0, 0.0], top_k=3)] == ["c", "b"]
+    vector_store.remove_document(3)
+    assert [m["point_id"] for m in vector_store.search([1.0, 0.0], top_k=3)] == ["b"]
+
+    # Autre dimension (changement de modèle): écriture refusée, copie locale intacte
+    vector_store.add_points([_chunk("d", 4)], [[1.0, 0.0, 0.0]])
+    assert vector_store.stats()["points"] == 1
+    assert vector_store.search([0.0, 1.0], top_k=1)[0]["point_id"] == "b"